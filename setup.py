@@ -26,12 +26,13 @@ setup(
     package_dir={'': 'src'}, 
     packages=find_packages(where='src'), 
     python_requires='>=3.6, <4',
-    #install_requires=['numpy', 'picosdk'],  # Optional
+    install_requires=['numpy', 'scipy', 'picosdk'],
     package_data={  
         'PicoNuclear': ['data/*.*'],
     },
     scripts=['src/bin/miniPET.py', 'src/bin/pico_capture.py', 
-             'src/bin/betagamma.py'],
+             'src/bin/betagamma.py', 'src/bin/pico_benchmark.py',
+             'src/bin/listmode2txt.py'],
     project_urls={  
         'Bug Reports': 'https://github.com/kmiernik/PicoNuclear/issues'
     }
@@ -0,0 +1,463 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Archive of raw waveforms (ADC values), stored in compressed chunks.
+
+"""
+
+import datetime
+import json
+import queue
+import struct
+import zlib
+from threading import Thread
+
+import numpy
+
+
+MAGIC = b'PNWF'
+VERSION = 1
+MAX_ADC = 32512
+# File header: magic, version, length of the JSON description
+_PREFIX = struct.Struct('<4sII')
+# Chunk header: magic, number of captures, length of settings (JSON),
+# length of the (compressed) waveforms
+_CHUNK = struct.Struct('<4sIIQ')
+_CHUNK_MAGIC = b'CHNK'
+# Trailer: offset of the index (JSON), magic
+_TRAILER = struct.Struct('<Q4s')
+_INDEX_MAGIC = b'PNWI'
+_COMPRESSION = ['none', 'zlib']
+
+
+def to_volts(values, v_range, offset, max_adc=MAX_ADC):
+    """
+    Converts ADC values to volts
+
+    * values - ADC values
+    * v_range - voltage range of the channel (V)
+    * offset - analogue offset of the channel (V)
+    * max_adc - ADC value of the full range
+    """
+    return v_range * numpy.asarray(values, dtype=numpy.float64) / max_adc \
+        - offset
+
+
+class WaveformWriter:
+    """
+    Writes captured waveforms (int16 ADC values) to an archive file
+
+    The captures are grouped in chunks of chunk_size captures, each chunk
+    holds the channel ranges and offsets, the trigger times and overflow
+    flags of its captures (uncompressed) and the waveforms, compressed
+    as a whole. The compression and the writing are done in a background
+    thread. An index of the chunks is written at the end, when the file
+    is closed. If it is missing (e.g. after a crash), the reader rebuilds
+    it by scanning the chunk headers.
+    """
+
+    def __init__(self, file_name, channels, num_samples, interval, ranges,
+                 offsets, chunk_size=1024, compression='zlib', level=1,
+                 max_adc=MAX_ADC, info=None):
+        """
+        * file_name - name of output file
+        * channels - names of channels stored (e.g. ['A', 'B'])
+        * num_samples - samples in a capture
+        * interval - sampling interval (ns)
+        * ranges - dictionary of voltage ranges of channels (V)
+        * offsets - dictionary of analogue offsets of channels (V)
+        * chunk_size - captures in a chunk
+        * compression - 'zlib' or 'none' (the reader may memory map the
+                        waveforms)
+        * level - zlib compression level (1 - fastest, 9 - smallest)
+        * max_adc - ADC value of the full range
+        * info - (optional) dictionary of information stored in the header
+                 (must be JSON serializable, e.g. configuration)
+        """
+        if compression not in _COMPRESSION:
+            raise ValueError('Compression {} is not supported'.format(
+                compression))
+        self.file_name = file_name
+        self.channels = list(channels)
+        self.num_samples = num_samples
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.level = level
+        self.captures = 0
+        header = {'channels': self.channels,
+                  'num_samples': num_samples,
+                  'interval': interval,
+                  'max_adc': max_adc,
+                  'chunk_size': chunk_size,
+                  'compression': compression,
+                  'start': datetime.datetime.now().isoformat()}
+        if info is not None:
+            header.update(info)
+        self._settings = self._channel_settings(ranges, offsets)
+
+        self._file = open(file_name, 'wb')
+        description = json.dumps(header).encode()
+        self._file.write(_PREFIX.pack(MAGIC, VERSION, len(description)))
+        self._file.write(description)
+        self._index = []
+        self._pending = []
+        self._pending_captures = 0
+        self._queue = queue.Queue(maxsize=4)
+        self._error = None
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_channel_settings(self, ranges, offsets):
+        """
+        Sets voltage ranges and offsets of channels for the next captures
+        (a new chunk is started)
+
+        * ranges - dictionary of voltage ranges of channels (V)
+        * offsets - dictionary of analogue offsets of channels (V)
+        """
+        self._flush()
+        self._settings = self._channel_settings(ranges, offsets)
+
+    def _channel_settings(self, ranges, offsets):
+        return {'ranges': [float(ranges[ch]) for ch in self.channels],
+                'offsets': [float(offsets[ch]) for ch in self.channels]}
+
+    def write(self, data, trigger_times, overflow=None):
+        """
+        Adds a batch of captures
+
+        * data - list of (captures, samples) arrays of ADC values, one per
+                 channel stored, or dictionary of them
+                 (e.g. dict(zip(scope.channels, scope.measure_adc_values())))
+        * trigger_times - trigger times of the captures (ps)
+                          (see PicoScope3000A.get_trigger_times())
+        * overflow - (optional) overflow bit masks of the captures
+                     (see PicoScope3000A.get_overflow())
+        """
+        if self._error is not None:
+            raise self._error
+        if isinstance(data, dict):
+            data = [data[ch] for ch in self.channels]
+        waveforms = numpy.stack(data, axis=1).astype(numpy.int16)
+        n = waveforms.shape[0]
+        if waveforms.shape[2] != self.num_samples:
+            raise ValueError('Captures of {} samples expected, not '
+                             '{}'.format(self.num_samples,
+                                         waveforms.shape[2]))
+        times = numpy.array(trigger_times, dtype=numpy.int64)
+        if overflow is None:
+            overflow = numpy.zeros(n, dtype=numpy.uint16)
+        overflow = numpy.array(overflow, dtype=numpy.uint16)
+
+        done = 0
+        while done < n:
+            k = min(self.chunk_size - self._pending_captures, n - done)
+            self._pending.append((waveforms[done:done + k],
+                                  times[done:done + k],
+                                  overflow[done:done + k]))
+            self._pending_captures += k
+            done += k
+            if self._pending_captures == self.chunk_size:
+                self._flush()
+        self.captures += n
+
+    def _flush(self):
+        """Hands over the captures collected to the background thread"""
+        if not self._pending:
+            return
+        waveforms, times, overflow = (numpy.concatenate(parts) for parts
+                                      in zip(*self._pending))
+        self._queue.put((self._settings, waveforms, times, overflow))
+        self._pending = []
+        self._pending_captures = 0
+
+    def _run(self):
+        """Compression and writing loop of the background thread"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self._write_chunk(*item)
+            except (OSError, zlib.error) as err:
+                self._error = err
+
+    def _write_chunk(self, settings, waveforms, times, overflow):
+        settings = json.dumps(settings).encode()
+        payload = waveforms.tobytes()
+        if self.compression == 'zlib':
+            payload = zlib.compress(payload, self.level)
+        offset = self._file.tell()
+        self._file.write(_CHUNK.pack(_CHUNK_MAGIC, waveforms.shape[0],
+                                     len(settings), len(payload)))
+        self._file.write(settings)
+        self._file.write(times.tobytes())
+        self._file.write(overflow.tobytes())
+        self._file.write(payload)
+        self._file.flush()
+        self._index.append(offset)
+
+    def close(self):
+        """Writes all remaining captures and the index, closes the file"""
+        if self._file.closed:
+            return
+        self._flush()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is None:
+            index_offset = self._file.tell()
+            self._file.write(json.dumps(self._index).encode())
+            self._file.write(_TRAILER.pack(index_offset, _INDEX_MAGIC))
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+class _Chunk:
+    """Location and settings of a chunk of an archive"""
+
+    def __init__(self, first, size, settings, times, data, data_bytes):
+        self.first = first
+        self.size = size
+        self.settings = settings
+        self.times = times
+        self.data = data
+        self.data_bytes = data_bytes
+
+
+class WaveformArchive:
+    """
+    Reads archive written by WaveformWriter
+
+    Only the header and the chunk headers are read when the archive is
+    opened. The waveforms are read (and decompressed) chunk by chunk when
+    requested, uncompressed archives are memory mapped, so any slice of a
+    large archive is read without loading the rest of it.
+
+    Captures are selected with an index or a slice, e.g.
+    archive[1000:2000] returns (1000, channels, samples) array of ADC
+    values. See also read(), read_volts() and trigger_times().
+    """
+
+    def __init__(self, file_name):
+        """
+        * file_name - name of archive
+        """
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+        magic, version, length = _PREFIX.unpack(
+                self._file.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a waveform archive'.format(
+                file_name))
+        if version > VERSION:
+            raise ValueError('Waveform archive version {} is not '
+                             'supported'.format(version))
+        self.header = json.loads(self._file.read(length).decode())
+        self.channels = self.header['channels']
+        self.num_samples = self.header['num_samples']
+        self.interval = self.header['interval']
+        self.compression = self.header['compression']
+        self._capture_bytes = 2 * len(self.channels) * self.num_samples
+
+        offsets = self._read_index()
+        if offsets is None:
+            offsets = self._scan(_PREFIX.size + length)
+        self._chunks = []
+        first = 0
+        for offset in offsets:
+            chunk = self._read_chunk_header(offset, first)
+            if chunk is None:
+                break
+            self._chunks.append(chunk)
+            first += chunk.size
+        self._starts = numpy.array([chunk.first for chunk in self._chunks]
+                                   + [first], dtype=numpy.int64)
+        self._cached = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def _read_index(self):
+        """Returns offsets of chunks from the index, None if missing"""
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        if size < _TRAILER.size:
+            return None
+        self._file.seek(size - _TRAILER.size)
+        index_offset, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if magic != _INDEX_MAGIC or index_offset >= size:
+            return None
+        self._file.seek(index_offset)
+        return json.loads(self._file.read(
+            size - _TRAILER.size - index_offset).decode())
+
+    def _scan(self, offset):
+        """Returns offsets of chunks found by following chunk headers"""
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        offsets = []
+        while offset + _CHUNK.size <= size:
+            self._file.seek(offset)
+            magic, n, settings_bytes, data_bytes = _CHUNK.unpack(
+                    self._file.read(_CHUNK.size))
+            if magic != _CHUNK_MAGIC:
+                break
+            end = offset + _CHUNK.size + settings_bytes + 10 * n + data_bytes
+            if end > size:
+                break
+            offsets.append(offset)
+            offset = end
+        return offsets
+
+    def _read_chunk_header(self, offset, first):
+        """Returns description of chunk at offset"""
+        self._file.seek(offset)
+        magic, n, settings_bytes, data_bytes = _CHUNK.unpack(
+                self._file.read(_CHUNK.size))
+        if magic != _CHUNK_MAGIC:
+            return None
+        settings = json.loads(self._file.read(settings_bytes).decode())
+        times = offset + _CHUNK.size + settings_bytes
+        return _Chunk(first, n, settings, times, times + 10 * n, data_bytes)
+
+    def _chunk_waveforms(self, i):
+        """Returns (captures, channels, samples) waveforms of chunk i"""
+        if self._cached[0] == i:
+            return self._cached[1]
+        chunk = self._chunks[i]
+        shape = (chunk.size, len(self.channels), self.num_samples)
+        if self.compression == 'none':
+            waveforms = numpy.memmap(self.file_name, dtype=numpy.int16,
+                                     mode='r', offset=chunk.data,
+                                     shape=shape)
+        else:
+            self._file.seek(chunk.data)
+            waveforms = numpy.frombuffer(
+                    zlib.decompress(self._file.read(chunk.data_bytes)),
+                    dtype=numpy.int16).reshape(shape)
+        self._cached = (i, waveforms)
+        return waveforms
+
+    def _chunk_range(self, start, stop):
+        """Yields chunk index, range in chunk and range in output of
+        captures start to stop"""
+        first = numpy.searchsorted(self._starts, start, side='right') - 1
+        position = 0
+        for i in range(max(first, 0), len(self._chunks)):
+            chunk = self._chunks[i]
+            if chunk.first >= stop:
+                break
+            a = max(start - chunk.first, 0)
+            b = min(stop - chunk.first, chunk.size)
+            yield i, a, b, position
+            position += b - a
+
+    def _slice(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('Only contiguous slices are supported')
+            return start, max(stop, start)
+        index = int(key)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Capture {} is out of range'.format(key))
+        return index, index + 1
+
+    def __getitem__(self, key):
+        start, stop = self._slice(key)
+        waveforms = self.read(start, stop)
+        if not isinstance(key, slice):
+            return waveforms[0]
+        return waveforms
+
+    def read(self, start=0, stop=None, channels=None):
+        """
+        Returns waveforms of captures start to stop (ADC values)
+
+        * start, stop - range of captures
+        * channels - (optional) names of channels returned (default all)
+        * returns (captures, channels, samples) int16 array
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        channels = self.channels if channels is None else list(channels)
+        columns = [self.channels.index(ch) for ch in channels]
+        out = numpy.empty((max(stop - start, 0), len(columns),
+                           self.num_samples), dtype=numpy.int16)
+        for i, a, b, position in self._chunk_range(start, stop):
+            waveforms = self._chunk_waveforms(i)
+            out[position:position + b - a] = waveforms[a:b][:, columns]
+        return out
+
+    def read_volts(self, start=0, stop=None, channels=None):
+        """
+        Returns waveforms of captures start to stop in volts, converted
+        with ranges and offsets of the channels at the time of capture
+
+        * start, stop, channels - see read()
+        * returns (captures, channels, samples) float array
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        channels = self.channels if channels is None else list(channels)
+        columns = [self.channels.index(ch) for ch in channels]
+        out = self.read(start, stop, channels).astype(numpy.float64)
+        for i, a, b, position in self._chunk_range(start, stop):
+            settings = self._chunks[i].settings
+            ranges = numpy.array(settings['ranges'])[columns]
+            offsets = numpy.array(settings['offsets'])[columns]
+            out[position:position + b - a] = to_volts(
+                    out[position:position + b - a],
+                    ranges[:, numpy.newaxis], offsets[:, numpy.newaxis],
+                    self.header['max_adc'])
+        return out
+
+    def trigger_times(self, start=0, stop=None):
+        """Returns trigger times (ps) of captures start to stop"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self._read_column(start, stop, 'times', numpy.int64)
+
+    def overflow(self, start=0, stop=None):
+        """Returns overflow bit masks of captures start to stop"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return self._read_column(start, stop, 'overflow', numpy.uint16)
+
+    def _read_column(self, start, stop, name, dtype):
+        out = numpy.empty(max(stop - start, 0), dtype=dtype)
+        for i, a, b, position in self._chunk_range(start, stop):
+            chunk = self._chunks[i]
+            offset = chunk.times
+            if name == 'overflow':
+                offset += 8 * chunk.size
+            self._file.seek(offset + a * out.itemsize)
+            out[position:position + b - a] = numpy.frombuffer(
+                    self._file.read((b - a) * out.itemsize), dtype=dtype)
+        return out
+
+    def settings(self, capture):
+        """Returns dictionary of voltage ranges and offsets of channels
+        at the time of the capture"""
+        start, stop = self._slice(capture)
+        i = numpy.searchsorted(self._starts, start, side='right') - 1
+        settings = self._chunks[i].settings
+        return {'ranges': dict(zip(self.channels, settings['ranges'])),
+                'offsets': dict(zip(self.channels, settings['offsets']))}
@@ -0,0 +1,272 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Throughput benchmark of the data processing chain, run against the
+simulated device (no hardware needed).
+
+"""
+
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy
+
+import PicoNuclear.events as events
+import PicoNuclear.tools as tools
+from PicoNuclear.histograms import Histogram
+from PicoNuclear.listmode import ListModeWriter
+from PicoNuclear.simulator import SimulatedPicoScope
+
+
+STAGES = ['readout', 'amplitude', 'timing', 'coincidence', 'histogram',
+          'output']
+
+REPORT_VERSION = 1
+
+
+def _stage_stats(durations):
+    """
+    Returns latency summary of a stage
+
+    * durations - list of durations (s), one per batch
+    * returns dictionary with mean, median, 90th and 99th percentile and
+              maximum (ms)
+    """
+    d = numpy.array(durations) * 1e3
+    p50, p90, p99 = numpy.percentile(d, [50, 90, 99])
+    return {'mean': float(d.mean()), 'p50': float(p50), 'p90': float(p90),
+            'p99': float(p99), 'max': float(d.max())}
+
+
+def _make_scope(config, pileup, seed):
+    """
+    Returns simulated device set up as given in configuration
+
+    * config - configuration (see tools.load_configuration())
+    * pileup - probability of a random pulse piled up in a capture
+    * seed - seed of the random number generator
+    """
+    channels = config['channels']
+    num_channels = 4 if set(channels) - {'A', 'B'} else 2
+    s = SimulatedPicoScope(num_channels=num_channels, seed=seed)
+    falling = config['trigger']['direction'] == 'FALLING'
+    for ch in channels:
+        s.set_channel(ch, coupling_type=config[ch]['coupling'],
+                      range_value=config[ch]['range'],
+                      offset=config[ch]['offset'])
+        s.set_source(ch, lines=[(0.2 * config[ch]['range'], 1.0),
+                                (0.4 * config[ch]['range'], 0.5)],
+                     polarity=-1 if falling else 1, pileup=pileup)
+    s.set_trigger(config['trigger']['source'],
+                  threshold=config['trigger']['threshold'],
+                  direction=config['trigger']['direction'])
+    return s
+
+
+def run_case(config, num_samples, num_captures, pileup, num_batches=20,
+             seed=0):
+    """
+    Runs the processing chain of miniPET on simulated data and measures
+    time spent in each stage
+
+    Stages (for each batch of captures):
+        o 'readout' - readout and conversion (measure_relative_adc())
+        o 'amplitude' - amplitudes (tools.amplitude_batch())
+        o 'timing' - times (tools.zero_crossing_batch())
+        o 'coincidence' - event building (events.build_events())
+        o 'histogram' - spectra of amplitudes and time differences
+                        (histograms.Histogram)
+        o 'output' - events written to a list-mode file
+                     (listmode.ListModeWriter, the time of queueing each
+                     batch plus an equal share of the final flush in
+                     close(), as the writing is done in a background
+                     thread)
+
+    The captures are synthesized before the measurement and replayed,
+    so the synthesis does not count to the readout time. One warm-up
+    batch (e.g. compilation of the numba backend) is processed first
+    and not counted.
+
+    * config - configuration (see tools.load_configuration())
+    * num_samples - trace length (samples)
+    * num_captures - captures in a batch
+    * pileup - probability of a random pulse piled up in a capture
+    * num_batches - number of batches processed
+    * seed - seed of the random number generator
+    * returns dictionary with parameters of the case, throughput
+              (captures and events per second) and latency summary of
+              each stage (see _stage_stats())
+    """
+    channels = config['channels']
+    num_pre = min(config['pre'], num_samples // 4)
+    num_post = num_samples - num_pre
+    timebase = config['timebase']
+
+    s = _make_scope(config, pileup, seed)
+    clock = s.get_interval_from_timebase(timebase, num_samples)
+    recorded = s.measure_adc_values(num_pre, num_post, timebase,
+                                    num_captures * min(num_batches, 8))
+    s.replay({ch: V.copy() for ch, V in zip(s.channels, recorded)
+              if V is not None})
+
+    spectra = [Histogram([0, config['ch_range']], config['ch_range'])
+               for ch in channels]
+    dt_spectrum = Histogram([-config['t_range'] / 2, config['t_range'] / 2],
+                            config['t_range'])
+    window = config.get('coin', 0.0) or 100 * clock
+    durations = {stage: [] for stage in STAGES}
+    n_events = 0
+
+    out_file = tempfile.NamedTemporaryFile(suffix='.lmd', delete=False)
+    out_file.close()
+    writer = ListModeWriter(out_file.name, events.event_dtype(channels))
+    try:
+        for batch in range(num_batches + 1):
+            t0 = time.perf_counter()
+            t, data = s.measure_relative_adc(num_pre, num_post, timebase,
+                                             num_captures, inverse=True)
+            data = dict(zip(s.channels, data))
+            data = [data[ch] for ch in channels]
+            t1 = time.perf_counter()
+            amplitudes = [tools.amplitude_batch(V, config[ch], clock, 'max')
+                          for ch, V in zip(channels, data)]
+            t2 = time.perf_counter()
+            times = [tools.zero_crossing_batch(V, config[ch]['filter']['B'],
+                                               falling=False) * clock
+                     for ch, V in zip(channels, data)]
+            t3 = time.perf_counter()
+            hits = numpy.empty(num_captures * len(data),
+                               dtype=tools.HIT_DTYPE)
+            hits['capture'] = numpy.tile(numpy.arange(num_captures),
+                                         len(data))
+            hits['channel'] = numpy.repeat(numpy.arange(len(data)),
+                                           num_captures)
+            hits['amplitude'] = numpy.concatenate(amplitudes)
+            hits['time'] = numpy.concatenate(times)
+            hits['overflow'] = False
+            coin, singles = events.build_events(hits, window, channels)
+            t4 = time.perf_counter()
+            for ch, spectrum in zip(channels, spectra):
+                spectrum.fill(coin[ch])
+            if len(channels) > 1:
+                dt_spectrum.fill(coin['t' + channels[1]]
+                                 - coin['t' + channels[0]])
+            t5 = time.perf_counter()
+            writer.write(coin)
+            t6 = time.perf_counter()
+
+            if batch == 0:
+                continue
+            n_events += coin.shape[0] + singles.shape[0]
+            for stage, dt in zip(STAGES, [t1 - t0, t2 - t1, t3 - t2,
+                                          t4 - t3, t5 - t4, t6 - t5]):
+                durations[stage].append(dt)
+        t0 = time.perf_counter()
+        writer.close()
+        flush = (time.perf_counter() - t0) / num_batches
+        durations['output'] = [dt + flush for dt in durations['output']]
+    finally:
+        writer.close()
+        os.remove(out_file.name)
+
+    total = numpy.sum([durations[stage] for stage in STAGES], axis=0)
+    return {'num_samples': num_samples,
+            'num_captures': num_captures,
+            'pileup': pileup,
+            'num_batches': num_batches,
+            'captures_per_s': num_captures * num_batches / total.sum(),
+            'events_per_s': n_events / total.sum(),
+            'stages': {stage: _stage_stats(durations[stage])
+                       for stage in STAGES},
+            'total': _stage_stats(total)}
+
+
+def run_benchmark(config, trace_lengths=(512, 2048), captures=(16, 256),
+                  pileups=(0.0, 0.1), num_batches=20, seed=0,
+                  progress=False):
+    """
+    Runs run_case() for all combinations of trace lengths, capture counts
+    and pileup probabilities
+
+    * config - configuration (see tools.load_configuration())
+    * trace_lengths - trace lengths (samples)
+    * captures - captures in a batch
+    * pileups - probabilities of a random pulse piled up in a capture
+    * num_batches - number of batches processed in each case
+    * seed - seed of the random number generator
+    * progress - if True, progress bar is shown
+    * returns report, dictionary with description of the environment and
+              list of results of all cases (JSON serializable)
+    """
+    cases = [(n, c, p) for n in trace_lengths for c in captures
+             for p in pileups]
+    results = []
+    t_start = time.perf_counter()
+    for i, (n, c, p) in enumerate(cases):
+        results.append(run_case(config, n, c, p, num_batches, seed))
+        if progress:
+            tools.progress_bar(i + 1, len(cases),
+                               time.perf_counter() - t_start)
+    if progress:
+        print()
+    return {'version': REPORT_VERSION,
+            'date': datetime.datetime.now().isoformat(),
+            'environment': {'python': platform.python_version(),
+                            'numpy': numpy.__version__,
+                            'backend': tools.get_backend(),
+                            'machine': platform.machine(),
+                            'system': platform.platform(),
+                            'cpus': os.cpu_count()},
+            'results': results}
+
+
+def save_report(report, file_name):
+    """Saves report (see run_benchmark()) to a JSON file"""
+    with open(file_name, 'w') as out_file:
+        json.dump(report, out_file, indent=2)
+
+
+def load_report(file_name):
+    """Loads report saved with save_report()"""
+    with open(file_name) as in_file:
+        return json.load(in_file)
+
+
+def compare_reports(reference, report, percentile='p50'):
+    """
+    Compares latencies of cases present in both reports
+
+    * reference - reference report (e.g. of the previous release)
+    * report - new report
+    * percentile - latency summary compared ('mean', 'p50', 'p90', ...)
+    * returns list of (case, stage, reference latency, new latency, ratio),
+              case is (num_samples, num_captures, pileup), ratio below 1
+              means the new version is faster
+    """
+    def key(result):
+        return (result['num_samples'], result['num_captures'],
+                result['pileup'])
+
+    previous = {key(result): result for result in reference['results']}
+    comparison = []
+    for result in report['results']:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for stage in STAGES + ['total']:
+            if stage == 'total':
+                t_old = old['total'][percentile]
+                t_new = result['total'][percentile]
+            elif stage in old['stages'] and stage in result['stages']:
+                t_old = old['stages'][stage][percentile]
+                t_new = result['stages'][stage][percentile]
+            else:
+                continue
+            ratio = t_new / t_old if t_old > 0 else float('inf')
+            comparison.append((key(result), stage, t_old, t_new, ratio))
+    return comparison
@@ -0,0 +1,173 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Host side buffers used for the continuous (streaming) data acquisition.
+
+"""
+
+from threading import Condition
+
+import numpy as np
+
+
+class RingBuffer:
+    """Preallocated multichannel ring buffer.
+
+    The buffer keeps all channels in a single (channels, capacity + max_read)
+    array. The first max_read samples of the ring are mirrored past its end,
+    so every read of up to max_read samples is returned as a contiguous numpy
+    view, regardless of the position of the read pointer. The writer (e.g.
+    the streaming callback) and a consumer may live in different threads.
+
+    Methods
+    -------
+    write()
+        Append new samples for all channels
+    read()
+        Return a contiguous view of the oldest unread samples
+    release()
+        Mark samples as consumed
+    close()
+        Mark the end of the data and wake up the waiting readers
+    reset()
+        Drop all data and zero the counters
+
+    """
+
+    def __init__(self, num_channels, capacity, max_read=None, dtype=np.int16):
+        """Allocate the buffer.
+
+        :param num_channels: number of channels stored
+        :param capacity: number of samples per channel kept in the ring
+        :param max_read: maximum number of samples returned by a single read,
+            defaults to a quarter of the capacity
+        :param dtype: data type of samples
+        """
+        if max_read is None:
+            max_read = max(capacity // 4, 1)
+        if not 0 < max_read <= capacity:
+            raise ValueError(f"max_read must be in range 1-{capacity}, "
+                             f"got {max_read}")
+        self.capacity = capacity
+        self.max_read = max_read
+        self._data = np.zeros((num_channels, capacity + max_read), dtype=dtype)
+        self._condition = Condition()
+        self.reset()
+
+    def reset(self):
+        """Drop all data and zero the counters."""
+        with self._condition:
+            self._written = 0
+            self._released = 0
+            self._closed = False
+            self.overruns = 0
+
+    @property
+    def available(self):
+        """Number of samples written, but not yet released."""
+        return self._written - self._released
+
+    @property
+    def closed(self):
+        """True if no more data will be written (see :method:`close`)."""
+        return self._closed
+
+    @property
+    def total_written(self):
+        """Total number of samples written since the last reset."""
+        return self._written
+
+    def write(self, chunks):
+        """Append new samples for all channels.
+
+        If there is not enough free space the oldest, not released samples
+        are overwritten and the number of lost samples is added to the
+        overruns counter.
+
+        :param chunks: sequence of 1-D arrays (one per channel) of equal
+            length
+        """
+        n = len(chunks[0])
+        if n == 0:
+            return
+        with self._condition:
+            skip = 0
+            if n > self.capacity:
+                skip = n - self.capacity
+                self._written += skip
+                n = self.capacity
+            lost = self.available + n - self.capacity
+            if lost > 0:
+                self._released += lost
+                self.overruns += lost
+            pos = self._written % self.capacity
+            first = min(n, self.capacity - pos)
+            second = n - first
+            for row, chunk in zip(self._data, chunks):
+                chunk = chunk[skip:]
+                row[pos:pos + first] = chunk[:first]
+                if pos < self.max_read:
+                    end = min(pos + first, self.max_read)
+                    row[self.capacity + pos:self.capacity + end] = \
+                        chunk[:end - pos]
+                if second > 0:
+                    row[:second] = chunk[first:]
+                    end = min(second, self.max_read)
+                    row[self.capacity:self.capacity + end] = \
+                        chunk[first:first + end]
+            self._written += n
+            self._condition.notify_all()
+
+    def read(self, num_samples=None, timeout=None):
+        """Return a contiguous view of the oldest unread samples.
+
+        The data are not consumed until :method:`release` is called, so
+        calling read again returns the same samples (and possibly more).
+        The view is valid until the samples are released or overwritten.
+
+        :param num_samples: number of samples required, if None all available
+            samples (but not more than max_read) are returned
+        :param timeout: maximum time to wait for the data in seconds, None
+            waits forever
+
+        After :method:`close` the read does not wait, the remaining samples
+        are returned (possibly fewer than num_samples) and then an empty
+        view (0 samples) marks the end of the data.
+
+        :returns: index of the first sample since reset and a view of
+            shape (channels, samples), or None, None on timeout
+        """
+        if num_samples is not None and num_samples > self.max_read:
+            raise ValueError(f"Cannot read more than {self.max_read} "
+                             "samples at once")
+        needed = 1 if num_samples is None else num_samples
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self.available >= needed or self._closed,
+                    timeout):
+                return None, None
+            if num_samples is None or self.available < num_samples:
+                num_samples = min(self.available, self.max_read)
+            start = self._released
+            pos = start % self.capacity
+            return start, self._data[:, pos:pos + num_samples]
+
+    def release(self, num_samples):
+        """Mark the oldest samples as consumed.
+
+        :param num_samples: number of samples to release
+        """
+        with self._condition:
+            self._released += min(num_samples, self.available)
+
+    def close(self):
+        """Mark the end of the data and wake up the waiting readers.
+
+        Called by the writer when no more samples will come (e.g. the
+        acquisition stopped or failed), so readers waiting in
+        :method:`read` return instead of waiting for the timeout.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
@@ -0,0 +1,142 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Event builder, groups hits from many channels into coincidence events.
+
+"""
+
+import numpy
+
+
+def event_dtype(channels=('A', 'B')):
+    """
+    Returns dtype of events built from the given channels
+
+    * channels - names of channels
+    * returns numpy dtype with fields
+        o 'capture' - capture number of the first hit of the event
+        o 'time' - time of the first hit of the event
+        o 'mask' - bit mask of channels present in the event (bit 0 for
+                   the first channel etc.)
+        o for each channel: amplitude (field named after the channel, e.g.
+          'A') and time (e.g. 'tA'), both are 0 if the channel is not
+          present in the event
+    """
+    fields = [('capture', numpy.int32), ('time', numpy.float64),
+              ('mask', numpy.uint8)]
+    for ch in channels:
+        fields.append((ch, numpy.float32))
+        fields.append(('t' + ch, numpy.float64))
+    return numpy.dtype(fields)
+
+
+def build_events(hits, window, channels=('A', 'B'), per_capture=True):
+    """
+    Groups hits from all channels into coincidence events
+
+    The hits are sorted by time and merged: an event starts with the
+    earliest free hit and takes the first hit of every other channel
+    closer than window to it, so all hits in an event are within the
+    window. Every hit belongs to exactly one event, hits not matched
+    with any other channel are returned as singles. The merge is done
+    in vectorized passes over the sorted hits, hits skipped in a pass
+    (e.g. pileups in the same channel) are merged in the next one.
+    With window <= 0 (no coincidences configured) every hit is a single.
+
+    * hits - structured array of hits, with fields 'capture', 'channel'
+             (index in channels), 'amplitude' and 'time'
+             (see tools.HIT_DTYPE)
+    * window - coincidence window (same units as hits time)
+    * channels - names of channels
+    * per_capture - if True, times are relative to the start of each
+                    capture and only hits from the same capture are
+                    grouped, if False times are absolute and hits from
+                    different captures may form an event
+    * returns coincidences, singles - structured arrays of events
+              (see event_dtype()), events with at least two channels
+              and with a single channel, ordered by time
+    """
+    dtype = event_dtype(channels)
+    if len(channels) > 8:
+        raise ValueError('At most 8 channels are supported')
+
+    if per_capture:
+        order = numpy.lexsort((hits['time'], hits['capture']))
+    else:
+        order = numpy.argsort(hits['time'], kind='stable')
+    remaining = hits[order]
+
+    if window <= 0:
+        singles = numpy.zeros(remaining.shape[0], dtype=dtype)
+        singles['capture'] = remaining['capture']
+        singles['time'] = remaining['time']
+        channel = remaining['channel'].astype(numpy.int64)
+        singles['mask'] = 1 << channel
+        for i, ch in enumerate(channels):
+            is_ch = channel == i
+            singles[ch][is_ch] = remaining['amplitude'][is_ch]
+            singles['t' + ch][is_ch] = remaining['time'][is_ch]
+        return numpy.empty(0, dtype=dtype), singles
+
+    events = []
+    while remaining.shape[0] > 0:
+        merged, member = _merge_pass(remaining, window, channels, dtype,
+                                     per_capture)
+        events.append(merged)
+        remaining = remaining[~member]
+    if len(events) == 0:
+        return numpy.empty(0, dtype=dtype), numpy.empty(0, dtype=dtype)
+
+    events = numpy.concatenate(events)
+    if per_capture:
+        events = events[numpy.lexsort((events['time'], events['capture']))]
+    else:
+        events = events[numpy.argsort(events['time'], kind='stable')]
+    multiplicity = numpy.zeros(events.shape[0], dtype=numpy.int64)
+    for i in range(len(channels)):
+        multiplicity += (events['mask'] >> i) & 1
+    return events[multiplicity > 1], events[multiplicity == 1]
+
+
+def _merge_pass(h, window, channels, dtype, per_capture):
+    """
+    Single merge pass over sorted hits, see build_events()
+
+    * returns events built and mask of hits used in these events
+    """
+    t = h['time']
+    channel = h['channel'].astype(numpy.int64)
+
+    # Groups of hits separated by less than window, each group is
+    # a candidate event starting at its first hit
+    new = numpy.ones(h.shape[0], dtype=bool)
+    new[1:] = numpy.diff(t) >= window
+    if per_capture:
+        new[1:] |= h['capture'][1:] != h['capture'][:-1]
+    group = numpy.cumsum(new) - 1
+    n_groups = group[-1] + 1
+    t_start = t[new]
+
+    # The first hit of each channel within window from the start
+    # of the group is a member of the event, the first hit of the group
+    # always is, so every pass takes at least one hit
+    inside = numpy.flatnonzero(new | (t - t_start[group] < window))
+    _, first = numpy.unique(group[inside] * len(channels) + channel[inside],
+                            return_index=True)
+    member = numpy.zeros(h.shape[0], dtype=bool)
+    member[inside[first]] = True
+
+    events = numpy.zeros(n_groups, dtype=dtype)
+    events['capture'] = h['capture'][new]
+    events['time'] = t_start
+    g = group[member]
+    c = channel[member]
+    events['mask'] = numpy.bincount(g, weights=1 << c, minlength=n_groups)
+    amplitude = h['amplitude'][member]
+    tm = t[member]
+    for i, ch in enumerate(channels):
+        is_ch = c == i
+        events[ch][g[is_ch]] = amplitude[is_ch]
+        events['t' + ch][g[is_ch]] = tm[is_ch]
+    return events, member
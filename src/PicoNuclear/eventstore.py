@@ -0,0 +1,108 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Compact, growable storage of events collected during a run.
+
+"""
+
+import numpy
+
+
+class EventStore:
+    """
+    Events kept in typed columns (one numpy array per field), growing
+    by doubling the capacity, so appending a batch costs O(batch size)
+    on average and an event takes only the bytes of its fields
+
+    The columns of the events collected so far are available as views
+    (store['A'], store.columns()), without copying. A view is valid until
+    the next append (the arrays may be reallocated when growing), it is
+    not updated with the new events.
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        """
+        * dtype - fields of events, numpy dtype or list of (name, type),
+                  e.g. [('A', 'f4'), ('time', 'i8'), ('flags', 'u1')]
+        * capacity - initial number of events allocated
+        """
+        self.dtype = numpy.dtype(dtype)
+        if self.dtype.names is None:
+            raise ValueError('Fields of events are required')
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        self._columns = {name: numpy.empty(self._capacity,
+                                           dtype=self.dtype[name])
+                         for name in self.dtype.names}
+
+    @property
+    def names(self):
+        """Names of fields"""
+        return self.dtype.names
+
+    @property
+    def capacity(self):
+        """Number of events allocated"""
+        return self._capacity
+
+    @property
+    def nbytes(self):
+        """Memory used by the events collected (bytes)"""
+        return self._size * self.dtype.itemsize
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        """Returns view of a column of all events"""
+        return self._columns[name][:self._size]
+
+    def columns(self, start=0, stop=None):
+        """
+        Returns dictionary of views of all columns of a range of events
+        (e.g. columns(n) - events added after first n)
+        """
+        return {name: column[:self._size][start:stop]
+                for name, column in self._columns.items()}
+
+    def clear(self):
+        """Removes all events (the memory is kept)"""
+        self._size = 0
+
+    def reserve(self, capacity):
+        """Makes room for at least capacity events"""
+        if capacity <= self._capacity:
+            return
+        new_capacity = self._capacity
+        while new_capacity < capacity:
+            new_capacity *= 2
+        for name, column in self._columns.items():
+            new_column = numpy.empty(new_capacity, dtype=column.dtype)
+            new_column[:self._size] = column[:self._size]
+            self._columns[name] = new_column
+        self._capacity = new_capacity
+
+    def append(self, batch):
+        """
+        Adds a batch of events
+
+        * batch - structured array or dictionary of arrays (or scalars,
+                  for a single event), with all fields of the store
+        """
+        n = numpy.size(batch[self.names[0]])
+        self.reserve(self._size + n)
+        for name, column in self._columns.items():
+            column[self._size:self._size + n] = batch[name]
+        self._size += n
+
+    def to_records(self, start=0, stop=None):
+        """
+        Returns copy of a range of events as a structured array (e.g. for
+        numpy.savetxt)
+        """
+        columns = self.columns(start, stop)
+        records = numpy.empty(len(columns[self.names[0]]), dtype=self.dtype)
+        for name, column in columns.items():
+            records[name] = column
+        return records
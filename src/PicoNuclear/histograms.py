@@ -0,0 +1,234 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Histograms filled incrementally, for live display of spectra.
+
+"""
+
+import numpy
+
+
+class Histogram:
+    """
+    One dimensional histogram with fixed, uniform bins, filled batch by
+    batch
+
+    The bins are the same as of numpy.histogram(values, bins, range): the
+    last bin includes its right edge, values outside the range are not
+    counted. The cost of filling is proportional to the size of the
+    batch, not to the number of values counted so far.
+    """
+
+    def __init__(self, range, bins):
+        """
+        * range - (low, high) edges of the histogram
+        * bins - number of bins
+        """
+        self.range = (float(range[0]), float(range[1]))
+        self.bins = int(bins)
+        self.edges = numpy.linspace(self.range[0], self.range[1],
+                                    self.bins + 1)
+        self._scale = self.bins / (self.range[1] - self.range[0])
+        self.counts = numpy.zeros(self.bins, dtype=numpy.int64)
+
+    def reset(self):
+        """Zeros all counts"""
+        self.counts[:] = 0
+
+    def index(self, values):
+        """
+        Returns bin indices of values, -1 for values out of range
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        i = numpy.floor((values - self.range[0]) * self._scale)
+        i[values == self.range[1]] = self.bins - 1
+        i[~((i >= 0) & (i < self.bins))] = -1
+        return i.astype(numpy.int64)
+
+    def fill(self, values):
+        """Adds values to the histogram"""
+        self.fill_index(self.index(values))
+
+    def fill_index(self, index):
+        """Adds values of given bin indices (see index())"""
+        index = index[index >= 0]
+        self.counts += numpy.bincount(index, minlength=self.bins)
+
+
+class Histogram2D:
+    """
+    Two dimensional histogram with fixed, uniform bins, filled batch by
+    batch (see Histogram)
+    """
+
+    def __init__(self, x_range, x_bins, y_range, y_bins):
+        """
+        * x_range, y_range - (low, high) edges of the histogram
+        * x_bins, y_bins - number of bins
+        """
+        self.x = Histogram(x_range, x_bins)
+        self.y = Histogram(y_range, y_bins)
+        self.counts = numpy.zeros((self.x.bins, self.y.bins),
+                                  dtype=numpy.int64)
+
+    def reset(self):
+        """Zeros all counts"""
+        self.counts[:] = 0
+
+    def fill(self, x, y):
+        """Adds (x, y) pairs to the histogram"""
+        ix = self.x.index(x)
+        iy = self.y.index(y)
+        inside = (ix >= 0) & (iy >= 0)
+        # bincount over all bins would cost O(bins) for every batch
+        numpy.add.at(self.counts.reshape(-1),
+                     ix[inside] * self.y.bins + iy[inside], 1)
+
+    def filled(self, x_slice=slice(None), y_slice=slice(None)):
+        """
+        Returns low edges (x, y) of non-empty bins within the given slices
+        of bin indices
+        """
+        ix, iy = numpy.nonzero(self.counts[x_slice, y_slice])
+        ix += x_slice.start or 0
+        iy += y_slice.start or 0
+        return self.x.edges[ix], self.y.edges[iy]
+
+
+class CoincidenceSpectra:
+    """
+    Live spectra of a two detector setup (A and B): amplitude spectra of
+    both detectors, A versus B map and the time difference (tB - tA)
+    spectrum, all of them also for events within a gate set on both
+    amplitudes
+
+    The gated amplitude spectra and the maps are taken from the A versus
+    B histogram, so the gate can be moved at any time without refilling.
+    The gated time difference spectrum is refilled from all events when
+    the gate is changed (see set_gate()).
+    """
+
+    def __init__(self, ch_range, ch_bins, t_range, t_bins):
+        """
+        * ch_range, ch_bins - range and number of bins of amplitudes
+        * t_range, t_bins - range and number of bins of time differences
+        """
+        self.a = Histogram(ch_range, ch_bins)
+        self.b = Histogram(ch_range, ch_bins)
+        self.ab = Histogram2D(ch_range, ch_bins, ch_range, ch_bins)
+        self.dt = Histogram(t_range, t_bins)
+        self.dt_gated = Histogram(t_range, t_bins)
+        self.gate = None
+        self._slices = (slice(0, 0), slice(0, 0))
+
+    def reset(self):
+        """Zeros all spectra"""
+        self.a.reset()
+        self.b.reset()
+        self.ab.reset()
+        self.dt.reset()
+        self.dt_gated.reset()
+
+    def set_gate(self, gate, A=None, B=None, tA=None, tB=None):
+        """
+        Sets the gate on amplitudes
+
+        * gate - (A low, A high, B low, B high), same as the condition
+                 (A >= A low) & (A <= A high) & (B >= B low) & (B <= B high)
+                 rounded to bins
+        * A, B, tA, tB - all events collected so far, used to refill
+                         the gated time difference spectrum if the gate
+                         has changed
+        * returns True if the gate has changed
+        """
+        gate = tuple(gate)
+        if gate == self.gate:
+            return False
+        self.gate = gate
+        xl, xr, yl, yr = gate
+        self._slices = (self._bin_slice(self.ab.x, xl, xr),
+                        self._bin_slice(self.ab.y, yl, yr))
+        self.dt_gated.reset()
+        if A is not None:
+            self._fill_gated(A, B, tA, tB)
+        return True
+
+    @staticmethod
+    def _bin_slice(histogram, low, high):
+        """Returns slice of bins from the bin of low up to the bin of high,
+        both included"""
+        i = numpy.floor((numpy.array([low, high]) - histogram.range[0])
+                        * histogram._scale) + [0, 1]
+        i = numpy.clip(i, 0, histogram.bins).astype(int)
+        return slice(i[0], max(i[1], i[0]))
+
+    def _in_gate(self, A, B):
+        """Returns mask of events in the gate"""
+        xs, ys = self._slices
+        ia = self.ab.x.index(A)
+        ib = self.ab.y.index(B)
+        return ((ia >= xs.start) & (ia < xs.stop)
+                & (ib >= ys.start) & (ib < ys.stop))
+
+    def _fill_gated(self, A, B, tA, tB):
+        dt = numpy.asarray(tB) - numpy.asarray(tA)
+        self.dt_gated.fill(dt[self._in_gate(A, B)])
+
+    def fill(self, A, B, tA, tB):
+        """
+        Adds a batch of events
+
+        * A, B - amplitudes
+        * tA, tB - times
+        """
+        A = numpy.atleast_1d(A)
+        B = numpy.atleast_1d(B)
+        dt = numpy.atleast_1d(tB) - numpy.atleast_1d(tA)
+        self.a.fill(A)
+        self.b.fill(B)
+        self.ab.fill(A, B)
+        self.dt.fill(dt)
+        if self.gate is not None:
+            self.dt_gated.fill(dt[self._in_gate(A, B)])
+
+    @property
+    def A(self):
+        """Amplitude spectrum of A"""
+        return self.a.counts
+
+    @property
+    def B(self):
+        """Amplitude spectrum of B"""
+        return self.b.counts
+
+    @property
+    def A_gated(self):
+        """Amplitude spectrum of A of events in the gate"""
+        spectrum = numpy.zeros(self.ab.x.bins, dtype=numpy.int64)
+        xs, ys = self._slices
+        spectrum[xs] = self.ab.counts[xs, ys].sum(axis=1)
+        return spectrum
+
+    @property
+    def B_gated(self):
+        """Amplitude spectrum of B of events in the gate"""
+        spectrum = numpy.zeros(self.ab.y.bins, dtype=numpy.int64)
+        xs, ys = self._slices
+        spectrum[ys] = self.ab.counts[xs, ys].sum(axis=0)
+        return spectrum
+
+    @property
+    def counts_gated(self):
+        """Number of events in the gate"""
+        xs, ys = self._slices
+        return int(self.ab.counts[xs, ys].sum())
+
+    def map(self):
+        """Returns (A, B) low edges of non-empty bins of A versus B"""
+        return self.ab.filled()
+
+    def map_gated(self):
+        """Returns (A, B) low edges of non-empty bins of A versus B in the
+        gate"""
+        return self.ab.filled(*self._slices)
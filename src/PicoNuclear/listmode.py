@@ -0,0 +1,183 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Binary list-mode files, events written during the run.
+
+"""
+
+import datetime
+import json
+import queue
+import struct
+from threading import Thread
+
+import numpy
+
+
+MAGIC = b'PNLM'
+VERSION = 1
+# Header: magic, version, length of the JSON description (padded)
+_PREFIX = struct.Struct('<4sII')
+# Room left in the header for the information added when closing
+_RESERVE = 4096
+
+
+class ListModeWriter:
+    """
+    Writes events (fixed size binary records) to a list-mode file,
+    batch by batch, in a background thread
+
+    The file starts with a header describing the records (numpy dtype),
+    and any other information given (e.g. configuration, calibration),
+    plus the start time. The records follow right after the header, every
+    batch is flushed to the disk when written, so after a crash all
+    events but the last batch can be read. On close, the stop time and
+    the information given to close() are added to the header.
+
+    write() only puts a copy of the batch in a queue, the formatting and
+    the disk operations are done by the background thread.
+    """
+
+    def __init__(self, file_name, dtype, info=None):
+        """
+        * file_name - name of output file
+        * dtype - fields of events, numpy dtype or list of (name, type)
+        * info - (optional) dictionary of information stored in the header
+                 (must be JSON serializable, e.g. configuration)
+        """
+        self.file_name = file_name
+        self.dtype = numpy.dtype(dtype)
+        self.events = 0
+        self._header = {'dtype': self.dtype.descr,
+                        'start': datetime.datetime.now().isoformat()}
+        if info is not None:
+            self._header.update(info)
+        self._file = open(file_name, 'wb')
+        description = self._encode(self._header)
+        self._length = len(description) + _RESERVE
+        self._write_header(description)
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _encode(header):
+        return json.dumps(header, default=_to_json).encode()
+
+    def _write_header(self, description):
+        """Writes header at the beginning of the file"""
+        self._file.seek(0)
+        self._file.write(_PREFIX.pack(MAGIC, VERSION, self._length))
+        self._file.write(description.ljust(self._length))
+
+    def write(self, batch):
+        """
+        Queues a batch of events to be written
+
+        * batch - structured array or dictionary of arrays, with all
+                  fields of dtype
+        """
+        if self._error is not None:
+            raise self._error
+        records = numpy.empty(numpy.size(batch[self.dtype.names[0]]),
+                              dtype=self.dtype)
+        for name in self.dtype.names:
+            records[name] = batch[name]
+        self.events += records.shape[0]
+        self._queue.put(records)
+
+    def _run(self):
+        """Writing loop of the background thread"""
+        while True:
+            records = self._queue.get()
+            if records is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                self._file.write(records.tobytes())
+                self._file.flush()
+            except OSError as err:
+                self._error = err
+
+    def close(self, info=None):
+        """
+        Writes all queued events, adds the stop time and info to the
+        header and closes the file
+
+        * info - (optional) dictionary of information stored in the header
+                 (e.g. running time)
+        """
+        if self._file.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._header['stop'] = datetime.datetime.now().isoformat()
+        self._header['events'] = self.events
+        if info is not None:
+            self._header.update(info)
+        description = self._encode(self._header)
+        if len(description) <= self._length:
+            self._write_header(description)
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+def read_header(file_name):
+    """
+    Reads header of a list-mode file
+
+    * returns header (dictionary) and offset of the first record (bytes)
+    """
+    with open(file_name, 'rb') as in_file:
+        magic, version, length = _PREFIX.unpack(in_file.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a list-mode file'.format(file_name))
+        if version > VERSION:
+            raise ValueError('List-mode file version {} is not '
+                             'supported'.format(version))
+        header = json.loads(in_file.read(length).decode())
+    return header, _PREFIX.size + length
+
+
+def read_listmode(file_name, mmap=True):
+    """
+    Reads list-mode file written by ListModeWriter
+
+    * file_name - name of the file
+    * mmap - if True, the events are memory mapped (read from the disk
+             when used), otherwise loaded to memory
+    * returns header, events - header (dictionary) and structured array
+              of events (incomplete last record, e.g. after a crash, is
+              skipped)
+    """
+    header, offset = read_header(file_name)
+    dtype = numpy.dtype([tuple(field) for field in header['dtype']])
+    with open(file_name, 'rb') as in_file:
+        in_file.seek(0, 2)
+        n = (in_file.tell() - offset) // dtype.itemsize
+        if not mmap:
+            in_file.seek(offset)
+            return header, numpy.fromfile(in_file, dtype=dtype, count=n)
+    if n == 0:
+        return header, numpy.empty(0, dtype=dtype)
+    return header, numpy.memmap(file_name, dtype=dtype, mode='r',
+                                offset=offset, shape=(n,))
+
+
+def _to_json(value):
+    """Converts numpy values (not serializable by json) to python types"""
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    return str(value)
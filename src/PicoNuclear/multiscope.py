@@ -0,0 +1,186 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Acquisition with several PicoScopes working together.
+
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from PicoNuclear.pipeline import PipelinedAcquisition
+
+try:
+    from PicoNuclear.pico3000a import PicoScope3000A
+except ImportError:
+    # Without the PicoSDK only opened devices (e.g. simulators) are grouped
+    PicoScope3000A = None
+
+
+class ScopeGroup:
+    """Group of PicoScopes armed and read out in parallel.
+
+    Every device is served by its own thread, so the runs of all devices
+    overlap and the total throughput grows with the number of devices.
+    The channels and triggers are set up separately for each device (the
+    devices are available by index, e.g. group[0].set_channel(...)).
+
+    The trigger times of all devices are put on a single timeline, counted
+    from the start of the acquisition (in ps). The devices do not share a
+    clock, so the runs are only roughly aligned with the host time of
+    arming. The time stamp counter of a device starts at its first trigger
+    of the run, not at the arming, so the times of a device are shifted by
+    the wait for that trigger (about 1/rate, easily tens of milliseconds)
+    plus the host timing jitter. The common timeline is good for ordering
+    batches and for rates, but coincidences between devices can not be
+    built from it, only the times within a single device are accurate.
+    If all devices are triggered by a common reference signal, the fixed
+    delays between them may be set in :attr:`time_offsets`.
+
+    Methods
+    -------
+    measure_adc_values()
+        Collect a batch of captures from every device
+    start()
+        Start a continuous acquisition of all devices
+    stop()
+        Stop the continuous acquisition
+    close()
+        Close all devices
+
+    """
+
+    def __init__(self, serials):
+        """Open the devices.
+
+        :param serials: list of serial numbers of the devices, an item may
+            also be an opened device (e.g. simulator.SimulatedPicoScope),
+            which is used as it is
+        """
+        self.serials = list(serials)
+        self.scopes = []
+        for serial in self.serials:
+            if isinstance(serial, str):
+                serial = serial.encode()
+            if isinstance(serial, bytes) or serial is None:
+                if PicoScope3000A is None:
+                    raise ImportError("The PicoSDK is required to open "
+                                      "the devices")
+                self.scopes.append(PicoScope3000A(serial))
+            else:
+                self.scopes.append(serial)
+        self.time_offsets = [0] * len(self.scopes)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.scopes))
+        self._pipelines = []
+
+    def __len__(self):
+        return len(self.scopes)
+
+    def __iter__(self):
+        return iter(self.scopes)
+
+    def __getitem__(self, index):
+        return self.scopes[index]
+
+    def measure_adc_values(self, num_pre_samples, num_post_samples,
+                           timebase=1, num_captures=1):
+        """Collect a batch of captures from every device.
+
+        All devices are armed at the same time (each in its own thread),
+        and the call returns when all of them have finished.
+
+        :param num_pre_samples: number of samples before the trigger
+        :param num_post_samples: number of samples after the trigger
+        :param timebase: timebase setting (see programmers guide for reference)
+        :param num_captures: number of captures to take by each device
+
+        :returns: data, trigger_times - lists with an item for each device,
+            data as returned by PicoScope3000A.measure_adc_values and
+            trigger times in ps on the common timeline (aligned only
+            roughly between the devices, see above)
+        """
+        t_start = time.perf_counter()
+        futures = [self._executor.submit(self._measure, scope,
+                                         num_pre_samples, num_post_samples,
+                                         timebase, num_captures)
+                   for scope in self.scopes]
+        data = []
+        trigger_times = []
+        for i, future in enumerate(futures):
+            t_arm, values, times = future.result()
+            data.append(values)
+            # The time stamps count from the first trigger of the device,
+            # which comes an unknown wait after t_arm
+            trigger_times.append(times + int((t_arm - t_start) * 1e12)
+                                 + self.time_offsets[i])
+        return data, trigger_times
+
+    @staticmethod
+    def _measure(scope, num_pre_samples, num_post_samples, timebase,
+                 num_captures):
+        """Measure with a single device, return time of arming as well."""
+        t_arm = time.perf_counter()
+        values, times = scope.measure_adc_values(
+            num_pre_samples, num_post_samples, timebase, num_captures,
+            trigger_times=True)
+        return t_arm, values, times
+
+    def start(self, consumer, num_pre_samples, num_post_samples, timebase=1,
+              num_captures=1, num_buffers=2):
+        """Start a continuous acquisition of all devices.
+
+        Each device runs its own pipelined acquisition (see
+        pipeline.PipelinedAcquisition). The consumer is called with the
+        index of the device, its batch of data and the trigger times on the
+        common timeline (aligned only roughly between the devices, see
+        above). The batches of different devices are processed
+        concurrently, so the consumer must be thread safe.
+
+        :param consumer: function called with index, data, trigger_times
+        :param num_pre_samples: number of samples before the trigger
+        :param num_post_samples: number of samples after the trigger
+        :param timebase: timebase setting (see programmers guide for
+            reference)
+        :param num_captures: number of captures in a batch
+        :param num_buffers: number of host buffer sets per device
+        """
+        self._pipelines = [
+            PipelinedAcquisition(scope, partial(self._consume, consumer, i),
+                                 num_pre_samples, num_post_samples,
+                                 timebase, num_captures, num_buffers,
+                                 trigger_times=True)
+            for i, scope in enumerate(self.scopes)]
+        self._t_start = time.perf_counter()
+        for pipeline in self._pipelines:
+            pipeline.start()
+
+    def _consume(self, consumer, index, data, trigger_times):
+        """Move the trigger times of a device on the common timeline."""
+        pipeline = self._pipelines[index]
+        shift = int((pipeline._t_start - self._t_start) * 1e12)
+        consumer(index, data,
+                 trigger_times + shift + self.time_offsets[index])
+
+    def stop(self):
+        """Stop the continuous acquisition.
+
+        Any exception raised in the acquisition or in the consumer is
+        re-raised here (after all devices are stopped).
+        """
+        error = None
+        for pipeline in self._pipelines:
+            try:
+                pipeline.stop()
+            except Exception as err:
+                error = err
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Close all devices."""
+        self._executor.shutdown()
+        for scope in self.scopes:
+            scope.stop()
+            scope.close()
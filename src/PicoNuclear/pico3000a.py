@@ -16,16 +16,24 @@ some minor changes
 
 """
 
+import asyncio
 import ctypes
-from threading import Event
+import time
+from threading import Event, Lock, Thread
 
 import numpy as np
 
 from picosdk.ps3000a import ps3000a as ps
 from picosdk.functions import assert_pico_ok
 from picosdk.constants import PICO_STATUS_LOOKUP
+from picosdk.constants import PICO_INFO
 from picosdk.constants import make_enum
 
+from PicoNuclear.buffers import RingBuffer
+from PicoNuclear.stats import AcquisitionStats
+
+
+CHANNELS = ['A', 'B', 'C', 'D']
 
 INPUT_RANGES = {
     0.01: '10mV',
@@ -59,12 +67,31 @@ class DeviceNotFoundError(PicoSDKError):
         super().__init__("Device not connected.")
 
 
+class _TriggerInfo(ctypes.Structure):
+    """PS3000A_TRIGGER_INFO structure (not defined in the PicoSDK wrapper)."""
+    _pack_ = 1
+    _fields_ = [("status", ctypes.c_uint32),
+                ("segmentIndex", ctypes.c_uint32),
+                ("reserved0", ctypes.c_uint32),
+                ("triggerTime", ctypes.c_int64),
+                ("timeUnits", ctypes.c_int16),
+                ("reserved1", ctypes.c_int16),
+                ("timeStampCounter", ctypes.c_uint64)]
+
+
 class PicoScope3000A:
     """Interface to a 3000 Series PicoScope.
 
     This class encapsulates the low-level PicoSDK and offers a python-friendly
     interface to a 3000 Series PicoScope (e.g. a PicoScope 5242D).
 
+    The live time, dead time and throughput of the block mode runs are
+    counted in :attr:`stats` (see stats.AcquisitionStats).
+
+    Two and four channel devices are supported. The data are returned as a
+    list with an item for each channel of the device (:attr:`channels`),
+    None for disabled channels. Only the enabled channels are read out.
+
     Methods
     -------
     open()
@@ -77,10 +104,22 @@ class PicoScope3000A:
         Start a data collection run and return the data
     measure_adc_values()
         Start a data collection run and return the data in ADC values
+    measure_chunked()
+        Collect any number of captures in a series of runs, in ADC values
+    get_max_captures()
+        Return the number of captures fitting in the device memory
     set_up_buffers()
         Set up memory buffers for reading data from device
+    allocate_buffer_sets()
+        Set up memory segments and return new sets of data buffers
+    swap_buffers()
+        Register a set of data buffers, filled by the following readouts
     get_adc_data()
         Return all captured data, in ADC values
+    get_trigger_times()
+        Return trigger times of the captures read out last
+    get_overflow()
+        Return overflow flags of the captures read out last
     get_data()
         Return all captured data, in physical units
     get_interval_from_timebase()
@@ -89,29 +128,65 @@ class PicoScope3000A:
         Start a run in (rapid) block mode
     wait_for_data()
         Wait for device to finish data capture
+    data_ready()
+        Wait for device to finish data capture in an asyncio coroutine
+    measure_async()
+        Coroutine version of measure()
+    measure_adc_values_async()
+        Coroutine version of measure_adc_values()
     stop()
         Stop data capture
     set_trigger()
         Set the oscilloscope trigger condition
+    set_advanced_trigger()
+        Set a trigger on a logical combination of channels
+    start_streaming()
+        Start a continuous data collection in streaming mode
+    get_streaming_values()
+        Return a contiguous view of the streamed data, in ADC values
+    release_streaming_values()
+        Mark streamed data as consumed
+    stop_streaming()
+        Stop the streaming mode data collection
 
     """
     _handle = None
 
     def __init__(self, serial=None):
         """Instantiate the class and open the device."""
-        self._channels_enabled = {'A': True, 'B': True}
+        self._channels_enabled = {}
         self._input_voltage_ranges = {}
         self._input_offsets = {}
         self._input_adc_ranges = {}
         self._offset_ranges = {}
         self._buffers = {}
+        self._buffer_layout = None
+        self._num_captures_set = None
+        self._downsample = ('NONE', 1)
+        self.rearm_time = 0.0
+        self.stats = AcquisitionStats()
+        self._t_ready = None
+        self.capture_rate = 0.0
+        self._max_captures = {}
+        self._trigger_times = None
+        self._trigger_info_supported = True
+        self._interval_key = None
+        self._sample_interval = None
+        self._overflow = None
+        self._stream = None
+        self._streaming = False
         self.data_is_ready = Event()
-        self._callback = callback_factory(self.data_is_ready)
+        self._ready_waiters = []
+        self._ready_lock = Lock()
+        self._callback = callback_factory(self.data_is_ready,
+                                          self._notify_ready)
         self.open(serial)
 
     def __del__(self):
         """Instance destructor, close device."""
         if self._handle:
+            if self._streaming:
+                self.stop_streaming()
             self.stop()
             self.close()
 
@@ -127,13 +202,43 @@ class PicoScope3000A:
 
         if status_msg == "PICO_OK":
             self._handle = handle
+            self._buffer_layout = None
+            self._num_captures_set = None
+            self._max_captures = {}
         elif status_msg == 'PICO_NOT_FOUND':
             raise DeviceNotFoundError()
         else:
             raise PicoSDKError(f"PicoSDK returned {status_msg}")
 
-        self.set_channel('A', is_enabled=False)
-        self.set_channel('B', is_enabled=False)
+        self._channels_enabled = {}
+        for channel_name in CHANNELS[:self._get_num_channels()]:
+            self.set_channel(channel_name, is_enabled=False)
+
+    def _get_num_channels(self):
+        """Return the number of channels of the device.
+
+        The number is the second digit of the variant name (e.g. 3206D has
+        two, 3406D four channels).
+        """
+        info = ctypes.create_string_buffer(32)
+        required_size = ctypes.c_int16()
+        assert_pico_ok(ps.ps3000aGetUnitInfo(
+            self._handle, info, len(info), ctypes.byref(required_size),
+            PICO_INFO['PICO_VARIANT_INFO']))
+        variant = info.value.decode()
+        if len(variant) > 1 and variant[1] == '4':
+            return 4
+        return 2
+
+    @property
+    def channels(self):
+        """Names of the channels of the device."""
+        return list(self._channels_enabled)
+
+    @property
+    def enabled_channels(self):
+        """Names of the enabled channels."""
+        return self._get_enabled_channels()
 
     def close(self):
         """Close the device."""
@@ -178,7 +283,8 @@ class PicoScope3000A:
 
 
     def measure(self, num_pre_samples, num_post_samples, timebase=1,
-                num_captures=1):
+                num_captures=1, trigger_times=False, downsample_mode='NONE',
+                downsample_ratio=1):
         """Start a data collection run and return the data.
 
         Start a data collection run and collect a number of captures. The data
@@ -190,52 +296,159 @@ class PicoScope3000A:
         :param num_post_samples: number of samples after the trigger
         :param timebase: timebase setting (see programmers guide for reference)
         :param num_captures: number of captures to take
+        :param trigger_times: if True, the trigger times of the captures
+            (see :method:`get_trigger_times`) are returned as well
+        :param downsample_mode, downsample_ratio: downsampling done by the
+            device (see :method:`set_up_buffers`)
 
-        :returns: time_values, data
+        :returns: time_values, data (and trigger_times)
         """
         data = self.measure_adc_values(num_pre_samples, num_post_samples,
-                                       timebase, num_captures)
+                                       timebase, num_captures,
+                                       downsample_mode=downsample_mode,
+                                       downsample_ratio=downsample_ratio)
 
         num_samples = num_pre_samples + num_post_samples
-        time_values = self._calculate_time_values(timebase, num_samples)
+        time_values = self._calculate_time_values(timebase, num_samples,
+                                                  self._downsample[1])
 
         V_data = []
         for channel, values in zip(self._channels_enabled, data):
             if self._channels_enabled[channel] is True:
-                V_data.append(self._rescale_adc_to_V(channel,
-                                                     np.array(values)))
+                V_data.append(self._rescale_adc_to_V(channel, values))
             else:
                 V_data.append(None)
 
+        if trigger_times:
+            return time_values, V_data, self._trigger_times
         return time_values, V_data
 
     def measure_adc_values(self, num_pre_samples, num_post_samples, timebase=1,
-                           num_captures=1):
+                           num_captures=1, trigger_times=False,
+                           downsample_mode='NONE', downsample_ratio=1):
         """Start a data collection run and return the data in ADC values.
 
         Start a data collection run in 'rapid block mode' and collect a number
-        of captures. The data is returned as a list of NumPy arrays (i.e. a
-        list of captures) with unconverted ADC values.
+        of captures. The data is returned as a list of twodimensional
+        (captures, samples) int16 NumPy arrays, one per channel, with
+        unconverted ADC values. The arrays are the buffers used by the driver
+        (no copy is made), so they are overwritten by the next run with the
+        same number of samples and captures.
 
         :param num_pre_samples: number of samples before the trigger
         :param num_post_samples: number of samples after the trigger
         :param timebase: timebase setting (see programmers guide for reference)
         :param num_captures: number of captures to take
+        :param trigger_times: if True, the trigger times of the captures
+            (see :method:`get_trigger_times`) are returned as well
+        :param downsample_mode, downsample_ratio: downsampling done by the
+            device (see :method:`set_up_buffers`)
 
-        :returns: data
+        The time spent on setting up the buffers and arming the device is
+        stored in :attr:`rearm_time` (in seconds).
+
+        :returns: data (and trigger_times)
         """
         num_samples = num_pre_samples + num_post_samples
-        self.set_up_buffers(num_samples, num_captures)
+        t_start = time.perf_counter()
+        self.set_up_buffers(num_samples, num_captures, downsample_mode,
+                            downsample_ratio)
         self.start_run(num_pre_samples, num_post_samples, timebase,
                        num_captures)
+        self.rearm_time = time.perf_counter() - t_start
         self.wait_for_data()
         values = self._get_values(num_samples, num_captures)
 
         self.stop()
+        if trigger_times:
+            return values, self._trigger_times
         return values
 
+    def measure_chunked(self, num_pre_samples, num_post_samples, timebase=1,
+                        num_captures=1, trigger_times=False):
+        """Collect any number of captures in a series of runs, in ADC values.
+
+        Unlike :method:`measure_adc_values`, the number of captures is not
+        limited by the device memory. The request is split into runs of
+        the largest number of captures the memory can hold (see
+        :method:`get_max_captures`). Each run is armed right after the
+        readout of the previous one, and its data is copied into the
+        result while the next run is captured. The data is returned as a
+        list of (captures, samples) int16 NumPy arrays, one per channel
+        (None for disabled channels).
+
+        The effective number of captures per second (including the
+        readout dead time between the runs) is stored in
+        :attr:`capture_rate`. The trigger times and overflow flags of all
+        captures are available from :method:`get_trigger_times` and
+        :method:`get_overflow`. The device counts trigger times from the
+        start of each run, the runs are aligned with the host clock at
+        arming, so time differences between captures of different runs are
+        only approximate.
+
+        :param num_pre_samples: number of samples before the trigger
+        :param num_post_samples: number of samples after the trigger
+        :param timebase: timebase setting (see programmers guide for reference)
+        :param num_captures: number of captures to take
+        :param trigger_times: if True, the trigger times of the captures
+            are returned as well
+
+        :returns: data (and trigger_times)
+        """
+        if num_captures < 1:
+            raise InvalidParameterError(
+                f"At least one capture is required, got {num_captures}")
+        num_samples = num_pre_samples + num_post_samples
+        run_size = min(num_captures, self.get_max_captures(num_samples))
+        runs = [run_size] * (num_captures // run_size)
+        if num_captures % run_size > 0:
+            runs.append(num_captures % run_size)
+
+        data = [np.empty((num_captures, num_samples), dtype=np.int16)
+                if is_enabled is True else None
+                for is_enabled in self._channels_enabled.values()]
+        times = np.empty(num_captures, dtype=np.int64)
+        overflow = np.empty(num_captures, dtype=np.uint16)
+
+        t_start = time.perf_counter()
+        self.set_up_buffers(num_samples, runs[0])
+        self.start_run(num_pre_samples, num_post_samples, timebase, runs[0])
+        t_arm = t_start
+        first = 0
+        for i, size in enumerate(runs):
+            self.wait_for_data()
+            values = self._get_values(num_samples, size)
+            if values is None:
+                raise PicoSDKError("PicoSDK returned PICO_NO_SAMPLES_AVAILABLE")
+            run_times = self._trigger_times + int((t_arm - t_start) * 1e12)
+            run_overflow = self._overflow
+            if i + 1 < len(runs):
+                if runs[i + 1] != size:
+                    # The memory is divided again for the last, shorter
+                    # run, the device must be stopped first
+                    self.stop()
+                t_arm = time.perf_counter()
+                self.set_up_buffers(num_samples, runs[i + 1])
+                self.start_run(num_pre_samples, num_post_samples, timebase,
+                               runs[i + 1])
+            # The buffers are not refilled until the next readout
+            for result, values in zip(data, values):
+                if result is not None:
+                    result[first:first + size] = values
+            times[first:first + size] = run_times
+            overflow[first:first + size] = run_overflow
+            first += size
+
+        self.stop()
+        self.capture_rate = num_captures / (time.perf_counter() - t_start)
+        self._trigger_times = times
+        self._overflow = overflow
+        if trigger_times:
+            return data, times
+        return data
+
     def measure_relative_adc(self, num_pre_samples, num_post_samples,
-            timebase=1, num_captures=1, inverse=False):
+            timebase=1, num_captures=1, inverse=False, trigger_times=False):
         """Start a data collection run and return the data.
 
         Start a data collection run and collect a number of captures. The data
@@ -247,8 +460,10 @@ class PicoScope3000A:
         :param num_post_samples: number of samples after the trigger
         :param timebase: timebase setting (see programmers guide for reference)
         :param num_captures: number of captures to take
+        :param trigger_times: if True, the trigger times of the captures
+            (see :method:`get_trigger_times`) are returned as well
 
-        :returns: time_values, data
+        :returns: time_values, data (and trigger_times)
         """
         data = self.measure_adc_values(num_pre_samples, num_post_samples,
                                        timebase, num_captures)
@@ -259,28 +474,130 @@ class PicoScope3000A:
         V_data = []
         for channel, values in zip(self._channels_enabled, data):
             if self._channels_enabled[channel] is True:
-                V_data.append(self._rescale_adc_to_1(channel,
-                                                     np.array(values), 
+                V_data.append(self._rescale_adc_to_1(channel, values,
                                                      inverse))
             else:
                 V_data.append(None)
 
+        if trigger_times:
+            return time_values, V_data, self._trigger_times
         return time_values, V_data
 
-    def set_up_buffers(self, num_samples, num_captures=1):
+    def set_up_buffers(self, num_samples, num_captures=1,
+                       downsample_mode='NONE', downsample_ratio=1):
         """Set up memory buffers for reading data from device.
 
+        The registered buffer layout is cached, so the device is only
+        reconfigured if the number of samples, captures, downsampling or the
+        set of enabled channels has changed since the last call.
+
+        The data may be downsampled by the device before the transfer, every
+        downsample_ratio samples are reduced to a single value:
+        'DECIMATE' takes the first sample, 'AVERAGE' the mean value and
+        'AGGREGATE' both the maximum and the minimum. With 'AGGREGATE' each
+        channel is returned as a (2, captures, samples) array of maxima (0)
+        and minima (1).
+
         :param num_samples: the number of required samples per capture.
         :param num_captures: the number of captures.
+        :param downsample_mode: 'NONE', 'AGGREGATE', 'DECIMATE' or 'AVERAGE'
+        :param downsample_ratio: number of samples reduced to one value
         """
+        _get_ratio_mode_from_name(downsample_mode)
+        if downsample_mode == 'NONE':
+            downsample_ratio = 1
+        elif downsample_ratio < 1:
+            raise InvalidParameterError(
+                f"Downsample ratio must be positive, got {downsample_ratio}")
+        layout = (num_samples, num_captures,
+                  tuple(self._get_enabled_channels()),
+                  downsample_mode, downsample_ratio)
+        if layout == self._buffer_layout:
+            return
         self._set_memory_segments(num_captures, num_samples)
-        for channel in self._get_enabled_channels():
-            self._set_data_buffer(channel, num_samples, num_captures)
+        buffer_length = -(-num_samples // downsample_ratio)
+        self._set_data_buffers(
+            self._allocate_buffers(buffer_length, num_captures,
+                                   downsample_mode == 'AGGREGATE'),
+            buffer_length, downsample_mode, downsample_ratio)
+        self._buffer_layout = layout
+
+    def allocate_buffer_sets(self, num_samples, num_captures=1, num_sets=2):
+        """Set up memory segments and return new sets of data buffers.
+
+        The sets are used in turn for multiple buffering (see
+        pipeline.PipelinedAcquisition): while one set is processed, the next
+        readout goes to another one, registered with
+        :method:`swap_buffers`. Each set is a dictionary of
+        (captures, samples) int16 arrays for every enabled channel.
+
+        :param num_samples: the number of required samples per capture.
+        :param num_captures: the number of captures.
+        :param num_sets: the number of buffer sets.
+
+        :returns: list of buffer sets
+        """
+        self._set_memory_segments(num_captures, num_samples)
+        return [self._allocate_buffers(num_samples, num_captures)
+                for i in range(num_sets)]
+
+    def swap_buffers(self, buffers):
+        """Register a set of data buffers, filled by the following readouts.
+
+        The device must not be running, call :method:`stop` after the
+        readout of the previous run first. The driver only writes the
+        buffers in ps3000aGetValuesBulk, but the programmer's guide
+        registers them between runs (RunBlock, GetValues, Stop) and gives no
+        guarantee for a running device.
+
+        :param buffers: a buffer set returned by
+            :method:`allocate_buffer_sets`
+        """
+        num_samples = max([values.shape[-1] for values in buffers.values()],
+                          default=0)
+        self._set_data_buffers(buffers, num_samples)
 
     def get_adc_data(self):
-        """Return all captured data, in ADC values."""
+        """Return all captured data, in ADC values.
+
+        The data are returned as views of the driver buffers, one
+        (captures, samples) int16 array per channel (or (2, captures,
+        samples) in the 'AGGREGATE' downsampling mode, see
+        :method:`set_up_buffers`).
+        """
         return self._get_values(self._num_samples, self._num_captures)
 
+    def get_trigger_times(self):
+        """Return trigger times of the captures read out last.
+
+        The time of each trigger is taken from the device time stamp
+        counter (number of samples since the first trigger of the run,
+        ps3000aGetTriggerInfoBulk) and corrected by the trigger time offset
+        (jitter of the trigger within the sample interval,
+        ps3000aGetValuesTriggerTimeOffsetBulk64). The times are in
+        picoseconds (int64 array, one value per capture) and give a common
+        time base for all captures of a run. Devices not supporting the time
+        stamps report only the offsets.
+        """
+        return self._trigger_times
+
+    def get_overflow(self, channel_name=None):
+        """Return overflow flags of the captures read out last.
+
+        The driver reports for each capture a bit mask of the channels whose
+        input voltage went out of range (bit 0 for channel A, 1 for B etc.).
+        Samples of such channels are clipped at the end of the ADC range.
+
+        :param channel_name: (optional) channel name, if given a boolean
+            array of overflows of this channel is returned
+
+        :returns: uint16 array of bit masks (or booleans), one per capture
+        """
+        if channel_name is None or self._overflow is None:
+            return self._overflow
+        channel = _get_channel_from_name(channel_name)
+        return (self._overflow >> channel) & 1 == 1
+
     def get_data(self):
         """Return all captured data, in physical units.
 
@@ -290,25 +607,26 @@ class PicoScope3000A:
         """
         data = self.get_adc_data()
         if data is None:
-            return None, [None, None]
+            return None, [None] * len(self._channels_enabled)
         time_values = self._calculate_time_values(self._timebase,
-                                                  self._num_samples)
+                                                  self._num_samples,
+                                                  self._downsample[1])
 
         V_data = []
         for channel, values in zip(self._channels_enabled, data):
             if self._channels_enabled[channel] is True:
-                V_data.append(self._rescale_adc_to_V(channel,
-                                                     np.array(values)))
+                V_data.append(self._rescale_adc_to_V(channel, values))
             else:
                 V_data.append(None)
 
         return time_values, V_data
 
-    def _calculate_time_values(self, timebase, num_samples):
+    def _calculate_time_values(self, timebase, num_samples,
+                               downsample_ratio=1):
         """Calculate time values from timebase and number of samples 
-        Return values in ns."""
+        (reduced by downsample_ratio). Return values in ns."""
         interval = self.get_interval_from_timebase(timebase, num_samples)
-        return interval * np.arange(num_samples) 
+        return interval * np.arange(0, num_samples, downsample_ratio)
 
     def _rescale_adc_to_V(self, channel, data):
         """Rescale the ADC data and return float values in volts.
@@ -364,6 +682,53 @@ class PicoScope3000A:
             None, 0))
         return interval.value
 
+    def get_max_captures(self, num_samples):
+        """Return the number of captures fitting in the device memory.
+
+        The memory of a segment is shared by the enabled channels
+        (ps3000aMemorySegments gives the samples of all channels), so the
+        result is valid for the current set of enabled channels. The
+        results are cached, but note that querying the device changes its
+        memory segmentation, so the buffers are set up again on the next
+        run.
+
+        :param num_samples: number of samples per capture
+
+        :returns: maximum number of captures in a single run
+        """
+        key = (num_samples, tuple(self._get_enabled_channels()))
+        if key in self._max_captures:
+            return self._max_captures[key]
+        max_segments = ctypes.c_uint32()
+        assert_pico_ok(ps.ps3000aGetMaxSegments(self._handle,
+                                                ctypes.byref(max_segments)))
+        num_channels = max(len(self._get_enabled_channels()), 1)
+        num_captures = min(max_segments.value,
+                           self._get_segment_size(1)
+                           // (num_samples * num_channels))
+        # Every segment has some overhead, reduce the number of segments
+        # until the samples fit
+        while num_captures > 1:
+            segment_size = self._get_segment_size(num_captures) // num_channels
+            if segment_size >= num_samples:
+                break
+            num_captures = min(num_captures - 1,
+                               num_captures * segment_size // num_samples)
+        if num_captures < 1:
+            raise InvalidParameterError(
+                f"The device memory cannot fit {num_samples} samples")
+        self._max_captures[key] = num_captures
+        return num_captures
+
+    def _get_segment_size(self, num_segments):
+        """Divide the device memory and return samples per segment."""
+        self._buffer_layout = None
+        self._num_captures_set = None
+        max_samples = ctypes.c_int32()
+        assert_pico_ok(ps.ps3000aMemorySegments(self._handle, num_segments,
+                                                ctypes.byref(max_samples)))
+        return max_samples.value
+
     def _set_memory_segments(self, num_segments, num_samples):
         """Set up memory segments in the device.
 
@@ -375,30 +740,65 @@ class PicoScope3000A:
         :param num_segments: the number of memory segments.
         :param num_samples: the number of required samples per capture.
         """
-        max_samples = ctypes.c_int32()
-        assert_pico_ok(ps.ps3000aMemorySegments(self._handle, num_segments,
-                                                ctypes.byref(max_samples)))
-        max_samples = max_samples.value
+        num_channels = max(len(self._get_enabled_channels()), 1)
+        max_samples = self._get_segment_size(num_segments) // num_channels
         if max_samples < num_samples:
             raise InvalidParameterError(
-                f"A memory segment can only fit {max_samples}, but "
-                f"{num_samples} are required.")
+                f"A memory segment can only fit {max_samples} samples per "
+                f"channel, but {num_samples} are required.")
 
-    def _set_data_buffer(self, channel_name, num_samples, num_captures=1):
-        """Set up data buffer.
+    def _allocate_buffers(self, num_samples, num_captures=1, aggregate=False):
+        """Return a new set of data buffers for all enabled channels.
+
+        Each channel gets a single contiguous (captures, samples) int16
+        array, every row is a buffer for one memory segment. The buffers
+        are not registered in the driver, use
+        :method:`_set_data_buffers` for that.
 
-        :param channel_name: channel name ('A', 'B', etc.)
         :param num_samples: number of samples required
         :param num_captures: number of captures
+        :param aggregate: if True, a (2, captures, samples) array of
+            maximum and minimum buffers is allocated for each channel
         """
-        channel = _get_channel_from_name(channel_name)
-        self._buffers[channel_name] = [(ctypes.c_int16 * num_samples)() for
-                                       i in range(num_captures)]
-        for segment in range(num_captures):
-            assert_pico_ok(ps.ps3000aSetDataBuffer(
-                self._handle, channel, ctypes.byref(
-                    self._buffers[channel_name][segment]), num_samples,
-                    segment, 0))
+        shape = (num_captures, num_samples)
+        if aggregate:
+            shape = (2,) + shape
+        return {channel: np.zeros(shape, dtype=np.int16)
+                for channel in self._get_enabled_channels()}
+
+    def _set_data_buffers(self, buffers, num_samples, downsample_mode='NONE',
+                          downsample_ratio=1):
+        """Register a set of data buffers in the driver.
+
+        The following readouts of the device will fill these buffers.
+
+        :param buffers: dictionary of (captures, samples) arrays for each
+            enabled channel, see :method:`_allocate_buffers`
+        :param num_samples: length of the buffers
+        :param downsample_mode, downsample_ratio: downsampling of the
+            readouts (see :method:`set_up_buffers`)
+        """
+        self._buffer_layout = None
+        mode = _get_ratio_mode_from_name(downsample_mode)
+        c_int16_p = ctypes.POINTER(ctypes.c_int16)
+        for channel_name, segments in buffers.items():
+            channel = _get_channel_from_name(channel_name)
+            if downsample_mode == 'AGGREGATE':
+                for segment, (buffer_max, buffer_min) in enumerate(
+                        zip(segments[0], segments[1])):
+                    assert_pico_ok(ps.ps3000aSetDataBuffers(
+                        self._handle, channel,
+                        buffer_max.ctypes.data_as(c_int16_p),
+                        buffer_min.ctypes.data_as(c_int16_p),
+                        num_samples, segment, mode))
+            else:
+                for segment, buffer in enumerate(segments):
+                    assert_pico_ok(ps.ps3000aSetDataBuffer(
+                        self._handle, channel,
+                        buffer.ctypes.data_as(c_int16_p),
+                        num_samples, segment, mode))
+        self._buffers = buffers
+        self._downsample = (downsample_mode, downsample_ratio)
 
     def start_run(self, num_pre_samples, num_post_samples, timebase=1,
                   num_captures=1, callback=None):
@@ -426,31 +826,157 @@ class PicoScope3000A:
         self._num_samples = num_pre_samples + num_post_samples
         self._timebase = timebase
         self._num_captures = num_captures
+        if (timebase, self._num_samples) != self._interval_key:
+            self._sample_interval = self.get_interval_from_timebase(
+                timebase, self._num_samples)
+            self._interval_key = (timebase, self._num_samples)
 
         if callback is None:
             callback = self._callback
         self.data_is_ready.clear()
 
-        assert_pico_ok(ps.ps3000aSetNoOfCaptures(self._handle, num_captures))
+        if num_captures != self._num_captures_set:
+            assert_pico_ok(ps.ps3000aSetNoOfCaptures(self._handle,
+                                                     num_captures))
+            self._num_captures_set = num_captures
+        self._t_ready = None
+        self.stats.armed()
         assert_pico_ok(ps.ps3000aRunBlock(
             self._handle, num_pre_samples, num_post_samples, timebase, 1,
             None, 0, callback, None))
 
-    def wait_for_data(self):
-        """Wait for device to finish data capture."""
-        self.data_is_ready.wait()
+    def wait_for_data(self, timeout=None):
+        """Wait for device to finish data capture.
+
+        :param timeout: maximum time to wait in seconds, None waits forever
+
+        :returns: True if the data is ready, False on timeout
+        """
+        return self.data_is_ready.wait(timeout)
+
+    async def data_ready(self, timeout=None):
+        """Wait for device to finish data capture in an asyncio coroutine.
+
+        The event loop is not blocked, the coroutine is woken up by the
+        driver callback (with call_soon_threadsafe). Use
+        :method:`start_run` (which does not block) to start the run first.
+        If the waiting task is cancelled, the run is not stopped.
+
+        :param timeout: maximum time to wait in seconds, None waits forever
+
+        :returns: True if the data is ready, False on timeout
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._ready_lock:
+            if self.data_is_ready.is_set():
+                return True
+            self._ready_waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._ready_lock:
+                if waiter in self._ready_waiters:
+                    self._ready_waiters.remove(waiter)
+
+    def _notify_ready(self):
+        """Record the time the data is ready and wake up the threads and
+        coroutines waiting for it (called by the driver)."""
+        # The time is set first, the woken thread reads it in _get_values
+        self._t_ready = time.perf_counter()
+        with self._ready_lock:
+            self.data_is_ready.set()
+            waiters = self._ready_waiters
+            self._ready_waiters = []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_set_future_done, future)
+
+    async def measure_adc_values_async(self, num_pre_samples,
+                                       num_post_samples, timebase=1,
+                                       num_captures=1, timeout=None):
+        """Coroutine version of :method:`measure_adc_values`.
+
+        The event loop keeps running while the device captures the data.
+        If the capture is cancelled or not finished within timeout, the
+        device is stopped (and asyncio.TimeoutError raised on timeout).
+
+        :param num_pre_samples: number of samples before the trigger
+        :param num_post_samples: number of samples after the trigger
+        :param timebase: timebase setting (see programmers guide for reference)
+        :param num_captures: number of captures to take
+        :param timeout: maximum time to wait for the data in seconds, None
+            waits forever
+
+        :returns: data
+        """
+        num_samples = num_pre_samples + num_post_samples
+        self.set_up_buffers(num_samples, num_captures)
+        self.start_run(num_pre_samples, num_post_samples, timebase,
+                       num_captures)
+        try:
+            if not await self.data_ready(timeout):
+                raise asyncio.TimeoutError(
+                    f"No data within {timeout} s")
+        except BaseException:
+            self.stop()
+            raise
+        values = self._get_values(num_samples, num_captures)
+        self.stop()
+        return values
+
+    async def measure_async(self, num_pre_samples, num_post_samples,
+                            timebase=1, num_captures=1, timeout=None):
+        """Coroutine version of :method:`measure`.
+
+        See :method:`measure_adc_values_async` for timeout and
+        cancellation.
+
+        :returns: time_values, data
+        """
+        data = await self.measure_adc_values_async(
+            num_pre_samples, num_post_samples, timebase, num_captures,
+            timeout)
+
+        num_samples = num_pre_samples + num_post_samples
+        time_values = self._calculate_time_values(timebase, num_samples)
+
+        V_data = []
+        for channel, values in zip(self._channels_enabled, data):
+            if self._channels_enabled[channel] is True:
+                V_data.append(self._rescale_adc_to_V(channel, values))
+            else:
+                V_data.append(None)
+
+        return time_values, V_data
 
     def _get_values(self, num_samples, num_captures):
         """Get data from device and return buffer or None."""
+        t_start = time.perf_counter()
+        self.stats.disarmed(self._t_ready)
         num_samples = ctypes.c_uint32(num_samples)
-        overflow = (ctypes.c_int16 * num_captures)()
+        overflow = np.zeros(num_captures, dtype=np.uint16)
+        downsample_mode, downsample_ratio = self._downsample
+        if downsample_mode == 'NONE':
+            downsample_ratio = 0
 
         status = ps.ps3000aGetValuesBulk(
-            self._handle, ctypes.byref(num_samples), 0, num_captures - 1, 0, 0,
-            ctypes.byref(overflow))
+            self._handle, ctypes.byref(num_samples), 0, num_captures - 1,
+            downsample_ratio, _get_ratio_mode_from_name(downsample_mode),
+            overflow.ctypes.data_as(ctypes.POINTER(ctypes.c_int16)))
         status_msg = PICO_STATUS_LOOKUP[status]
 
         if status_msg == "PICO_OK":
+            self._overflow = overflow
+            self._trigger_times = self._get_trigger_times(num_captures)
+            num_bytes = (2 * num_samples.value * num_captures
+                         * len(self._buffers))
+            if downsample_mode == 'AGGREGATE':
+                num_bytes *= 2
+            self.stats.read_out(time.perf_counter() - t_start, num_captures,
+                                num_bytes)
             return [self._buffers[channel] if is_enabled is True else None
                     for channel, is_enabled in self._channels_enabled.items()]
         elif status_msg == "PICO_NO_SAMPLES_AVAILABLE":
@@ -458,8 +984,37 @@ class PicoScope3000A:
         else:
             raise PicoSDKError(f"PicoSDK returned {status_msg}")
 
+    def _get_trigger_times(self, num_captures):
+        """Get trigger times of all captures and return them in ps."""
+        times = np.zeros(num_captures, dtype=np.int64)
+        units = np.zeros(num_captures, dtype=np.int32)
+        assert_pico_ok(ps.ps3000aGetValuesTriggerTimeOffsetBulk64(
+            self._handle,
+            times.ctypes.data_as(ctypes.POINTER(ctypes.c_int64)),
+            units.ctypes.data_as(ctypes.POINTER(ctypes.c_int32)),
+            0, num_captures - 1))
+        # Units are PS3000A_TIME_UNITS, from FS (0) to S (5)
+        scale = 10.0**(3 * (units.astype(np.int64) - 1))
+        times = times * scale
+
+        if self._trigger_info_supported:
+            info = (_TriggerInfo * num_captures)()
+            status = ps.ps3000aGetTriggerInfoBulk(
+                self._handle, ctypes.byref(info), 0, num_captures - 1)
+            if PICO_STATUS_LOOKUP[status] == "PICO_OK":
+                counter = np.frombuffer(info, dtype=np.dtype({
+                    'names': ['timeStampCounter'], 'formats': [np.uint64],
+                    'offsets': [_TriggerInfo.timeStampCounter.offset],
+                    'itemsize': ctypes.sizeof(_TriggerInfo)}))
+                counter = counter['timeStampCounter']
+                times += counter * (self._sample_interval * 1000)
+            else:
+                self._trigger_info_supported = False
+        return np.rint(times).astype(np.int64)
+
     def stop(self):
         """Stop data capture."""
+        self.stats.disarmed(self._t_ready)
         assert_pico_ok(ps.ps3000aStop(self._handle))
 
     def set_trigger(self, channel_name, threshold=0., direction='RISING',
@@ -486,6 +1041,242 @@ class PicoScope3000A:
             self._handle, is_enabled, channel, threshold, direction, delay,
             auto_trigger))
 
+    def set_advanced_trigger(self, thresholds, direction='RISING',
+                             logic='AND', hysteresis=0.01, delay=0,
+                             auto_trigger=0):
+        """Set a trigger on a logical combination of channels.
+
+        The device triggers when the threshold condition is met on all
+        ('AND') or on any ('OR') of the given channels, so e.g. only
+        coincidences of two detectors are captured and transferred.
+
+        :param thresholds: dictionary of the trigger thresholds (in V) of
+            the source channels, e.g. {'A': -0.05, 'B': -0.1}
+        :param direction: the direction in which the signal must move to
+            cause a trigger, either one for all channels or a dictionary
+            with a direction for each source channel
+        :param logic: 'AND' or 'OR'
+        :param hysteresis: the hysteresis of the thresholds (in V)
+        :param delay: the delay between the trigger occuring and the start of
+            capturing data, in number of sample periods
+        :param auto_trigger: the maximum amount of time to wait for a trigger
+            before starting capturing data in miliseconds
+
+        See :method:`set_trigger` for the direction values. For the 'AND'
+        logic, 'RISING' and 'FALLING' are edge conditions, so the edges in
+        all channels must happen at the same moment; use 'ABOVE' or
+        'BELOW' to require levels instead.
+        """
+        if logic not in ['AND', 'OR']:
+            raise InvalidParameterError(f"Trigger logic {logic} is not "
+                                        "supported")
+        if len(thresholds) == 0:
+            raise InvalidParameterError("No trigger source channels given")
+        if not isinstance(direction, dict):
+            direction = {channel_name: direction
+                         for channel_name in thresholds}
+
+        true = ps.PS3000A_TRIGGER_STATE['PS3000A_CONDITION_TRUE']
+        dont_care = ps.PS3000A_TRIGGER_STATE['PS3000A_CONDITION_DONT_CARE']
+        fields = []
+        for channel_name in thresholds:
+            _get_channel_from_name(channel_name)
+            fields.append('channel' + channel_name)
+        # Conditions are ORed by the driver, fields of a single condition
+        # are ANDed
+        if logic == 'AND':
+            groups = [fields]
+        else:
+            groups = [[field] for field in fields]
+        conditions = (ps.PS3000A_TRIGGER_CONDITIONS * len(groups))()
+        for condition, group in zip(conditions, groups):
+            for name, _ in condition._fields_:
+                setattr(condition, name, true if name in group else dont_care)
+
+        none = _get_trigger_direction_from_name('NONE')
+        directions = {name: none for name in ['A', 'B', 'C', 'D']}
+        properties = (ps.PS3000A_TRIGGER_CHANNEL_PROPERTIES
+                      * len(thresholds))()
+        level = ps.PS3000A_THRESHOLD_MODE['PS3000A_LEVEL']
+        for prop, (channel_name, threshold) in zip(properties,
+                                                   thresholds.items()):
+            directions[channel_name] = _get_trigger_direction_from_name(
+                direction[channel_name])
+            threshold = int(self._rescale_V_to_adc(channel_name, threshold))
+            hysteresis_adc = int(abs(hysteresis)
+                                 * self._input_adc_ranges[channel_name]
+                                 / self._input_voltage_ranges[channel_name])
+            prop.thresholdUpper = threshold
+            prop.thresholdUpperHysteresis = hysteresis_adc
+            prop.thresholdLower = threshold
+            prop.thresholdLowerHysteresis = hysteresis_adc
+            prop.channel = _get_channel_from_name(channel_name)
+            prop.thresholdMode = level
+
+        assert_pico_ok(ps.ps3000aSetTriggerChannelConditions(
+            self._handle, ctypes.byref(conditions), len(conditions)))
+        assert_pico_ok(ps.ps3000aSetTriggerChannelDirections(
+            self._handle, directions['A'], directions['B'], directions['C'],
+            directions['D'], none, none))
+        assert_pico_ok(ps.ps3000aSetTriggerChannelProperties(
+            self._handle, ctypes.byref(properties), len(properties), 0,
+            auto_trigger))
+        assert_pico_ok(ps.ps3000aSetTriggerDelay(self._handle, delay))
+
+    def start_streaming(self, sample_interval, time_units='NS',
+                        num_pre_samples=0, num_post_samples=0,
+                        buffer_size=100000, ring_size=None, max_read=None,
+                        poll_interval=0.001):
+        """Start a continuous data collection in streaming mode.
+
+        The device continuously transfers data to the driver buffers of
+        buffer_size samples. A background thread polls the driver and copies
+        every new chunk into a preallocated host ring buffer, from which the
+        data may be taken with :method:`get_streaming_values`. There are no
+        gaps in the data stream as long as the consumer keeps up with the
+        ring buffer, the number of lost samples is available as
+        :attr:`streaming_overruns`. When done, call :method:`stop_streaming`.
+
+        If num_post_samples is 0, the run is continuous until stopped,
+        otherwise the device stops automatically after collecting
+        num_pre_samples + num_post_samples samples, counted from the trigger
+        (if enabled).
+
+        :param sample_interval: requested time between samples
+        :param time_units: units of sample_interval ('FS', 'PS', 'NS', 'US',
+            'MS' or 'S')
+        :param num_pre_samples: number of samples before the trigger
+        :param num_post_samples: number of samples after the trigger
+        :param buffer_size: size of the driver buffers (per channel)
+        :param ring_size: size of the host ring buffer (per channel),
+            defaults to 100 driver buffers
+        :param max_read: maximum number of samples in a single read from the
+            ring buffer, defaults to a quarter of the ring size
+        :param poll_interval: time in seconds between polls of the driver
+            when no new data were available
+
+        :returns: actual sample interval (in time_units)
+        """
+        if ring_size is None:
+            ring_size = 100 * buffer_size
+        channels = self._get_enabled_channels()
+        self._buffer_layout = None
+        self._stream_buffers = {}
+        for channel_name in channels:
+            buffer = np.zeros(buffer_size, dtype=np.int16)
+            assert_pico_ok(ps.ps3000aSetDataBuffer(
+                self._handle, _get_channel_from_name(channel_name),
+                buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
+                buffer_size, 0,
+                ps.PS3000A_RATIO_MODE['PS3000A_RATIO_MODE_NONE']))
+            self._stream_buffers[channel_name] = buffer
+        self._stream = RingBuffer(len(channels), ring_size, max_read)
+        self._stream_channels = channels
+        self._stream_auto_stop = False
+        self._stream_error = None
+        self._streaming_callback = ps.StreamingReadyType(
+            self._streaming_ready)
+
+        interval = ctypes.c_uint32(sample_interval)
+        auto_stop = 1 if num_post_samples > 0 else 0
+        assert_pico_ok(ps.ps3000aRunStreaming(
+            self._handle, ctypes.byref(interval),
+            _get_time_units_from_name(time_units), num_pre_samples,
+            num_post_samples, auto_stop, 1,
+            ps.PS3000A_RATIO_MODE['PS3000A_RATIO_MODE_NONE'], buffer_size))
+
+        self._streaming = True
+        self._stream_thread = Thread(target=self._poll_streaming,
+                                     args=(poll_interval,), daemon=True)
+        self._stream_thread.start()
+        return interval.value
+
+    def _streaming_ready(self, handle, num_samples, start_index, overflow,
+                         trigger_at, triggered, auto_stop, parameters):
+        """Copy new samples to the ring buffer, called by PicoSDK."""
+        end = start_index + num_samples
+        self._stream.write([self._stream_buffers[channel][start_index:end]
+                            for channel in self._stream_channels])
+        if auto_stop:
+            self._stream_auto_stop = True
+
+    def _poll_streaming(self, poll_interval):
+        """Poll the driver for new streaming data until stopped.
+
+        When the polling ends (stop, auto stop or driver error) the ring
+        buffer is closed, so a consumer waiting for data wakes up.
+        """
+        try:
+            while self._streaming and not self._stream_auto_stop:
+                written = self._stream.total_written
+                status = ps.ps3000aGetStreamingLatestValues(
+                    self._handle, self._streaming_callback, None)
+                status_msg = PICO_STATUS_LOOKUP[status]
+                if status_msg not in ("PICO_OK", "PICO_BUSY"):
+                    self._stream_error = PicoSDKError(
+                        f"PicoSDK returned {status_msg}")
+                    self._streaming = False
+                if self._stream.total_written == written:
+                    time.sleep(poll_interval)
+        except Exception as err:
+            self._stream_error = err
+            self._streaming = False
+        finally:
+            self._stream.close()
+
+    def get_streaming_values(self, num_samples=None, timeout=None):
+        """Return a contiguous view of the streamed data, in ADC values.
+
+        The data stay in the ring buffer until released with
+        :method:`release_streaming_values`, the views are valid until then.
+
+        :param num_samples: number of samples required, if None all
+            available samples (up to max_read) are returned
+        :param timeout: maximum time to wait for the data in seconds
+
+        When the streaming ended (auto stop or :method:`stop_streaming`) the
+        remaining data are returned without waiting and then views of 0
+        samples mark the end of the stream. If the driver failed, the error
+        is raised, also in a consumer waiting for the data.
+
+        :returns: index of the first sample since the start of streaming and
+            a list of per channel views (None for disabled channels), or
+            None, None on timeout
+        """
+        if self._stream_error is not None:
+            raise self._stream_error
+        start, view = self._stream.read(num_samples, timeout)
+        if self._stream_error is not None:
+            raise self._stream_error
+        if view is None:
+            return None, None
+        rows = dict(zip(self._stream_channels, view))
+        return start, [rows.get(channel)
+                       for channel in self._channels_enabled]
+
+    def release_streaming_values(self, num_samples):
+        """Mark streamed data as consumed.
+
+        :param num_samples: number of samples to release
+        """
+        self._stream.release(num_samples)
+
+    @property
+    def streaming_overruns(self):
+        """Number of streamed samples lost because the ring buffer was full."""
+        if self._stream is None:
+            return 0
+        return self._stream.overruns
+
+    def stop_streaming(self):
+        """Stop the streaming mode data collection.
+
+        Data remaining in the ring buffer may still be read afterwards.
+        """
+        self._streaming = False
+        self._stream_thread.join()
+        self.stop()
+
     def _get_enabled_channels(self):
         """Return list of enabled channels."""
         return [channel for channel, status in self._channels_enabled.items()
@@ -522,6 +1313,26 @@ def _get_range_from_value(range):
     return ps.PS3000A_RANGE[def_name]
 
 
+def _get_time_units_from_name(time_units_name):
+    """Return the time units from the time units name."""
+    if time_units_name in ['FS', 'PS', 'NS', 'US', 'MS', 'S']:
+        def_name = f"PS3000A_{time_units_name}"
+    else:
+        raise InvalidParameterError(f"Time units {time_units_name} are not "
+                                    "supported")
+    return ps.PS3000A_TIME_UNITS[def_name]
+
+
+def _get_ratio_mode_from_name(ratio_mode_name):
+    """Return the downsampling ratio mode from the mode name."""
+    if ratio_mode_name in ['NONE', 'AGGREGATE', 'DECIMATE', 'AVERAGE']:
+        def_name = f"PS3000A_RATIO_MODE_{ratio_mode_name}"
+    else:
+        raise InvalidParameterError(f"Downsampling mode {ratio_mode_name} is "
+                                    "not supported")
+    return ps.PS3000A_RATIO_MODE[def_name]
+
+
 def _get_trigger_direction_from_name(direction_name):
     """Return the trigger direction from the direction name."""
 
@@ -539,7 +1350,7 @@ def _get_trigger_direction_from_name(direction_name):
         "PS3000A_NEGATIVE_RUNT",
     ])
     if direction_name in ['ABOVE', 'BELOW', 'RISING', 'FALLING',
-                          'RISING_OR_FALLING']:
+                          'RISING_OR_FALLING', 'NONE']:
         def_name = f"PS3000A_{direction_name}"
     else:
         raise InvalidParameterError(f"Trigger direction {direction_name} is "
@@ -547,10 +1358,24 @@ def _get_trigger_direction_from_name(direction_name):
     return PS3000A_THRESHOLD_DIRECTION[def_name]
 
 
-def callback_factory(event):
-    """Return callback that will signal event when called."""
+def callback_factory(event, notify=None):
+    """Return callback that will signal event when called.
+
+    If notify is given, it is called instead and must set the event itself,
+    so it can record anything the waiting thread needs (e.g. the time the
+    data was ready) before the thread is woken up.
+    """
     @ctypes.CFUNCTYPE(None, ctypes.c_int16, ctypes.c_int, ctypes.c_void_p)
     def data_is_ready_callback(handle, status, parameters):
         """Signal that data is ready when called by PicoSDK."""
-        event.set()
+        if notify is not None:
+            notify()
+        else:
+            event.set()
     return data_is_ready_callback
+
+
+def _set_future_done(future):
+    """Mark the future waiting for data as done (unless cancelled)."""
+    if not future.done():
+        future.set_result(True)
@@ -0,0 +1,216 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Pipelined (double buffered) rapid block acquisition.
+
+"""
+
+import queue
+import time
+from threading import Thread
+
+import numpy as np
+
+
+class PipelinedAcquisition:
+    """Rapid block acquisition overlapping device capture with host
+    processing.
+
+    The device is re-armed right after the data of the previous run is read
+    out (ps3000aGetValuesBulk), while the data are copied from the single
+    set of buffers registered in the driver to one of several host buffer
+    sets, used in turn, and handed over to a consumer thread. So the
+    capture N+1 runs while the batch N is copied and processed. The driver
+    buffers are registered once, at the start, and the device is not
+    stopped between the runs: a block run is over when the data are ready,
+    ps3000aRunBlock starts the next one and the buffers stay valid. If the
+    consumer is slower than the device, the copy waits for a free host
+    buffer set (the device keeps capturing in the meantime).
+
+    The consumer is called with a list of captured data for each channel
+    (None for disabled channels), same as returned by
+    :method:`PicoScope3000A.measure_adc_values`. The data is valid only until
+    the consumer returns, and must be copied if needed later. With
+    trigger_times set, the consumer is also given the trigger times of the
+    captures in ps (see :method:`PicoScope3000A.get_trigger_times`), shifted
+    by the host time of arming of each run, counted from the start of the
+    acquisition.
+
+    Methods
+    -------
+    start()
+        Start the acquisition and processing threads
+    stop()
+        Stop the acquisition and wait for the processing to finish
+
+    """
+
+    def __init__(self, scope, consumer, num_pre_samples, num_post_samples,
+                 timebase=1, num_captures=1, num_buffers=2,
+                 trigger_times=False):
+        """Set up the pipeline.
+
+        :param scope: PicoScope3000A instance, with channels and trigger
+            already set up
+        :param consumer: function called with every batch of data
+        :param num_pre_samples: number of samples before the trigger
+        :param num_post_samples: number of samples after the trigger
+        :param timebase: timebase setting (see programmers guide for
+            reference)
+        :param num_captures: number of captures in a batch
+        :param num_buffers: number of host buffer sets (at least 2)
+        :param trigger_times: if True, the consumer is called with
+            data, trigger_times
+        """
+        if num_buffers < 2:
+            raise ValueError("At least 2 buffer sets are required")
+        self.scope = scope
+        self.consumer = consumer
+        self.num_pre_samples = num_pre_samples
+        self.num_post_samples = num_post_samples
+        self.num_samples = num_pre_samples + num_post_samples
+        self.timebase = timebase
+        self.num_captures = num_captures
+        self.num_buffers = num_buffers
+        self.trigger_times = trigger_times
+        self._running = False
+        self._error = None
+        self.batches_acquired = 0
+        self.batches_processed = 0
+        self.live_time = 0.0
+        self.rearm_time = 0.0
+        self._t_start = None
+        self._t_stop = None
+
+    @property
+    def elapsed_time(self):
+        """Wall clock time since the start of the acquisition, in seconds."""
+        if self._t_start is None:
+            return 0.0
+        if self._t_stop is None:
+            return time.perf_counter() - self._t_start
+        return self._t_stop - self._t_start
+
+    @property
+    def duty_cycle(self):
+        """Fraction of the elapsed time the device was armed.
+
+        The time spent on registering the buffers, reading out and
+        re-arming (:attr:`rearm_time`) counts as dead time.
+        """
+        elapsed = self.elapsed_time
+        if elapsed == 0:
+            return 0.0
+        return self.live_time / elapsed
+
+    @property
+    def dead_time(self):
+        """Fraction of the elapsed time the device was not armed."""
+        return 1.0 - self.duty_cycle
+
+    def start(self):
+        """Start the acquisition and processing threads."""
+        # The first set is registered in the driver, the others are
+        # the host buffer sets
+        buffer_sets = self.scope.allocate_buffer_sets(
+                self.num_samples, self.num_captures, self.num_buffers + 1)
+        self._driver_buffers = buffer_sets[0]
+        self._buffer_sets = buffer_sets[1:]
+        self._free = queue.Queue()
+        for i in range(self.num_buffers):
+            self._free.put(i)
+        self._full = queue.Queue()
+        self._error = None
+        self.batches_acquired = 0
+        self.batches_processed = 0
+        self.live_time = 0.0
+        self.rearm_time = 0.0
+        self._running = True
+        self._t_start = time.perf_counter()
+        self._t_stop = None
+        self._consumer_thread = Thread(target=self._process, daemon=True)
+        self._consumer_thread.start()
+        self._acquisition_thread = Thread(target=self._acquire, daemon=True)
+        self._acquisition_thread.start()
+
+    def stop(self):
+        """Stop the acquisition and wait for the processing to finish.
+
+        Any exception raised in the acquisition or in the consumer is
+        re-raised here.
+        """
+        self._running = False
+        self._acquisition_thread.join()
+        self._consumer_thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _arm(self):
+        """Start the next run, return time of arming."""
+        t_arm = time.perf_counter()
+        self.scope.start_run(self.num_pre_samples, self.num_post_samples,
+                             self.timebase, self.num_captures)
+        return t_arm
+
+    def _acquire(self):
+        """Acquisition loop, keeps the device armed as much as possible."""
+        try:
+            t_start = time.perf_counter()
+            self.scope.swap_buffers(self._driver_buffers)
+            t_arm = self._arm()
+            self.rearm_time += time.perf_counter() - t_start
+            self.scope.rearm_time = time.perf_counter() - t_start
+            while self._running:
+                if not self.scope.wait_for_data(0.1):
+                    continue
+                t_ready = time.perf_counter()
+                self.live_time += t_ready - t_arm
+                data = self.scope.get_adc_data()
+                trigger_times = self.scope.get_trigger_times()
+                if trigger_times is not None:
+                    trigger_times = trigger_times + int(
+                        (t_arm - self._t_start) * 1e12)
+                t_arm = self._arm()
+                self.rearm_time += time.perf_counter() - t_ready
+                self.scope.rearm_time = time.perf_counter() - t_arm
+                if data is None:
+                    continue
+                # The next readout overwrites the driver buffers, the data
+                # are copied to a host buffer set before it
+                current = self._free.get()
+                batch = self._buffer_sets[current]
+                copied = []
+                for channel, values in zip(self.scope.channels, data):
+                    if values is not None:
+                        np.copyto(batch[channel], values)
+                        values = batch[channel]
+                    copied.append(values)
+                self.batches_acquired += 1
+                self._full.put((current, copied, trigger_times))
+            self.scope.stop()
+        except Exception as err:
+            self._error = err
+            self._running = False
+        finally:
+            self._t_stop = time.perf_counter()
+            self._full.put(None)
+
+    def _process(self):
+        """Processing loop, hands over the batches to the consumer."""
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            current, data, trigger_times = item
+            try:
+                if data is not None and self._error is None:
+                    if self.trigger_times:
+                        self.consumer(data, trigger_times)
+                    else:
+                        self.consumer(data)
+                    self.batches_processed += 1
+            except Exception as err:
+                self._error = err
+                self._running = False
+            self._free.put(current)
@@ -0,0 +1,278 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Multiprocess signal processing of capture blocks, with the raw data
+passed to the workers through shared memory.
+
+"""
+
+import collections
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import PicoNuclear.tools as tools
+
+
+class ProcessingPool:
+    """Pool of worker processes extracting hits from capture blocks.
+
+    Raw int16 blocks (all channels of a batch of captures) are copied into
+    one of the preallocated shared memory slots and processed by a free
+    worker with :func:`tools.extract_hits`. Only the compact arrays of hits
+    are sent back. A slot is reused once its result has been collected.
+
+    If all slots are busy (the workers fall behind the acquisition), the
+    policy decides what happens to a new block: with 'drop' it is rejected
+    immediately, with 'block' the caller waits for a free slot (up to the
+    given timeout). The number of dropped blocks is kept in
+    :attr:`dropped`.
+
+    The workers use the DSP backend selected (tools.set_backend) when the
+    pool is started.
+
+    Methods
+    -------
+    start()
+        Start the worker processes
+    submit()
+        Queue a block of data for processing
+    get()
+        Return the next processed block
+    results()
+        Return all processed blocks available now
+    close()
+        Stop the workers and release the shared memory
+
+    """
+
+    def __init__(self, config, clock, num_samples, num_captures,
+                 channels=('A', 'B'), num_workers=None, num_slots=None,
+                 policy='drop', pileup='max', falling=False, scale=None,
+                 on_overflow='reject'):
+        """Set up the pool, the workers are started with :method:`start`.
+
+        :param config: configuration (see tools.load_configuration)
+        :param clock: sampling interval in ns
+        :param num_samples: number of samples per capture
+        :param num_captures: maximum number of captures in a block
+        :param channels: names of the channels in a block
+        :param num_workers: number of worker processes, defaults to the
+            number of CPUs
+        :param num_slots: number of shared memory slots, defaults to twice
+            the number of workers
+        :param policy: 'drop' or 'block', see above
+        :param pileup, falling, scale, on_overflow: see tools.extract_hits
+        """
+        if policy not in ['drop', 'block']:
+            raise ValueError(f"Policy {policy} is not supported")
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if num_slots is None:
+            num_slots = 2 * num_workers
+        self.config = config
+        self.clock = clock
+        self.channels = tuple(channels)
+        self._index = {name: i for i, name in enumerate(self.channels)}
+        self.shape = (len(self.channels), num_captures, num_samples)
+        self.num_workers = num_workers
+        self.num_slots = num_slots
+        self.policy = policy
+        self.options = {'pileup': pileup, 'falling': falling, 'scale': scale,
+                        'on_overflow': on_overflow}
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self._workers = []
+
+    def start(self):
+        """Allocate the shared memory slots and start the workers."""
+        size = int(np.prod(self.shape)) * np.dtype(np.int16).itemsize
+        self._memory = [shared_memory.SharedMemory(create=True, size=size)
+                        for i in range(self.num_slots)]
+        self._slots = [np.ndarray(self.shape, dtype=np.int16,
+                                  buffer=memory.buf)
+                       for memory in self._memory]
+        self._free = collections.deque(range(self.num_slots))
+        self._ready = collections.deque()
+        # Workers are spawned, forking a process running the acquisition
+        # threads (or numba thread pool) is not safe
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        names = [memory.name for memory in self._memory]
+        for i in range(self.num_workers):
+            worker = context.Process(
+                    target=_worker,
+                    args=(names, self.shape, self.config, self.clock,
+                          self.channels, self.options, self._tasks,
+                          self._results, tools.get_backend()),
+                    daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def pending(self):
+        """Number of blocks submitted, but not yet collected."""
+        return self.num_slots - len(self._free) + len(self._ready)
+
+    def submit(self, data, tag=None, timeout=None, trigger_times=None,
+               overflow=None):
+        """Queue a block of data for processing.
+
+        :param data: list of (captures, samples) int16 arrays, one per
+            channel (in order of channels, None for channels not used, e.g.
+            disabled), or dictionary of arrays keyed by channel name
+        :param tag: any picklable object returned together with the hits
+            (e.g. batch number or trigger times)
+        :param timeout: with the 'block' policy, maximum time to wait for
+            a free slot in seconds (None waits forever)
+        :param trigger_times: (optional) trigger times of the captures
+        :param overflow: (optional) overflow bit masks of the captures
+            (see tools.extract_hits)
+
+        :returns: True if the block was queued, False if it was dropped
+        :raises ValueError: if the block does not fit in a slot
+        """
+        blocks = self._blocks(data)
+        num_captures = blocks[0][1].shape[0] if blocks else 0
+        for name, values in blocks:
+            if values.shape[0] != num_captures:
+                raise ValueError("Channels of a block differ in the number "
+                                 "of captures")
+            if (values.shape[0] > self.shape[1]
+                    or values.shape[1] != self.shape[2]):
+                raise ValueError(
+                        f"Block of channel {name} {values.shape} does not "
+                        f"fit in a slot of {self.shape[1]} captures of "
+                        f"{self.shape[2]} samples")
+
+        self._collect(block=False)
+        if len(self._free) == 0 and self.policy == 'block':
+            self._collect(block=True, timeout=timeout)
+        if len(self._free) == 0:
+            self.dropped += 1
+            return False
+        slot = self._free.popleft()
+        for name, values in blocks:
+            self._slots[slot][self._index[name], :num_captures] = values
+        present = tuple(name for name, values in blocks)
+        self._tasks.put((slot, num_captures, present, tag, trigger_times,
+                         overflow))
+        self.submitted += 1
+        return True
+
+    def _blocks(self, data):
+        """Return list of (channel name, array) of the channels used."""
+        if isinstance(data, dict):
+            items = data.items()
+        else:
+            extra = [values for values in data[len(self.channels):]
+                     if values is not None]
+            if extra:
+                raise ValueError("Block has more channels than "
+                                 f"{self.channels}")
+            items = zip(self.channels, data)
+        blocks = []
+        for name, values in items:
+            if values is None:
+                continue
+            if name not in self._index:
+                raise ValueError(f"Channel {name} is not in {self.channels}")
+            blocks.append((name, np.atleast_2d(values)))
+        return blocks
+
+    def get(self, timeout=None):
+        """Return the next processed block.
+
+        :param timeout: maximum time to wait in seconds, None waits forever
+
+        :returns: tag, hits (structured array, see tools.HIT_DTYPE) or
+            None, None on timeout
+        :raises RuntimeError: if no block is pending (nothing would ever
+            be returned)
+        """
+        if self.pending == 0:
+            raise RuntimeError("No blocks were submitted to get")
+        if len(self._ready) == 0:
+            self._collect(block=True, timeout=timeout)
+        if len(self._ready) == 0:
+            return None, None
+        return self._ready.popleft()
+
+    def results(self):
+        """Return list of all (tag, hits) processed blocks available now."""
+        self._collect(block=False)
+        ready = list(self._ready)
+        self._ready.clear()
+        return ready
+
+    def _collect(self, block=False, timeout=None):
+        """Move finished results from the workers, freeing their slots."""
+        while True:
+            try:
+                slot, tag, hits = self._results.get(block, timeout)
+            except queue.Empty:
+                return
+            self._free.append(slot)
+            if isinstance(hits, Exception):
+                raise hits
+            self.processed += 1
+            self._ready.append((tag, hits))
+            block = False
+
+    def close(self):
+        """Stop the workers and release the shared memory.
+
+        Blocks not yet processed are discarded.
+        """
+        for worker in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self._slots = []
+        for memory in self._memory:
+            memory.close()
+            memory.unlink()
+        self._memory = []
+
+
+def _worker(names, shape, config, clock, channels, options, tasks, results,
+            backend):
+    """Worker process, extracts hits from blocks in shared memory slots."""
+    # Spawned process starts with the default backend, not the parent's
+    tools.set_backend(backend)
+    if backend == 'numba':
+        # Parallelism comes from the worker processes
+        tools.numba.set_num_threads(1)
+    memory = [shared_memory.SharedMemory(name=name) for name in names]
+    slots = [np.ndarray(shape, dtype=np.int16, buffer=m.buf) for m in memory]
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, num_captures, present, tag, trigger_times, overflow = task
+        data = [block[:num_captures] if name in present else None
+                for name, block in zip(channels, slots[slot])]
+        try:
+            hits = tools.extract_hits(
+                    data, config, clock, channels,
+                    trigger_times=trigger_times,
+                    overflow=overflow, **options)
+        except Exception as err:
+            hits = err
+        results.put((slot, tag, hits))
+    slots = []
+    for m in memory:
+        m.close()
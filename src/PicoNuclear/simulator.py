@@ -0,0 +1,650 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Simulated PicoScope, used for tests and benchmarks without the hardware
+(and without the PicoSDK).
+
+"""
+
+import asyncio
+import time
+from threading import Event
+
+import numpy as np
+
+from PicoNuclear.stats import AcquisitionStats
+
+
+CHANNELS = ['A', 'B', 'C', 'D']
+MAX_ADC = 32512
+MAX_SEGMENTS = 32768
+DOWNSAMPLE_MODES = ['NONE', 'AGGREGATE', 'DECIMATE', 'AVERAGE']
+
+
+class SimulatedPicoScope:
+    """Simulated 3000 Series PicoScope.
+
+    The class has the same interface as pico3000a.PicoScope3000A (channels,
+    trigger, block mode runs and readout), but the data are synthesized:
+    each trigger is a detector pulse (double exponential shape) with the
+    amplitude drawn from a spectrum of lines, on top of a gaussian noise.
+    Other channels see a coincident pulse with a given probability, and
+    random pulses pile up in the traces. Alternatively, recorded waveforms
+    may be replayed (see :method:`replay`).
+
+    The triggers come at random (Poisson) times with the given rate. With
+    realtime set, a run lasts as long as it would on the device, otherwise
+    the data are available immediately.
+
+    Methods
+    -------
+    set_source()
+        Set up the pulses seen in a channel
+    replay()
+        Replay recorded waveforms instead of synthesized ones
+    set_channel()
+        Set up input channels
+    set_trigger()
+        Set the trigger condition
+    measure()
+        Start a data collection run and return the data
+    measure_adc_values()
+        Start a data collection run and return the data in ADC values
+    measure_chunked()
+        Collect any number of captures in a series of runs, in ADC values
+    get_max_captures()
+        Return the number of captures fitting in the memory
+    set_up_buffers()
+        Set up memory buffers for reading data
+    allocate_buffer_sets()
+        Return new sets of data buffers
+    swap_buffers()
+        Register a set of data buffers, filled by the following readouts
+    start_run()
+        Start a run in (rapid) block mode
+    wait_for_data()
+        Wait for the run to finish
+    get_adc_data()
+        Return all captured data, in ADC values
+    get_data()
+        Return all captured data, in physical units
+
+    """
+
+    def __init__(self, serial=None, num_channels=2, rate=1000.0,
+                 coincidence=1.0, realtime=False, seed=None,
+                 memory=64 * 2**20):
+        """Instantiate the simulated device.
+
+        :param serial: ignored, for compatibility
+        :param num_channels: number of channels (2 or 4)
+        :param rate: trigger rate in Hz
+        :param coincidence: probability that a pulse in the trigger source
+            is accompanied by a pulse in each of the other channels
+        :param realtime: if True, runs take as long as the simulated time
+            of the captures
+        :param seed: seed of the random number generator
+        :param memory: capture memory in samples (shared by the enabled
+            channels, see :method:`get_max_captures`)
+        """
+        if num_channels not in [2, 4]:
+            raise ValueError(f"Devices have 2 or 4 channels, not "
+                             f"{num_channels}")
+        self.rate = rate
+        self.coincidence = coincidence
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.memory = memory
+        self.capture_rate = 0.0
+        self._channels_enabled = {ch: False for ch in CHANNELS[:num_channels]}
+        self._input_voltage_ranges = {}
+        self._input_offsets = {}
+        self._sources = {}
+        for channel_name in self._channels_enabled:
+            self.set_channel(channel_name, is_enabled=False)
+            self.set_source(channel_name)
+        self._trigger = {'sources': ['A'], 'logic': 'OR'}
+        self._replay = None
+        self._replay_position = 0
+        self._buffers = {}
+        self._buffer_layout = None
+        self._downsample = ('NONE', 1)
+        self._captured = None
+        self._trigger_times = None
+        self._overflow = None
+        self._ready_at = 0.0
+        self.rearm_time = 0.0
+        self.stats = AcquisitionStats()
+        self.data_is_ready = Event()
+
+    def open(self, serial=None):
+        """Open the device (nothing to do)."""
+        pass
+
+    def close(self):
+        """Close the device (nothing to do)."""
+        pass
+
+    @property
+    def channels(self):
+        """Names of the channels of the device."""
+        return list(self._channels_enabled)
+
+    @property
+    def enabled_channels(self):
+        """Names of the enabled channels."""
+        return self._get_enabled_channels()
+
+    def _get_enabled_channels(self):
+        """Return list of enabled channels."""
+        return [channel for channel, status in self._channels_enabled.items()
+                if status is True]
+
+    def set_source(self, channel_name, lines=((0.5, 1.0),), resolution=0.03,
+                   background=0.2, noise=0.002, rise_time=10.0,
+                   decay_time=200.0, polarity=-1, pileup=None):
+        """Set up the pulses seen in a channel.
+
+        :param channel_name: channel name
+        :param lines: list of (amplitude in V, relative intensity) of the
+            lines of the amplitude spectrum
+        :param resolution: relative width (sigma) of the lines
+        :param background: fraction of pulses with amplitude uniformly
+            distributed up to the highest line
+        :param noise: sigma of the gaussian noise in V
+        :param rise_time: rise time constant of pulses in ns
+        :param decay_time: decay time constant of pulses in ns
+        :param polarity: -1 for negative, 1 for positive pulses
+        :param pileup: probability of an additional random pulse in a
+            capture, if None it follows from the trigger rate
+        """
+        if channel_name not in self._channels_enabled:
+            raise ValueError(f"Channel {channel_name} is not supported")
+        amplitudes, weights = np.array(lines, dtype=float).T
+        self._sources[channel_name] = {
+            'amplitudes': amplitudes,
+            'weights': weights / weights.sum(),
+            'resolution': resolution,
+            'background': background,
+            'noise': noise,
+            'rise_time': rise_time,
+            'decay_time': decay_time,
+            'polarity': polarity,
+            'pileup': pileup}
+
+    def replay(self, data):
+        """Replay recorded waveforms instead of synthesized ones.
+
+        The recorded captures are returned in turn (and from the beginning
+        when all were used).
+
+        :param data: dictionary of (captures, samples) int16 arrays of ADC
+            values, one per channel, or None to go back to synthesized data
+        """
+        self._replay = data
+        self._replay_position = 0
+
+    def set_channel(self, channel_name, coupling_type='DC', range_value=1,
+                    offset=0, is_enabled=True):
+        """Set up input channels (see PicoScope3000A.set_channel)."""
+        if channel_name not in self._channels_enabled:
+            raise ValueError(f"Channel {channel_name} is not supported")
+        if coupling_type not in ['AC', 'DC']:
+            raise ValueError(f"Coupling type {coupling_type} is not "
+                             "supported")
+        self._input_voltage_ranges[channel_name] = float(range_value)
+        self._input_offsets[channel_name] = float(offset)
+        self._channels_enabled[channel_name] = is_enabled
+        self._buffer_layout = None
+
+    def set_trigger(self, channel_name, threshold=0., direction='RISING',
+                    is_enabled=True, delay=0, auto_trigger=0):
+        """Set the trigger condition (see PicoScope3000A.set_trigger).
+
+        Every simulated trigger is a pulse in the source channel, the
+        threshold and direction are not checked.
+        """
+        if channel_name not in self._channels_enabled:
+            raise ValueError(f"Channel {channel_name} is not supported")
+        self._trigger = {'sources': [channel_name], 'logic': 'OR'}
+
+    def set_advanced_trigger(self, thresholds, direction='RISING',
+                             logic='AND', hysteresis=0.01, delay=0,
+                             auto_trigger=0):
+        """Set a trigger on a logical combination of channels (see
+        PicoScope3000A.set_advanced_trigger).
+
+        With the 'AND' logic, every trigger has pulses in all source
+        channels. With 'OR', each capture is triggered by one of the
+        source channels, drawn at random.
+        """
+        if logic not in ['AND', 'OR']:
+            raise ValueError(f"Trigger logic {logic} is not supported")
+        self._trigger = {'sources': list(thresholds), 'logic': logic}
+
+    def get_interval_from_timebase(self, timebase, num_samples=1000):
+        """Get sampling interval for given timebase (in ns)."""
+        if timebase < 3:
+            return 2.0**timebase
+        return 8.0 * (timebase - 2)
+
+    def measure(self, num_pre_samples, num_post_samples, timebase=1,
+                num_captures=1, trigger_times=False, downsample_mode='NONE',
+                downsample_ratio=1):
+        """Start a data collection run and return the data (see
+        PicoScope3000A.measure).
+
+        :returns: time_values, data (and trigger_times)
+        """
+        data = self.measure_adc_values(num_pre_samples, num_post_samples,
+                                       timebase, num_captures,
+                                       downsample_mode=downsample_mode,
+                                       downsample_ratio=downsample_ratio)
+        num_samples = num_pre_samples + num_post_samples
+        time_values = (self.get_interval_from_timebase(timebase)
+                       * np.arange(0, num_samples, self._downsample[1]))
+        V_data = [self._rescale_adc_to_V(channel, values)
+                  if values is not None else None
+                  for channel, values in zip(self._channels_enabled, data)]
+        if trigger_times:
+            return time_values, V_data, self._trigger_times
+        return time_values, V_data
+
+    def measure_adc_values(self, num_pre_samples, num_post_samples,
+                           timebase=1, num_captures=1, trigger_times=False,
+                           downsample_mode='NONE', downsample_ratio=1):
+        """Start a data collection run and return the data in ADC values
+        (see PicoScope3000A.measure_adc_values).
+
+        :returns: data (and trigger_times)
+        """
+        num_samples = num_pre_samples + num_post_samples
+        t_start = time.perf_counter()
+        self.set_up_buffers(num_samples, num_captures, downsample_mode,
+                            downsample_ratio)
+        self.start_run(num_pre_samples, num_post_samples, timebase,
+                       num_captures)
+        self.rearm_time = time.perf_counter() - t_start
+        self.wait_for_data()
+        values = self._get_values(num_samples, num_captures)
+        self.stop()
+        if trigger_times:
+            return values, self._trigger_times
+        return values
+
+    def get_max_captures(self, num_samples):
+        """Return the number of captures fitting in the memory (see
+        PicoScope3000A.get_max_captures), the memory is shared by the
+        enabled channels."""
+        num_channels = max(len(self._get_enabled_channels()), 1)
+        num_captures = min(MAX_SEGMENTS,
+                           self.memory // (num_samples * num_channels))
+        if num_captures < 1:
+            raise ValueError(f"The memory cannot fit {num_samples} samples")
+        return num_captures
+
+    def measure_chunked(self, num_pre_samples, num_post_samples, timebase=1,
+                        num_captures=1, trigger_times=False):
+        """Collect any number of captures in a series of runs, in ADC
+        values (see PicoScope3000A.measure_chunked).
+
+        :returns: data (and trigger_times)
+        """
+        if num_captures < 1:
+            raise ValueError(
+                f"At least one capture is required, got {num_captures}")
+        num_samples = num_pre_samples + num_post_samples
+        run_size = min(num_captures, self.get_max_captures(num_samples))
+        runs = [run_size] * (num_captures // run_size)
+        if num_captures % run_size > 0:
+            runs.append(num_captures % run_size)
+
+        data = [np.empty((num_captures, num_samples), dtype=np.int16)
+                if is_enabled is True else None
+                for is_enabled in self._channels_enabled.values()]
+        times = np.empty(num_captures, dtype=np.int64)
+        overflow = np.empty(num_captures, dtype=np.uint16)
+
+        t_start = time.perf_counter()
+        first = 0
+        for size in runs:
+            t_arm = time.perf_counter()
+            values = self.measure_adc_values(num_pre_samples,
+                                             num_post_samples, timebase, size)
+            for result, values in zip(data, values):
+                if result is not None:
+                    result[first:first + size] = values
+            times[first:first + size] = (self._trigger_times
+                                         + int((t_arm - t_start) * 1e12))
+            overflow[first:first + size] = self._overflow
+            first += size
+
+        self.capture_rate = num_captures / (time.perf_counter() - t_start)
+        self._trigger_times = times
+        self._overflow = overflow
+        if trigger_times:
+            return data, times
+        return data
+
+    def measure_relative_adc(self, num_pre_samples, num_post_samples,
+                             timebase=1, num_captures=1, inverse=False,
+                             trigger_times=False):
+        """Start a data collection run and return the data in range 0-1
+        (see PicoScope3000A.measure_relative_adc).
+
+        :returns: time_values, data (and trigger_times)
+        """
+        data = self.measure_adc_values(num_pre_samples, num_post_samples,
+                                       timebase, num_captures)
+        num_samples = num_pre_samples + num_post_samples
+        time_values = (self.get_interval_from_timebase(timebase)
+                       * np.arange(num_samples))
+        V_data = [self._rescale_adc_to_1(values, inverse)
+                  if values is not None else None for values in data]
+        if trigger_times:
+            return time_values, V_data, self._trigger_times
+        return time_values, V_data
+
+    async def measure_async(self, num_pre_samples, num_post_samples,
+                            timebase=1, num_captures=1, timeout=None):
+        """Coroutine version of :method:`measure`."""
+        data = await self.measure_adc_values_async(
+            num_pre_samples, num_post_samples, timebase, num_captures,
+            timeout)
+        num_samples = num_pre_samples + num_post_samples
+        time_values = (self.get_interval_from_timebase(timebase)
+                       * np.arange(num_samples))
+        V_data = [self._rescale_adc_to_V(channel, values)
+                  if values is not None else None
+                  for channel, values in zip(self._channels_enabled, data)]
+        return time_values, V_data
+
+    async def measure_adc_values_async(self, num_pre_samples,
+                                       num_post_samples, timebase=1,
+                                       num_captures=1, timeout=None):
+        """Coroutine version of :method:`measure_adc_values`."""
+        num_samples = num_pre_samples + num_post_samples
+        self.set_up_buffers(num_samples, num_captures)
+        self.start_run(num_pre_samples, num_post_samples, timebase,
+                       num_captures)
+        if not await self.data_ready(timeout):
+            self.stop()
+            raise asyncio.TimeoutError(f"No data within {timeout} s")
+        values = self._get_values(num_samples, num_captures)
+        self.stop()
+        return values
+
+    def set_up_buffers(self, num_samples, num_captures=1,
+                       downsample_mode='NONE', downsample_ratio=1):
+        """Set up memory buffers for reading data, the data may be
+        downsampled (see PicoScope3000A.set_up_buffers)."""
+        if downsample_mode not in DOWNSAMPLE_MODES:
+            raise ValueError(f"Downsampling mode {downsample_mode} is not "
+                             "supported")
+        if downsample_mode == 'NONE':
+            downsample_ratio = 1
+        elif downsample_ratio < 1:
+            raise ValueError(
+                f"Downsample ratio must be positive, got {downsample_ratio}")
+        layout = (num_samples, num_captures,
+                  tuple(self._get_enabled_channels()),
+                  downsample_mode, downsample_ratio)
+        if layout == self._buffer_layout:
+            return
+        buffer_length = -(-num_samples // downsample_ratio)
+        self._set_data_buffers(
+            self._allocate_buffers(buffer_length, num_captures,
+                                   downsample_mode == 'AGGREGATE'),
+            buffer_length, downsample_mode, downsample_ratio)
+        self._buffer_layout = layout
+
+    def allocate_buffer_sets(self, num_samples, num_captures=1, num_sets=2):
+        """Return new sets of data buffers (see
+        PicoScope3000A.allocate_buffer_sets)."""
+        self._buffer_layout = None
+        return [self._allocate_buffers(num_samples, num_captures)
+                for i in range(num_sets)]
+
+    def swap_buffers(self, buffers):
+        """Register a set of data buffers, filled by the following readouts
+        (see PicoScope3000A.swap_buffers)."""
+        num_samples = max([values.shape[-1] for values in buffers.values()],
+                          default=0)
+        self._set_data_buffers(buffers, num_samples)
+
+    def _allocate_buffers(self, num_samples, num_captures=1, aggregate=False):
+        """Return a new set of data buffers for all enabled channels, a
+        (2, captures, samples) array of maxima and minima per channel if
+        aggregate is True."""
+        shape = (num_captures, num_samples)
+        if aggregate:
+            shape = (2,) + shape
+        return {channel: np.zeros(shape, dtype=np.int16)
+                for channel in self._get_enabled_channels()}
+
+    def _set_data_buffers(self, buffers, num_samples, downsample_mode='NONE',
+                          downsample_ratio=1):
+        """Register a set of data buffers, filled by the next readouts."""
+        self._buffer_layout = None
+        self._buffers = buffers
+        self._downsample = (downsample_mode, downsample_ratio)
+
+    def start_run(self, num_pre_samples, num_post_samples, timebase=1,
+                  num_captures=1, callback=None):
+        """Start a run in (rapid) block mode.
+
+        The captures are synthesized right away, the callback is not
+        supported.
+        """
+        self._num_samples = num_pre_samples + num_post_samples
+        self._num_captures = num_captures
+        self._timebase = timebase
+        self.data_is_ready.clear()
+        self.stats.armed()
+        interval = self.get_interval_from_timebase(timebase)
+        if self._replay is not None:
+            self._captured = self._replay_captures(num_captures)
+            intervals = self.rng.exponential(1e12 / self.rate, num_captures)
+        else:
+            self._captured, intervals = self._synthesize(
+                num_pre_samples, self._num_samples, num_captures, interval)
+        intervals[0] = 0
+        self._trigger_times = np.cumsum(intervals).astype(np.int64)
+        self._ready_at = time.perf_counter()
+        if self.realtime:
+            self._ready_at += (self._trigger_times[-1] * 1e-12
+                               + self._num_samples * interval * 1e-9)
+        else:
+            self.data_is_ready.set()
+
+    def wait_for_data(self, timeout=None):
+        """Wait for the run to finish.
+
+        :returns: True if the data is ready, False on timeout
+        """
+        delay = self._ready_at - time.perf_counter()
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        self.data_is_ready.set()
+        return True
+
+    async def data_ready(self, timeout=None):
+        """Wait for the run to finish in an asyncio coroutine.
+
+        :returns: True if the data is ready, False on timeout
+        """
+        delay = self._ready_at - time.perf_counter()
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            return False
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.data_is_ready.set()
+        return True
+
+    def _get_values(self, num_samples, num_captures):
+        """Copy the captured data into the buffers and return them."""
+        t_start = time.perf_counter()
+        self.stats.disarmed(self._ready_at)
+        if self._captured is None:
+            return None
+        num_bytes = 0
+        for channel, values in self._captured.items():
+            if channel in self._buffers:
+                values = _downsample(values[:num_captures],
+                                     *self._downsample)
+                self._buffers[channel][..., :num_captures, :] = values
+                num_bytes += values.nbytes
+        self._captured = None
+        self.stats.read_out(time.perf_counter() - t_start, num_captures,
+                            num_bytes)
+        return [self._buffers[channel] if is_enabled is True else None
+                for channel, is_enabled in self._channels_enabled.items()]
+
+    def get_adc_data(self):
+        """Return all captured data, in ADC values."""
+        return self._get_values(self._num_samples, self._num_captures)
+
+    def get_data(self):
+        """Return all captured data, in physical units.
+
+        :returns: time_values, data
+        """
+        data = self.get_adc_data()
+        if data is None:
+            return None, [None] * len(self._channels_enabled)
+        time_values = (self.get_interval_from_timebase(self._timebase)
+                       * np.arange(0, self._num_samples, self._downsample[1]))
+        V_data = [self._rescale_adc_to_V(channel, values)
+                  if values is not None else None
+                  for channel, values in zip(self._channels_enabled, data)]
+        return time_values, V_data
+
+    def get_trigger_times(self):
+        """Return trigger times (in ps from the first trigger of the run)
+        of the captures read out last."""
+        return self._trigger_times
+
+    def get_overflow(self, channel_name=None):
+        """Return overflow flags of the captures read out last (see
+        PicoScope3000A.get_overflow)."""
+        if channel_name is None or self._overflow is None:
+            return self._overflow
+        channel = CHANNELS.index(channel_name)
+        return (self._overflow >> channel) & 1 == 1
+
+    def stop(self):
+        """Stop data capture."""
+        self.stats.disarmed()
+
+    def _rescale_adc_to_V(self, channel, data):
+        """Rescale the ADC data and return float values in volts."""
+        voltage_range = self._input_voltage_ranges[channel]
+        offset = self._input_offsets[channel]
+        return (voltage_range * data) / MAX_ADC - offset
+
+    def _rescale_adc_to_1(self, data, inverse):
+        """Rescale the ADC data to 0-1 range and return float values."""
+        if inverse:
+            return (MAX_ADC - data) / MAX_ADC
+        return data / MAX_ADC
+
+    def _replay_captures(self, num_captures):
+        """Return the next recorded captures of enabled channels."""
+        total = len(next(iter(self._replay.values())))
+        index = (self._replay_position + np.arange(num_captures)) % total
+        self._replay_position = (index[-1] + 1) % total
+        self._overflow = np.zeros(num_captures, dtype=np.uint16)
+        return {channel: self._replay[channel][index]
+                for channel in self._get_enabled_channels()
+                if channel in self._replay}
+
+    def _synthesize(self, num_pre_samples, num_samples, num_captures,
+                    interval):
+        """Synthesize captures of enabled channels.
+
+        :returns: dictionary of (captures, samples) int16 arrays and
+            intervals between the triggers in ps
+        """
+        intervals = self.rng.exponential(1e12 / self.rate, num_captures)
+        sources = self._trigger['sources']
+        # Channel triggering each capture (with OR any of the sources)
+        trigger_source = self.rng.integers(len(sources), size=num_captures)
+        t = np.arange(num_samples) * interval
+        t_trigger = num_pre_samples * interval
+        trace_length = num_samples * interval
+        captured = {}
+        self._overflow = np.zeros(num_captures, dtype=np.uint16)
+        for channel in self._get_enabled_channels():
+            source = self._sources[channel]
+            V = self.rng.normal(0.0, source['noise'],
+                                (num_captures, num_samples))
+            # Pulse at the trigger, in other channels only in coincidence
+            if self._trigger['logic'] == 'AND' and channel in sources:
+                present = np.ones(num_captures, dtype=bool)
+            else:
+                present = self.rng.random(num_captures) < self.coincidence
+                if channel in sources:
+                    present |= trigger_source == sources.index(channel)
+            t0 = t_trigger + self.rng.uniform(0, interval, num_captures)
+            self._add_pulses(V, t, t0, present, source)
+            # Random pulses piled up in the trace
+            if source['pileup'] is None:
+                pileup = 1 - np.exp(-self.rate * trace_length * 1e-9)
+            else:
+                pileup = source['pileup']
+            present = self.rng.random(num_captures) < pileup
+            t0 = self.rng.uniform(-trace_length / 2, trace_length,
+                                  num_captures)
+            self._add_pulses(V, t, t0, present, source)
+
+            adc = np.rint((V + self._input_offsets[channel])
+                          / self._input_voltage_ranges[channel] * MAX_ADC)
+            clipped = (np.abs(adc) > MAX_ADC).any(axis=1)
+            self._overflow[clipped] |= 1 << CHANNELS.index(channel)
+            captured[channel] = np.clip(adc, -MAX_ADC,
+                                        MAX_ADC).astype(np.int16)
+        return captured, intervals
+
+    def _add_pulses(self, V, t, t0, present, source):
+        """Add pulses starting at t0 to the captures where present."""
+        n = np.count_nonzero(present)
+        if n == 0:
+            return
+        amplitudes = self.rng.choice(source['amplitudes'], n,
+                                     p=source['weights'])
+        amplitudes *= 1 + self.rng.normal(0, source['resolution'], n)
+        background = self.rng.random(n) < source['background']
+        amplitudes[background] = self.rng.uniform(
+            0, source['amplitudes'].max(), np.count_nonzero(background))
+        tau_r = source['rise_time']
+        tau_d = source['decay_time']
+        # Double exponential with the maximum normalized to 1
+        t_max = tau_r * tau_d / (tau_d - tau_r) * np.log(tau_d / tau_r)
+        norm = np.exp(-t_max / tau_d) - np.exp(-t_max / tau_r)
+        dt = np.maximum(t[np.newaxis, :] - t0[present, np.newaxis], 0)
+        shape = (np.exp(-dt / tau_d) - np.exp(-dt / tau_r)) / norm
+        V[present] += (source['polarity'] * amplitudes[:, np.newaxis]
+                       * shape)
+
+
+def _downsample(values, downsample_mode, downsample_ratio):
+    """Reduce every downsample_ratio samples of (captures, samples) values
+    to a single value, as the device does (the last block may be shorter).
+    'AGGREGATE' returns a (2, captures, samples) array of maxima and
+    minima."""
+    if downsample_mode == 'NONE':
+        return values
+    if downsample_mode == 'DECIMATE':
+        return values[:, ::downsample_ratio]
+    starts = np.arange(0, values.shape[1], downsample_ratio)
+    if downsample_mode == 'AGGREGATE':
+        return np.stack((np.maximum.reduceat(values, starts, axis=1),
+                         np.minimum.reduceat(values, starts, axis=1)))
+    lengths = np.diff(np.append(starts, values.shape[1]))
+    sums = np.add.reduceat(values.astype(np.int64), starts, axis=1)
+    return np.rint(sums / lengths).astype(np.int16)
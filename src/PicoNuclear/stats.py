@@ -0,0 +1,134 @@
+"""K. Miernik 2019
+k.a.miernik@gmail.com
+Distributed under GNU General Public Licence v3
+
+Live time, dead time and throughput accounting of the data acquisition.
+
+"""
+
+import time
+
+
+class AcquisitionStats:
+    """Counters of the block mode data acquisition.
+
+    The device is live (armed) from the start of a run until the data are
+    ready, the rest of the elapsed time (readout, processing, setting up)
+    is dead time. The counters are updated by the PicoScope3000A class,
+    the elapsed time is counted from the last reset.
+
+    Methods
+    -------
+    reset()
+        Zero all counters and restart the elapsed time
+    summary()
+        Return all counters as a dictionary
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Zero all counters and restart the elapsed time."""
+        self.armed_time = 0.0
+        self.readout_time = 0.0
+        self.runs = 0
+        self.captures = 0
+        self.bytes = 0
+        self._t_start = time.perf_counter()
+        self._t_arm = None
+
+    def armed(self, t_arm=None):
+        """Record the start of a run.
+
+        :param t_arm: time of arming (time.perf_counter), defaults to now
+        """
+        if t_arm is None:
+            t_arm = time.perf_counter()
+        self._t_arm = t_arm
+
+    def disarmed(self, t_ready=None):
+        """Record the end of a run (data ready or run stopped).
+
+        :param t_ready: time the device finished (time.perf_counter),
+            defaults to now
+        """
+        if self._t_arm is None:
+            return
+        if t_ready is None:
+            t_ready = time.perf_counter()
+        self.armed_time += max(t_ready - self._t_arm, 0.0)
+        self.runs += 1
+        self._t_arm = None
+
+    def read_out(self, duration, captures, num_bytes):
+        """Record a readout of the data.
+
+        :param duration: time spent on the readout in seconds
+        :param captures: number of captures received
+        :param num_bytes: number of bytes of data received
+        """
+        self.readout_time += duration
+        self.captures += captures
+        self.bytes += num_bytes
+
+    @property
+    def elapsed_time(self):
+        """Wall clock time since the last reset, in seconds."""
+        return time.perf_counter() - self._t_start
+
+    @property
+    def live_time(self):
+        """Time the device was armed, in seconds (including the current
+        run)."""
+        if self._t_arm is None:
+            return self.armed_time
+        return self.armed_time + time.perf_counter() - self._t_arm
+
+    @property
+    def dead_time(self):
+        """Time the device was not armed, in seconds."""
+        return max(self.elapsed_time - self.live_time, 0.0)
+
+    @property
+    def dead_time_fraction(self):
+        """Fraction of the elapsed time the device was not armed."""
+        elapsed = self.elapsed_time
+        if elapsed == 0:
+            return 0.0
+        return self.dead_time / elapsed
+
+    @property
+    def capture_rate(self):
+        """Captures received per second of elapsed time."""
+        elapsed = self.elapsed_time
+        if elapsed == 0:
+            return 0.0
+        return self.captures / elapsed
+
+    @property
+    def data_rate(self):
+        """Bytes received per second of elapsed time."""
+        elapsed = self.elapsed_time
+        if elapsed == 0:
+            return 0.0
+        return self.bytes / elapsed
+
+    def summary(self):
+        """Return all counters as a dictionary."""
+        return {'elapsed_time': self.elapsed_time,
+                'live_time': self.live_time,
+                'dead_time': self.dead_time,
+                'dead_time_fraction': self.dead_time_fraction,
+                'readout_time': self.readout_time,
+                'runs': self.runs,
+                'captures': self.captures,
+                'bytes': self.bytes,
+                'capture_rate': self.capture_rate,
+                'data_rate': self.data_rate}
+
+    def __str__(self):
+        return ('live {:.2f} s, dead time {:.1%}, {} captures '
+                '({:.1f}/s)').format(self.live_time, self.dead_time_fraction,
+                                     self.captures, self.capture_rate)
@@ -8,10 +8,47 @@ other setups.
 """
 import datetime
 import numpy
+import os
 import xml.dom.minidom
 from scipy.interpolate import CubicSpline
 from scipy.signal import find_peaks
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def set_backend(name='numpy'):
+    """
+    Selects the implementation used by the DSP functions (trapezoidal,
+    zero_crossing, amplitude and their batch versions)
+
+    * name - 'numpy' (pure numpy / python), 'numba' (compiled kernels,
+             requires numba) or 'auto' (numba if it can be imported)
+
+    The numba backend is opt-in: zero_crossing() interpolates there with a
+    local cubic polynomial instead of a cubic spline, so the times differ
+    slightly (by up to a few hundredths of a sample).
+
+    The initial backend is taken from PICONUCLEAR_BACKEND environment
+    variable (defaults to 'numpy').
+    """
+    global _backend
+    if name == 'auto':
+        name = 'numpy' if numba is None else 'numba'
+    if name not in ['numpy', 'numba']:
+        raise ValueError('Backend {} is not supported'.format(name))
+    if name == 'numba' and numba is None:
+        raise ImportError('numba backend requested, but numba is not '
+                          'installed')
+    _backend = name
+
+
+def get_backend():
+    """Returns name of the currently used DSP backend"""
+    return _backend
+
 
 def progress_bar(n, n_max, time_to_n=None):
     """
@@ -75,9 +112,13 @@ def load_configuration(file_name):
                                         0, 'int')
                 }
 
+        configuration['channels'] = []
         channels = hardware.getElementsByTagName('channel')
         for ch in channels:
             name = ch.getAttribute('name').upper()
+            if name not in ['A', 'B', 'C', 'D']:
+                raise ValueError('Unknown channel {}'.format(name))
+            configuration['channels'].append(name)
             coupling = ch.getAttribute('coupling').upper()
             v_range = get_number(ch.getAttribute('range'), 1.0)
             offset = get_number(ch.getAttribute('offset'), 0.0)
@@ -135,74 +176,93 @@ def load_configuration(file_name):
     return configuration
 
 
-def trapezoidal(v, params, clock, pileup='max'):
+def _trapezoidal_recurrence(v, b, k, m, M):
     """
-    Applies trapezoidal filter to a waveform v
-    V.T. Jordanov NIMA 353 (1994) 261
+    Jordanov recurrence used by trapezoidal(), returns filtered signal
+    not divided by k (see trapezoidal() for parameters)
 
-    * params are a dictionary
-        o params['filter']['B'] - baseline (number of samples in front 
-                                            taken to calculate average baseline)
-        o params['filter']['L'] - length (in samples) see article for details
-        o params['filter']['G'] - gap (in samples) see article for details
-        o params['filter']['tau'] - signal decay constant
-        o params['filter']['threshold'] - threshold for local maxima level 
-                                in the filtered signal (see below)
-
-    * pileup - mode of pileups treatment
-        o 'max' - (default) take the maximum value from the filtered signal,
-                  this is the fastest, method but if there are pileups in
-                  the signal, all are rejected except of highest amplitude
-        o 'all' - find all local maxima in the filtered signal above threshold
-                  threshold is calculated from threshold:
-                  Vtr * tau
-
-    * returns A, s - amplitudes vector and filtered signal
+    The loop bounds are clamped to the length of v, so waveforms shorter
+    than 2L+G are filtered as well (numba does not check the indices).
     """
-    b = params['filter']['B']
-    k = params['filter']['L']
-    m = params['filter']['G']
-    tau = params['filter']['tau']
-    threshold = params['filter']['threshold']
-
     base = v[0:b].sum() / b
     N = len(v)
     d = numpy.zeros(N)
     p = numpy.zeros(N)
     r = numpy.zeros(N)
     s = numpy.zeros(N)
+    if N == 0:
+        return s
     l = k + m
-    M = 1 / (numpy.exp(clock / tau) - 1)
 
     d[0] = v[0] - base
     p[0] = d[0]
     r[0] = p[0] + M * d[0]
     s[0] = r[0]
 
-    for n in range(1, k):
+    for n in range(1, min(k, N)):
         d[n] = v[n] - base
         p[n] = p[n-1] + d[n]
         r[n] = p[n] + M * d[n]
         s[n] = s[n-1] + r[n]
 
-    for n in range(k, l):
+    for n in range(min(k, N), min(l, N)):
         d[n] = v[n] - v[n-k]
         p[n] = p[n-1] + d[n]
         r[n] = p[n] + M * d[n]
         s[n] = s[n-1] + r[n]
 
-    for n in range(l, l + k):
+    for n in range(min(l, N), min(l + k, N)):
         d[n] = v[n] - v[n-k] - v[n-l] + base
         p[n] = p[n-1] + d[n]
         r[n] = p[n] + M * d[n]
         s[n] = s[n-1] + r[n]
 
-    for n in range(l + k, N):
+    for n in range(min(l + k, N), N):
         d[n] = v[n] - v[n-k] - v[n-l] + v[n-l-k]
         p[n] = p[n-1] + d[n]
         r[n] = p[n] + M * d[n]
         s[n] = s[n-1] + r[n]
 
+    return s
+
+
+def trapezoidal(v, params, clock, pileup='max'):
+    """
+    Applies trapezoidal filter to a waveform v
+    V.T. Jordanov NIMA 353 (1994) 261
+
+    * params are a dictionary
+        o params['filter']['B'] - baseline (number of samples in front 
+                                            taken to calculate average baseline)
+        o params['filter']['L'] - length (in samples) see article for details
+        o params['filter']['G'] - gap (in samples) see article for details
+        o params['filter']['tau'] - signal decay constant
+        o params['filter']['threshold'] - threshold for local maxima level 
+                                in the filtered signal (see below)
+
+    * pileup - mode of pileups treatment
+        o 'max' - (default) take the maximum value from the filtered signal,
+                  this is the fastest, method but if there are pileups in
+                  the signal, all are rejected except of highest amplitude
+        o 'all' - find all local maxima in the filtered signal above threshold
+                  threshold is calculated from threshold:
+                  Vtr * tau
+
+    * returns A, s - amplitudes vector and filtered signal
+    """
+    b = params['filter']['B']
+    k = params['filter']['L']
+    m = params['filter']['G']
+    tau = params['filter']['tau']
+    threshold = params['filter']['threshold']
+
+    M = 1 / (numpy.exp(clock / tau) - 1)
+    if _backend == 'numba':
+        s = _trapezoidal_recurrence_nb(numpy.asarray(v, dtype=numpy.float64),
+                                       b, k, m, M)
+    else:
+        s = _trapezoidal_recurrence(v, b, k, m, M)
+
     if pileup == 'all':
         peaks, _ = find_peaks(abs(s / k), prominence=threshold * tau,
                               distance=params['filter']['L'])
@@ -212,6 +272,68 @@ def trapezoidal(v, params, clock, pileup='max'):
 
 
 
+def trapezoidal_batch(V, params, clock, pileup='max'):
+    """
+    Applies trapezoidal filter to all waveforms in a block at once
+    V.T. Jordanov NIMA 353 (1994) 261
+
+    The recurrences of trapezoidal() are replaced by cumulative sums over
+    the whole block, the results are the same as for trapezoidal() called
+    for each waveform.
+
+    * V - (captures, samples) array of waveforms
+    * params, clock, pileup - see trapezoidal()
+
+    * returns A, S, P - amplitudes, filtered signals and peak positions
+        o pileup='max' - A and P are arrays with one value per waveform,
+                         S is a (captures, samples) array
+        o pileup='all' - A and P are lists of arrays (all peaks found in 
+                         each waveform), S is a (captures, samples) array
+    """
+    b = params['filter']['B']
+    k = params['filter']['L']
+    m = params['filter']['G']
+    tau = params['filter']['tau']
+    threshold = params['filter']['threshold']
+
+    V = numpy.atleast_2d(V)
+    n_captures, N = V.shape
+    l = k + m
+    M = 1 / (numpy.exp(clock / tau) - 1)
+
+    if _backend == 'numba':
+        s = _trapezoidal_block_nb(numpy.asarray(V, dtype=numpy.float64),
+                                  b, k, m, M)
+    else:
+        # Samples in front of the waveform are taken equal to the baseline,
+        # this reproduces the four ranges of the recurrence in trapezoidal()
+        base = V[:, 0:b].sum(axis=1) / b
+        v = numpy.empty((n_captures, N + l + k))
+        v[:, :l + k] = base[:, numpy.newaxis]
+        v[:, l + k:] = V
+
+        d = v[:, l + k:] - v[:, l:l + N] - v[:, k:k + N] + v[:, :N]
+        p = numpy.cumsum(d, axis=1)
+        r = p + M * d
+        s = numpy.cumsum(r, axis=1)
+    s /= k
+
+    if pileup == 'all':
+        A = []
+        P = []
+        for si in s:
+            peaks, _ = find_peaks(abs(si), prominence=threshold * tau,
+                                  distance=params['filter']['L'])
+            A.append(abs(si[peaks]))
+            P.append(peaks)
+        return A, s, P
+    else:
+        P = numpy.argmax(abs(s), axis=1)
+        A = abs(s[numpy.arange(n_captures), P])
+        return A, s, P
+
+
+
 def zero_crossing(trace, base=15, shift=10, chi=0.6, falling=True):
     """
     Calculates trigger time based on zero crossing algorithm
@@ -223,12 +345,19 @@ def zero_crossing(trace, base=15, shift=10, chi=0.6, falling=True):
     * chi - algorithm parameter (see article for more details)
     * falling - signal defaults to falling edge
     * returns trigger time in time stamps
+
+    With the numba backend the crossing is interpolated with a local cubic
+    polynomial (see zero_crossing_batch()) instead of a cubic spline.
     """
+    if _backend == 'numba':
+        return _zero_crossing_point_nb(numpy.asarray(trace, 
+                                       dtype=numpy.float64),
+                                       base, shift, chi, falling, True)
 
     try:
         bs = numpy.average(trace[0:base])
         inv = numpy.zeros(trace.shape)
-        inv[shift:] = trace[0:-shift] - bs
+        inv[shift:] = trace[0:trace.shape[0] - shift] - bs
         zc = chi * (trace - bs) - inv
         if falling:
             zc *= -1
@@ -249,13 +378,296 @@ def zero_crossing(trace, base=15, shift=10, chi=0.6, falling=True):
 
 
 
+def zero_crossing_batch(traces, base=15, shift=10, chi=0.6, falling=True,
+                        method='cubic'):
+    """
+    Calculates trigger times of all waveforms in a block at once, based on 
+    zero crossing algorithm (see zero_crossing())
+    NIMA 775 (2015) 71–76
+
+    Instead of a cubic spline built for every trace, the crossing is
+    interpolated in closed form for the whole block, either linearly
+    between the two samples around the crossing, or with a cubic
+    polynomial through the four nearest samples (solved with a few
+    Newton iterations started from the linear estimate).
+
+    * traces - (captures, samples) array of waveforms
+    * base, shift, chi, falling - see zero_crossing()
+    * method - 'cubic' (default) or 'linear' interpolation
+    * returns array of trigger times in time stamps, 0 if the crossing
+              was not found
+    """
+    if method not in ['cubic', 'linear']:
+        raise ValueError(f"Interpolation method {method} is not supported")
+    traces = numpy.atleast_2d(traces)
+    if _backend == 'numba':
+        return _zero_crossing_block_nb(numpy.asarray(traces,
+                                       dtype=numpy.float64),
+                                       base, shift, chi, falling,
+                                       method == 'cubic')
+    n_captures, N = traces.shape
+    rows = numpy.arange(n_captures)
+
+    bs = traces[:, 0:base].mean(axis=1)[:, numpy.newaxis]
+    zc = chi * (traces - bs)
+    zc[:, shift:] -= traces[:, 0:N - shift] - bs
+    if falling:
+        zc *= -1
+
+    t_lim = zc.argmax(axis=1)
+    negative = (zc < 0) & (numpy.arange(N) >= t_lim[:, numpy.newaxis])
+    t0 = negative.argmax(axis=1)
+    found = negative[rows, t0] & (t0 > 0)
+    t0 = numpy.where(found, t0, 1)
+
+    # Crossing is between samples t0 - 1 (zc >= 0) and t0 (zc < 0),
+    # x is the position relative to t0 - 1
+    y0 = zc[rows, t0 - 1]
+    y1 = zc[rows, t0]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        x = numpy.where(found, y0 / (y0 - y1), 0.0)
+
+    if method == 'cubic':
+        ym = zc[rows, numpy.clip(t0 - 2, 0, N - 1)]
+        y2 = zc[rows, numpy.clip(t0 + 1, 0, N - 1)]
+        # Lagrange polynomial through points x = -1, 0, 1, 2
+        a1 = -ym / 3 - y0 / 2 + y1 - y2 / 6
+        a2 = (ym + y1) / 2 - y0
+        a3 = (y0 - y1) / 2 + (y2 - ym) / 6
+        xc = x.copy()
+        for i in range(4):
+            dp = a1 + xc * (2 * a2 + 3 * a3 * xc)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                step = numpy.where(dp != 0,
+                        (y0 + xc * (a1 + xc * (a2 + a3 * xc))) / dp, 0.0)
+            xc = numpy.clip(xc - step, 0.0, 1.0)
+        inside = (t0 >= 2) & (t0 + 1 < N)
+        x = numpy.where(inside, xc, x)
+
+    return numpy.where(found, t0 - 1 + x, 0.0)
+
+
+def _zero_crossing_point(trace, base, shift, chi, falling, cubic):
+    """
+    Zero crossing of a single trace with closed form interpolation
+    (compiled by the numba backend), see zero_crossing_batch() for
+    parameters
+    """
+    N = trace.shape[0]
+    bs = trace[0:base].mean()
+    sign = -1.0 if falling else 1.0
+    zc = numpy.empty(N)
+    for n in range(N):
+        z = chi * (trace[n] - bs)
+        if n >= shift:
+            z -= trace[n - shift] - bs
+        zc[n] = sign * z
+
+    t0 = -1
+    for n in range(numpy.argmax(zc), N):
+        if zc[n] < 0:
+            t0 = n
+            break
+    if t0 < 1:
+        return 0.0
+
+    y0 = zc[t0 - 1]
+    y1 = zc[t0]
+    x = y0 / (y0 - y1)
+    if cubic and t0 >= 2 and t0 + 1 < N:
+        ym = zc[t0 - 2]
+        y2 = zc[t0 + 1]
+        a1 = -ym / 3 - y0 / 2 + y1 - y2 / 6
+        a2 = (ym + y1) / 2 - y0
+        a3 = (y0 - y1) / 2 + (y2 - ym) / 6
+        for i in range(4):
+            dp = a1 + x * (2 * a2 + 3 * a3 * x)
+            if dp == 0:
+                break
+            x -= (y0 + x * (a1 + x * (a2 + a3 * x))) / dp
+            x = min(max(x, 0.0), 1.0)
+    return t0 - 1 + x
+
+
+def _baseline_amplitude(s, b, use_sum):
+    """
+    Amplitude of a waveform above the baseline, without filtering
+    (compiled by the numba backend), see amplitude()
+    """
+    baseline = s[0:b].sum() / b
+    A = 0.0
+    for n in range(s.shape[0]):
+        if use_sum:
+            A += s[n] - baseline
+        else:
+            A = max(A, abs(s[n] - baseline))
+    if use_sum:
+        A = abs(A) / s.shape[0]
+    return A
+
+
 def amplitude(s, params, clock, pileup='all'):
     if params['filter']['method'] == 'trapezoidal':
         A, sa, pa = trapezoidal(s, params, clock, pileup)
+    elif _backend == 'numba':
+        A = _baseline_amplitude_nb(numpy.asarray(s, dtype=numpy.float64),
+                                   params['filter']['B'],
+                                   params['filter']['method'] == 'sum')
     else:
-        baseline = s[0:params['B']].sum() / params['B']
+        b = params['filter']['B']
+        baseline = s[0:b].sum() / b
         if params['filter']['method'] == 'sum':
             A = abs((s - baseline).sum()) / s.shape[0]
         else:
             A = max(abs(s - baseline))
     return A
+
+
+def amplitude_batch(V, params, clock, pileup='all'):
+    """
+    Calculates amplitudes of all waveforms in a block at once,
+    see amplitude() and trapezoidal_batch() for details
+
+    * V - (captures, samples) array of waveforms
+    * returns amplitudes, array (one per waveform) or list of arrays
+              (trapezoidal filter with pileup='all')
+    """
+    if params['filter']['method'] == 'trapezoidal':
+        A, S, P = trapezoidal_batch(V, params, clock, pileup)
+    elif _backend == 'numba':
+        A = _baseline_amplitude_block_nb(
+                numpy.asarray(numpy.atleast_2d(V), dtype=numpy.float64),
+                params['filter']['B'], params['filter']['method'] == 'sum')
+    else:
+        V = numpy.atleast_2d(V)
+        b = params['filter']['B']
+        baseline = V[:, 0:b].sum(axis=1) / b
+        if params['filter']['method'] == 'sum':
+            A = abs((V - baseline[:, numpy.newaxis]).sum(axis=1)) / V.shape[1]
+        else:
+            A = abs(V - baseline[:, numpy.newaxis]).max(axis=1)
+    return A
+
+
+HIT_DTYPE = numpy.dtype([('capture', numpy.int32),
+                         ('channel', numpy.uint8),
+                         ('amplitude', numpy.float32),
+                         ('time', numpy.float64),
+                         ('overflow', numpy.bool_)])
+
+
+def overflowed(overflow, channel):
+    """
+    Returns flags of captures with the given channel out of range
+
+    * overflow - array of overflow bit masks, one per capture, with bit 0
+                 for channel A, 1 for B etc.
+                 (see PicoScope3000A.get_overflow())
+    * channel - channel name ('A', 'B', ...)
+    * returns boolean array
+    """
+    bit = ord(channel) - ord('A')
+    return (numpy.asarray(overflow) >> bit) & 1 == 1
+
+
+def extract_hits(data, config, clock, channels=('A', 'B'), pileup='max',
+                 falling=False, scale=None, trigger_times=None,
+                 overflow=None, on_overflow='reject'):
+    """
+    Extracts hits (amplitude and time) from a block of captures of all
+    channels, using the filter configured for each channel
+
+    * data - list of (captures, samples) arrays, one per channel, None
+             for channels not used (e.g. disabled)
+    * config - configuration (see load_configuration()), the filter
+               parameters are taken from config[channel]
+    * clock - sampling interval (ns)
+    * channels - names of channels in data
+    * pileup - 'max' one hit per capture and channel, timed with the
+                     zero crossing algorithm
+               'all' all peaks found by the trapezoidal filter, timed with
+                     the peak position
+    * falling - signal polarity used by the zero crossing algorithm
+    * scale - (optional) factors the amplitudes are multiplied by, one
+              per channel
+    * trigger_times - (optional) trigger times of the captures in ps
+                      (see PicoScope3000A.get_trigger_times()), added to
+                      the hit times
+    * overflow - (optional) overflow bit masks of the captures
+                 (see overflowed())
+    * on_overflow - 'reject' captures with the channel out of range are
+                             skipped before filtering
+                    'flag' hits from such captures are kept, with the
+                           'overflow' field set
+    * returns structured array of hits (HIT_DTYPE), times are in ns from
+              the start of each capture, or from the trigger time
+              reference of the device if trigger_times are given
+    """
+    if on_overflow not in ['reject', 'flag']:
+        raise ValueError('Unknown overflow handling {}'.format(on_overflow))
+    hits = []
+    for ch, V in enumerate(data):
+        if V is None:
+            continue
+        params = config[channels[ch]]
+        captures = numpy.arange(V.shape[0])
+        clipped = numpy.zeros(V.shape[0], dtype=bool)
+        if overflow is not None:
+            clipped = overflowed(overflow, channels[ch])
+            if on_overflow == 'reject' and clipped.any():
+                captures = numpy.flatnonzero(~clipped)
+                V = V[captures]
+        if pileup == 'all':
+            A, S, P = trapezoidal_batch(V, params, clock, 'all')
+            counts = [len(a) for a in A]
+            h = numpy.empty(sum(counts), dtype=HIT_DTYPE)
+            h['capture'] = numpy.repeat(captures, counts)
+            h['amplitude'] = numpy.concatenate(A) if counts else []
+            h['time'] = numpy.concatenate(P) * clock if counts else []
+        else:
+            h = numpy.empty(V.shape[0], dtype=HIT_DTYPE)
+            h['capture'] = captures
+            h['amplitude'] = amplitude_batch(V, params, clock, 'max')
+            h['time'] = zero_crossing_batch(V, params['filter']['B'],
+                                            falling=falling) * clock
+        h['channel'] = ch
+        h['overflow'] = clipped[h['capture']]
+        if scale is not None:
+            h['amplitude'] *= scale[ch]
+        if trigger_times is not None:
+            h['time'] += trigger_times[h['capture']] * 1e-3
+        hits.append(h)
+    if len(hits) == 0:
+        return numpy.empty(0, dtype=HIT_DTYPE)
+    return numpy.concatenate(hits)
+
+if numba is not None:
+    _trapezoidal_recurrence_nb = numba.njit(_trapezoidal_recurrence,
+                                            cache=True)
+    _zero_crossing_point_nb = numba.njit(_zero_crossing_point, cache=True)
+    _baseline_amplitude_nb = numba.njit(_baseline_amplitude, cache=True)
+
+    @numba.njit(parallel=True, cache=True)
+    def _trapezoidal_block_nb(V, b, k, m, M):
+        S = numpy.empty(V.shape)
+        for i in numba.prange(V.shape[0]):
+            S[i] = _trapezoidal_recurrence_nb(V[i], b, k, m, M)
+        return S
+
+    @numba.njit(parallel=True, cache=True)
+    def _zero_crossing_block_nb(traces, base, shift, chi, falling, cubic):
+        T = numpy.empty(traces.shape[0])
+        for i in numba.prange(traces.shape[0]):
+            T[i] = _zero_crossing_point_nb(traces[i], base, shift, chi,
+                                           falling, cubic)
+        return T
+
+    @numba.njit(parallel=True, cache=True)
+    def _baseline_amplitude_block_nb(V, b, use_sum):
+        A = numpy.empty(V.shape[0])
+        for i in numba.prange(V.shape[0]):
+            A[i] = _baseline_amplitude_nb(V[i], b, use_sum)
+        return A
+
+
+set_backend(os.environ.get('PICONUCLEAR_BACKEND', 'numpy'))
@@ -0,0 +1,28 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import numpy
+from PicoNuclear.listmode import read_listmode
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Converts list-mode file to text')
+    parser.add_argument('input', help='List-mode file')
+    parser.add_argument('output', help='Output text file')
+    parser.add_argument('--fmt', default='%.3f',
+            help='Format of real values (default %(default)s), '
+                 'integer fields (time, mask, flags) are written as such')
+
+    args = parser.parse_args()
+
+    header, events = read_listmode(args.input)
+    description = {key: value for key, value in header.items()
+                   if key not in ['dtype', 'config']}
+    text = json.dumps(description, indent=1) + '\n'
+    text += '  '.join(events.dtype.names)
+    fmt = ['%d' if events.dtype[name].kind in 'iub' else args.fmt
+           for name in events.dtype.names]
+    numpy.savetxt(args.output, events, fmt=fmt, header=text,
+                  delimiter=' ')
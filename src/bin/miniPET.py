@@ -3,25 +3,37 @@
 import datetime
 import numpy
 import os
-import pandas
 import sys
 import time
 
 import matplotlib.pyplot as plt
 import PicoNuclear
+import PicoNuclear.eventstore as eventstore
+import PicoNuclear.histograms as histograms
+import PicoNuclear.listmode as listmode
 import PicoNuclear.tools as tools
 
 from scipy.optimize import curve_fit
 from PicoNuclear.pico3000a import PicoScope3000A
 
 from PyQt5.QtWidgets import  *
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QIntValidator, QDoubleValidator, QFont, QIcon
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 
 
+# time - trigger time of the capture (ps, since the start of the run),
+# mask - channels present in the event (bit 0 - A, bit 1 - B),
+# flags - channels which overflowed (same bits),
+# tA, tB - times of the channels relative to the start of the capture
+EVENT_DTYPE = [('time', numpy.int64), ('mask', numpy.uint8),
+               ('flags', numpy.uint8),
+               ('A', numpy.float32), ('B', numpy.float32),
+               ('tA', numpy.float32), ('tB', numpy.float32)]
+
+
 class ConfigWindow(QDialog):
 
     def __init__(self, config):
@@ -56,7 +68,7 @@ class ConfigWindow(QDialog):
         self.label_source.setFixedWidth(100)
 
         self.combo_source = QComboBox()
-        self.combo_source.addItems(['A', 'B'])
+        self.combo_source.addItems(['A', 'B', 'AND', 'OR'])
         self.combo_source.setCurrentText(self.config['trigger']['source'])
 
         self.label_direction = QLabel()
@@ -516,12 +528,117 @@ class CalibrationWindow(QDialog):
         self.close()
 
 
+class Acquisition(QThread):
+    """Data acquisition and processing, run in a separate thread, so
+    the drawing of spectra does not slow down the acquisition.
+
+    The events (EVENT_DTYPE arrays) are collected and sent to the GUI
+    with the events_ready signal every t_update seconds.
+
+    Overflows: events of captures in which a channel of the event went
+    out of the input range are kept, with the channel bit set in the
+    'flags' field, so they are written to the list-mode file, but are
+    left out of the spectra and the gate. The thread
+    finishes after max_time seconds or when stop() is called. An error
+    (e.g. PicoSDKError) ends the thread as well, it is sent with the error
+    signal, after the events collected so far.
+    """
+
+    events_ready = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+    def __init__(self, s, config, clock, max_time, t_update=0.1,
+                 demo_data=None):
+        super().__init__()
+        self.s = s
+        self.config = config
+        self.clock = clock
+        self.max_time = max_time
+        self.t_update = t_update
+        self.demo_data = demo_data
+        self.finish = False
+
+
+    def stop(self):
+        self.finish = True
+
+
+    def run(self):
+        t0 = time.perf_counter()
+        self.t0 = t0
+        t_send = t0
+        collected = []
+        try:
+            while not self.finish:
+                collected.append(self.measure())
+                tnow = time.perf_counter()
+                if tnow - t0 > self.max_time:
+                    self.finish = True
+                if tnow - t_send > self.t_update or self.finish:
+                    self.events_ready.emit(numpy.concatenate(collected))
+                    collected = []
+                    t_send = tnow
+        except Exception as err:
+            # Returning from run() emits finished, so the file is closed
+            self.finish = True
+            if len(collected) > 0:
+                self.events_ready.emit(numpy.concatenate(collected))
+            self.error.emit('{}: {}'.format(type(err).__name__, err))
+
+
+    def measure(self):
+        """Returns events of a single batch of captures"""
+        if self.s is None:
+            n = self.demo_data.shape[0]
+            time.sleep(0.01)
+            row = self.demo_data[numpy.random.choice(n, 1)]
+            batch = numpy.zeros(1, dtype=EVENT_DTYPE)
+            batch['time'] = int((time.perf_counter() - self.t0) * 1e12)
+            batch['mask'] = 3
+            for i, name in enumerate(['A', 'B', 'tA', 'tB']):
+                batch[name] = row[:, i]
+            return batch
+        else:
+            t_start = time.perf_counter()
+            t, data, trigger_times = self.s.measure_relative_adc(
+                                self.config['pre'], self.config['post'],
+                                num_captures=self.config['captures'],
+                                timebase=self.config['timebase'], 
+                                inverse=True, trigger_times=True)
+            # Device time stamps start with each batch, the batches are
+            # placed on the host clock
+            trigger_times = (trigger_times + 
+                             int((t_start - self.t0) * 1e12))
+            data = dict(zip(self.s.channels, data))
+            A, B = data['A'], data['B']
+            xa = tools.amplitude_batch(A, self.config['A'],
+                    self.clock, 'max')
+            xb = tools.amplitude_batch(B, self.config['B'],
+                    self.clock, 'max')
+            ta = tools.zero_crossing_batch(A, 
+                    self.config['A']['filter']['B'], 
+                    falling=False)
+            tb = tools.zero_crossing_batch(B, 
+                    self.config['B']['filter']['B'], 
+                    falling=False)
+            batch = numpy.zeros(A.shape[0], dtype=EVENT_DTYPE)
+            batch['time'] = trigger_times
+            batch['mask'] = 3
+            overflow = self.s.get_overflow()
+            if overflow is not None:
+                batch['flags'] = overflow & 3
+            batch['A'] = xa
+            batch['B'] = xb
+            batch['tA'] = ta
+            batch['tB'] = tb
+            return batch
+
+
 class Window(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle('MiniPET')
 
-        self.finish = False
         self.status = 'Ready'
         self.data = None
         default_config = os.path.join(PicoNuclear.__path__[0], 'data', 
@@ -543,16 +660,12 @@ class Window(QMainWindow):
         try:
             self.s = PicoScope3000A()
 
-            self.s.set_channel('A', coupling_type=self.config['A']['coupling'], 
-                    range_value=self.config['A']['range'], 
-                    offset=self.config['A']['offset'])
-            self.s.set_channel('B', coupling_type=self.config['B']['coupling'],
-                    range_value=self.config['B']['range'], 
-                    offset=self.config['B']['offset'])
-            self.s.set_trigger(self.config['trigger']['source'],
-                        threshold=self.config['trigger']['threshold'],
-                        direction=self.config['trigger']['direction'], 
-                        auto_trigger=self.config['trigger']['autotrigger'])
+            for ch in self.config['channels']:
+                self.s.set_channel(ch, 
+                        coupling_type=self.config[ch]['coupling'], 
+                        range_value=self.config[ch]['range'], 
+                        offset=self.config[ch]['offset'])
+            self.set_trigger()
             self.clock = self.s.get_interval_from_timebase(
                     self.config['timebase'], 
                     self.config['pre'] + self.config['post'])
@@ -792,22 +905,41 @@ class Window(QMainWindow):
 
 
     def mca_settings(self):
+        if self.status == 'Measuring':
+            return None
         config_dialog = ConfigWindow(self.config)
         config_dialog.exec_()
 
         self.config = config_dialog.config
 
         if self.s is not None:
-            self.s.set_channel('A', coupling_type=self.config['A']['coupling'], 
-                    range_value=self.config['A']['range'], 
-                    offset=self.config['A']['offset'])
-            self.s.set_channel('B', coupling_type=self.config['B']['coupling'],
-                    range_value=self.config['B']['range'], 
-                    offset=self.config['B']['offset'])
-            self.s.set_trigger(self.config['trigger']['source'],
-                        threshold=self.config['trigger']['threshold'],
-                        direction=self.config['trigger']['direction'], 
-                        auto_trigger=self.config['trigger']['autotrigger'])
+            for ch in self.config['channels']:
+                self.s.set_channel(ch, 
+                        coupling_type=self.config[ch]['coupling'], 
+                        range_value=self.config[ch]['range'], 
+                        offset=self.config[ch]['offset'])
+            self.set_trigger()
+
+
+    def set_trigger(self):
+        trigger = self.config['trigger']
+        if trigger['source'] in ['AND', 'OR']:
+            # Hardware coincidence of both detectors, the edges are not
+            # simultaneous, so levels are used for the 'AND' condition
+            direction = trigger['direction']
+            if trigger['source'] == 'AND':
+                direction = {'RISING': 'ABOVE',
+                             'FALLING': 'BELOW'}[direction]
+            self.s.set_advanced_trigger(
+                        {'A': trigger['threshold'], 'B': trigger['threshold']},
+                        direction=direction,
+                        logic=trigger['source'],
+                        auto_trigger=trigger['autotrigger'])
+        else:
+            self.s.set_trigger(trigger['source'],
+                        threshold=trigger['threshold'],
+                        direction=trigger['direction'], 
+                        auto_trigger=trigger['autotrigger'])
 
 
     def calibrate(self):
@@ -816,9 +948,8 @@ class Window(QMainWindow):
 
 
     def stop(self):
-        self.finish = True
-        self.status = 'Ready'
-        self.statusbar.showMessage(self.status)
+        if self.status == 'Measuring':
+            self.acquisition.stop()
 
 
     def init_axes(self):
@@ -884,12 +1015,14 @@ class Window(QMainWindow):
             yr = self.ch_range[1] - 1
 
 
-        df = pandas.DataFrame(self.data, columns=['A', 'B', 'tA', 'tB'])
-        good = df[((df.A >= xl) & (df.A <= xr) & (df.B >= yl) & (df.B <= yr))]
-        self.count_input.setText('{}'.format(good.shape[0]))
+        if self.spectra.gate != (xl, xr, yl, yr):
+            good = self.data['flags'] == 0
+            self.spectra.set_gate((xl, xr, yl, yr), self.data['A'][good],
+                    self.data['B'][good], self.data['tA'][good],
+                    self.data['tB'][good])
+        self.count_input.setText('{}'.format(self.spectra.counts_gated))
 
-        bins, edges = numpy.histogram(df.tB - df.tA, 
-                range=self.t_range, bins=self.t_bins)
+        bins, edges = self.spectra.dt.counts, self.spectra.dt.edges
         self.data00.set_ydata(bins)
         self.data00.set_xdata(edges[:-1] * self.config['timebase'])
         ymax = max(bins[5:]) * 1.1 
@@ -897,13 +1030,11 @@ class Window(QMainWindow):
             ymax = 1.0
         self.axes[0][0].set_ylim(0, ymax)
 
-        bins, edges = numpy.histogram(good.tB - good.tA, 
-                range=self.t_range, bins=self.t_bins)
+        bins = self.spectra.dt_gated.counts
         self.data00g.set_ydata(bins)
         self.data00g.set_xdata(edges[:-1] * self.config['timebase'])
 
-        bins, edges = numpy.histogram(df.A, range=self.ch_range, 
-                bins=self.ch_bins)
+        bins, edges = self.spectra.A, self.spectra.a.edges
         self.data01L.set_ydata([0, max(bins) * 2])
         self.data01L.set_xdata(xl * self.calib['A'][1] 
                               + self.calib['A'][0])
@@ -918,14 +1049,12 @@ class Window(QMainWindow):
             ymax = 1.0
         self.axes[0][1].set_ylim(0, ymax)
 
-        bins, edges = numpy.histogram(good.A, range=self.ch_range, 
-                bins=self.ch_bins)
+        bins = self.spectra.A_gated
         self.data01g.set_ydata(bins)
         self.data01g.set_xdata(edges[:-1] * self.calib['A'][1] 
                               + self.calib['A'][0])
 
-        bins, edges = numpy.histogram(df.B, range=self.ch_range, 
-                bins=self.ch_bins)
+        bins, edges = self.spectra.B, self.spectra.b.edges
         self.data10L.set_ydata([0, max(bins) * 2])
         self.data10L.set_xdata(yl * self.calib['B'][1] 
                               + self.calib['B'][0])
@@ -940,17 +1069,19 @@ class Window(QMainWindow):
             ymax = 1.0
         self.axes[1][0].set_ylim(0, ymax)
 
-        bins, edges = numpy.histogram(good.B, range=self.ch_range, 
-                bins=self.ch_bins)
+        bins = self.spectra.B_gated
         self.data10g.set_ydata(bins)
         self.data10g.set_xdata(edges[:-1] * self.calib['B'][1] 
                               + self.calib['B'][0])
 
-        self.data11.set_xdata(df.A * self.calib['A'][1] + self.calib['A'][0])
-        self.data11.set_ydata(df.B * self.calib['B'][1] + self.calib['B'][0])
+        # Map of A vs B shows filled bins instead of all events
+        a, b = self.spectra.map()
+        self.data11.set_xdata(a * self.calib['A'][1] + self.calib['A'][0])
+        self.data11.set_ydata(b * self.calib['B'][1] + self.calib['B'][0])
 
-        self.data11g.set_xdata(good.A * self.calib['A'][1] + self.calib['A'][0])
-        self.data11g.set_ydata(good.B * self.calib['B'][1] + self.calib['B'][0])
+        a, b = self.spectra.map_gated()
+        self.data11g.set_xdata(a * self.calib['A'][1] + self.calib['A'][0])
+        self.data11g.set_ydata(b * self.calib['B'][1] + self.calib['B'][0])
 
 
 
@@ -985,78 +1116,69 @@ class Window(QMainWindow):
         self.data11g, = self.axes[1][1].plot([0], [0], marker='o', 
                 ls='None', color='red')
 
-        self.finish = False
-
         max_time = int(self.input_time.text())
 
-        self.data = []
-
-        t0 = datetime.datetime.now()
-        t_plot = datetime.datetime.now()
-
-        header = 'Start at {}\n'.format(t0)
-        header += 'EA  EB  tA  tB\n'
-
-        while True:
-            if self.finish:
-                break
-
-            try:
-                if self.s is not None:
-                    t, [A, B] = self.s.measure_relative_adc(
-                                        self.config['pre'], self.config['post'],
-                                        num_captures=self.config['captures'],
-                                        timebase=self.config['timebase'], 
-                                        inverse=True)
-                    for i, Ai in enumerate(A):
-                        xa = tools.amplitude(A[i, :], self.config['A'],
-                                self.clock, 'max')
-                        xb = tools.amplitude(B[i, :], self.config['B'],
-                                self.clock, 'max')
-
-                        ta = tools.zero_crossing(A[i, :], 
-                                self.config['A']['filter']['B'], 
-                                falling=False)
-                        tb = tools.zero_crossing(B[i, :], 
-                                self.config['B']['filter']['B'], 
-                                falling=False)
-
-                        self.data.append([xa[0], xb[0], ta, tb])
-
-                else:
-                    n = self.demo_data.shape[0]
-                    self.data.append(self.demo_data[numpy.random.choice(n)])
-                    time.sleep(0.01)
-
-                tnow = datetime.datetime.now()
-                dt = (tnow - t0).total_seconds()
-                self.progress.setValue(int(dt / max_time * 100))
-                self.input_elapsed.setText('{:.2f} s'.format(dt))
-                dt_plot = (tnow - t_plot).total_seconds()
-                if dt_plot > t_update:
-                    self.update_data()
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    t_plot = datetime.datetime.now()
-                if dt > max_time:
-                    self.finish = True
-            except KeyboardInterrupt:
-                print('\r Stop                ')
-                break
-
-        tnow = datetime.datetime.now()
-        dt = (tnow - t0).total_seconds()
+        self.data = eventstore.EventStore(EVENT_DTYPE)
+        self.spectra = histograms.CoincidenceSpectra(self.ch_range,
+                self.ch_bins, self.t_range, self.t_bins)
 
-        footer = 'Stop at {}\n'.format(tnow)
-        footer += 'Total running time: {:.3f} s\n'.format(dt)
-        footer += 'Total events: {}'.format(len(self.data))
+        self.t0 = datetime.datetime.now()
+        if self.s is not None:
+            self.s.stats.reset()
 
+        # Events are written during the run, in a binary list-mode file
         out_file_name = '{0}_{1.year}{1.month:02}{1.day:02}_{1.hour:02}'\
-                '{1.minute:02}{1.second:02}.txt'.format(
-                        self.input_file.text(), t0)
-        out_file_path  = os.path.join(self.path_name, out_file_name)
-        numpy.savetxt(out_file_path, self.data, fmt='%.3f', header=header,
-                footer=footer, delimiter=' ')
+                '{1.minute:02}{1.second:02}.lmd'.format(
+                        self.input_file.text(), self.t0)
+        self.writer = listmode.ListModeWriter(
+                os.path.join(self.path_name, out_file_name), EVENT_DTYPE,
+                {'config': self.config, 'calibration': self.calib})
+
+        self.acquisition = Acquisition(self.s, self.config, self.clock,
+                max_time, t_update,
+                None if self.s is not None else self.demo_data)
+        self.acquisition.events_ready.connect(self.add_events)
+        self.acquisition.error.connect(self.acquisition_error)
+        self.acquisition.finished.connect(self.save_data)
+        self.acquisition.start()
+
+
+    def add_events(self, new_events):
+        self.data.append(new_events)
+        self.writer.write(new_events)
+        good = new_events[new_events['flags'] == 0]
+        self.spectra.fill(good['A'], good['B'], good['tA'], good['tB'])
+
+        max_time = self.acquisition.max_time
+        dt = (datetime.datetime.now() - self.t0).total_seconds()
+        self.progress.setValue(min(int(dt / max_time * 100), 100))
+        self.input_elapsed.setText('{:.2f} s'.format(dt))
+        if self.s is not None:
+            self.statusbar.showMessage('{}: {}'.format(
+                self.status, self.s.stats))
+        self.update_data()
+        self.figure.canvas.draw_idle()
+
+
+    def acquisition_error(self, message):
+        error_msg = QMessageBox(self)
+        error_msg.setIcon(QMessageBox.Critical)
+        error_msg.setWindowTitle('Error')
+        error_msg.setText('Acquisition stopped with an error')
+        error_msg.setInformativeText(message)
+        error_msg.setStandardButtons(QMessageBox.Ok)
+        error_msg.show()
+
+
+    def save_data(self):
+        tnow = datetime.datetime.now()
+        dt = (tnow - self.t0).total_seconds()
+
+        info = {'running_time': dt}
+        if self.s is not None:
+            info['live_time'] = self.s.stats.live_time
+            info['dead_time_fraction'] = self.s.stats.dead_time_fraction
+        self.writer.close(info)
 
         self.progress.setValue(100)
         self.input_elapsed.setText('{:.2f} s'.format(dt))
@@ -1092,40 +1214,33 @@ class Window(QMainWindow):
         if yr >= self.ch_range[1]:
             yr = self.ch_range[1] - 1
 
-        df = pandas.DataFrame(self.data, columns=['A', 'B', 'tA', 'tB'])
-        good = df[df.A >= xl][df.A <= xr][df.B >= yl][df.B <= yr]
-
         if self.combo_fit.currentText() == 'A':
-            bins, edges = numpy.histogram(df.A, range=self.ch_range, 
-                    bins=self.ch_bins)
+            bins, edges = self.spectra.A, self.spectra.a.edges
             col = 0
             row = 1
             ch = 'A'
         if self.combo_fit.currentText() == 'A gate':
-            bins, edges = numpy.histogram(good.A, range=self.ch_range, 
-                    bins=self.ch_bins)
+            bins, edges = self.spectra.A_gated, self.spectra.a.edges
             col = 0
             row = 1 
             ch = 'A'
         elif self.combo_fit.currentText() == 'B':
-            bins, edges = numpy.histogram(df.B, range=self.ch_range, 
-                    bins=self.ch_bins)
+            bins, edges = self.spectra.B, self.spectra.b.edges
             xl = yl
             xr = yr
             col = 1
             row = 0
             ch = 'B'
         elif self.combo_fit.currentText() == 'B gate':
-            bins, edges = numpy.histogram(good.B, range=self.ch_range, 
-                    bins=self.ch_bins)
+            bins, edges = self.spectra.B_gated, self.spectra.b.edges
             xl = yl
             xr = yr
             col = 1
             row = 0
             ch = 'B'
         elif self.combo_fit.currentText() == 'dt':
-            bins, edges = numpy.histogram(good.tB - good.tA, 
-                    range=self.t_range, bins=self.t_bins)
+            bins = self.spectra.dt_gated.counts
+            edges = self.spectra.dt_gated.edges
             xl = 0
             xr = self.t_bins - 1
             col = 0
@@ -1190,7 +1305,9 @@ class Window(QMainWindow):
 
 
     def closeEvent(self, event):
-        self.finish = True
+        if self.status == 'Measuring':
+            self.acquisition.stop()
+            self.acquisition.wait()
 
 
 
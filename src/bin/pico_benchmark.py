@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+import argparse
+import os
+import PicoNuclear
+import PicoNuclear.benchmark as benchmark
+import PicoNuclear.tools as tools
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Benchmark of the data processing chain, '
+                        'uses simulated device (no hardware needed)')
+    parser.add_argument('config', nargs='?', type=argparse.FileType('r'),
+            help='XML configuration file (optional)')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[512, 2048],
+            help='Trace lengths (samples)')
+    parser.add_argument('--captures', type=int, nargs='+', default=[16, 256],
+            help='Captures per batch')
+    parser.add_argument('--pileup', type=float, nargs='+', default=[0.0, 0.1],
+            help='Probabilities of a pileup in a capture')
+    parser.add_argument('--batches', type=int, default=20,
+            help='Batches processed in each case')
+    parser.add_argument('--backend', default='numpy',
+            help='DSP backend (numpy, numba or auto)')
+    parser.add_argument('--save',
+            help='Name of output file with report in JSON (optional)')
+    parser.add_argument('--compare',
+            help='Report to compare with, e.g. of previous release '
+                 '(optional)')
+
+    args = parser.parse_args()
+
+    if args.config is None:
+        args.config = os.path.join(PicoNuclear.__path__[0], 'data',
+                                   'default.xml')
+    config = tools.load_configuration(args.config)
+    tools.set_backend(args.backend)
+
+    report = benchmark.run_benchmark(config, args.lengths, args.captures,
+                                     args.pileup, args.batches, progress=True)
+
+    print('# {:>7} {:>8} {:>6} {:>10} {:>10}'.format(
+        'samples', 'captures', 'pileup', 'capt/s', 'events/s'), end='')
+    for stage in benchmark.STAGES:
+        print(' {:>11}'.format(stage), end='')
+    print()
+    for result in report['results']:
+        print('  {:>7} {:>8} {:>6.2f} {:>10.0f} {:>10.0f}'.format(
+            result['num_samples'], result['num_captures'], result['pileup'],
+            result['captures_per_s'], result['events_per_s']), end='')
+        for stage in benchmark.STAGES:
+            print(' {:>8.3f} ms'.format(result['stages'][stage]['p50']),
+                  end='')
+        print()
+
+    if args.save is not None:
+        benchmark.save_report(report, args.save)
+
+    if args.compare is not None:
+        reference = benchmark.load_report(args.compare)
+        print('# Median latency compared with {}'.format(args.compare))
+        print('# {:>7} {:>8} {:>6} {:>11} {:>10} {:>10} {:>7}'.format(
+            'samples', 'captures', 'pileup', 'stage', 'old (ms)', 'new (ms)',
+            'ratio'))
+        for case, stage, t_old, t_new, ratio in benchmark.compare_reports(
+                reference, report):
+            print('  {:>7} {:>8} {:>6.2f} {:>11} {:>10.3f} {:>10.3f} '
+                  '{:>7.2f}'.format(*case, stage, t_old, t_new, ratio))
@@ -4,6 +4,7 @@ import argparse
 import numpy
 import matplotlib.pyplot as plt
 from PicoNuclear.pico3000a import PicoScope3000A
+import PicoNuclear.archive as archive
 import PicoNuclear.tools as tools
 
 
@@ -13,6 +14,8 @@ if __name__ == '__main__':
                          help='XML configuration file')
     parser.add_argument('--save', 
             help='Name of output file with waveforms (optional)')
+    parser.add_argument('--archive', 
+            help='Name of output waveform archive (ADC values, optional)')
     parser.add_argument('-f', help='Apply trapezoidal filter (optional)',
             action='store_true')
 
@@ -21,8 +24,10 @@ if __name__ == '__main__':
     config = tools.load_configuration(args.config)
     s = PicoScope3000A()
 
-    s.set_channel('A', coupling_type=config['A']['coupling'], 
-            range_value=config['A']['range'], offset=config['A']['offset'])
+    channels = config['channels']
+    for ch in channels:
+        s.set_channel(ch, coupling_type=config[ch]['coupling'], 
+                range_value=config[ch]['range'], offset=config[ch]['offset'])
     s.set_trigger(config['trigger']['source'],
                   threshold=config['trigger']['threshold'],
                   direction=config['trigger']['direction'], 
@@ -42,17 +47,31 @@ if __name__ == '__main__':
                                        * interval / unit[0]),
                                        unit[1]))
 
-    t, [A, B] = s.measure(config['pre'], config['post'],
-            num_captures=config['captures'], timebase=config['timebase'])
+    if args.archive is not None:
+        values, times = s.measure_adc_values(config['pre'], config['post'],
+                num_captures=config['captures'], timebase=config['timebase'],
+                trigger_times=True)
+        values = dict(zip(s.channels, values))
+        with archive.WaveformWriter('{}.pnw'.format(args.archive), channels,
+                config['pre'] + config['post'], interval,
+                {ch: config[ch]['range'] for ch in channels},
+                {ch: config[ch]['offset'] for ch in channels},
+                info={'config': config}) as writer:
+            writer.write(values, times, s.get_overflow())
+        t = interval * numpy.arange(config['pre'] + config['post'])
+        data = {ch: archive.to_volts(values[ch], config[ch]['range'],
+                                     config[ch]['offset'])
+                for ch in channels}
+    else:
+        t, data = s.measure(config['pre'], config['post'],
+                num_captures=config['captures'], timebase=config['timebase'])
+        data = dict(zip(s.channels, data))
 
     s.close()
 
     if args.save is not None:
-        data = numpy.zeros((A.shape[1], A.shape[0] + B.shape[0] + 1))
-        data[:, 0] = t
-        data[:, 1:A.shape[0]+1] = numpy.rot90(A)
-        data[:, A.shape[0]+1: ] = numpy.rot90(B)
-        numpy.savetxt('{}.txt'.format(args.save), data, 
+        columns = [t] + [V for ch in channels for V in data[ch]]
+        numpy.savetxt('{}.txt'.format(args.save), numpy.column_stack(columns),
                 fmt='%.3f', delimiter=' ')
 
     nx = int(numpy.round(numpy.sqrt(config['captures'])))
@@ -65,27 +84,32 @@ if __name__ == '__main__':
 
     fig, axes = plt.subplots(nx, ny, sharex='all', sharey='all')
 
-    for i, Ai in enumerate(A):
-        ix = int(i % nx)
-        iy = int(i // nx)
-        axes[ix][iy].plot(t / unit[0], A[i, :], marker='.', ls='-', 
-                ds='steps-mid', color='blue', label='A')
-        if args.f:
-            amp, sa = tools.trapezoidal(A[i, :], config['A'], interval)
-            ta = tools.zero_crossing(A[i, :], config['A']['filter']['B'], 
-                                    falling=False)
-            axes[ix][iy].axvline(ta / unit[0], ls='--', color='red')
-            axes[ix][iy].text(ta / unit[0], 0, 
-                    ' A = {:.1f}\n t = {:.1f}'.format(amp[0], ta / unit[0]),
-                    fontsize=8)
+    colors = {'A': 'blue', 'B': 'red', 'C': 'green', 'D': 'magenta'}
+    for ch in channels:
+        for i, Vi in enumerate(data[ch]):
+            ix = int(i % nx)
+            iy = int(i // nx)
+            axes[ix][iy].plot(t / unit[0], Vi, marker='.', ls='-', 
+                    ds='steps-mid', color=colors[ch], label=ch)
+            if args.f:
+                amp, sa = tools.trapezoidal(Vi, config[ch], interval)
+                ta = tools.zero_crossing(Vi, config[ch]['filter']['B'], 
+                                        falling=False)
+                axes[ix][iy].axvline(ta / unit[0], ls='--', 
+                                     color=colors[ch])
+                axes[ix][iy].text(ta / unit[0], 0, 
+                        ' {} = {:.1f}\n t = {:.1f}'.format(ch, amp[0], 
+                                                           ta / unit[0]),
+                        fontsize=8)
 
 
     for ax in axes[-1]:
         ax.set_xlabel('t ({})'.format(unit[1]), size=14)
     for axr in axes:
         axr[0].set_ylabel('U (V)', size=14)
-        axr[0].set_ylim(-config['A']['range'] + config['A']['offset'],
-                config['A']['range'] + config['A']['offset'])
+        v_range = max(config[ch]['range'] for ch in channels)
+        axr[0].set_ylim(-v_range + config[channels[0]]['offset'],
+                v_range + config[channels[0]]['offset'])
         axr[0].set_xlim(0, None)
         for ax in axr:
             ax.legend()
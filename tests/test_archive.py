@@ -0,0 +1,114 @@
+import numpy
+import pytest
+
+from PicoNuclear.archive import WaveformArchive, WaveformWriter, to_volts
+
+
+CHANNELS = ['A', 'B']
+RANGES = {'A': 1.0, 'B': 0.5}
+OFFSETS = {'A': 0.0, 'B': 0.1}
+
+
+def captures(n, start=0, num_samples=50):
+    rng = numpy.random.default_rng(start)
+    data = rng.integers(-32512, 32512, (n, 2, num_samples),
+                        dtype=numpy.int16)
+    times = numpy.arange(start, start + n, dtype=numpy.int64) * 10**6
+    overflow = numpy.arange(start, start + n, dtype=numpy.uint16) % 4
+    return data, times, overflow
+
+
+def write(name, batches, compression='zlib', chunk_size=16):
+    writer = WaveformWriter(name, CHANNELS, 50, 4.0, RANGES, OFFSETS,
+                            chunk_size=chunk_size, compression=compression,
+                            info={'run': 7})
+    for data, times, overflow in batches:
+        writer.write(dict(zip(CHANNELS, data.transpose(1, 0, 2))), times,
+                     overflow)
+    return writer
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'none'])
+def test_round_trip(tmp_path, compression):
+    name = str(tmp_path / 'run.pnw')
+    batches = [captures(10), captures(30, 10), captures(1, 40)]
+    write(name, batches, compression).close()
+    data, times, overflow = (numpy.concatenate(parts)
+                             for parts in zip(*batches))
+    with WaveformArchive(name) as archive:
+        assert len(archive) == 41
+        assert archive.header['run'] == 7
+        assert archive.interval == 4.0
+        assert numpy.array_equal(archive[:], data)
+        assert numpy.array_equal(archive[5:37], data[5:37])
+        assert numpy.array_equal(archive[-1], data[-1])
+        assert numpy.array_equal(archive.read(14, 20, channels=['B']),
+                                 data[14:20, 1:])
+        assert numpy.array_equal(archive.trigger_times(), times)
+        assert numpy.array_equal(archive.overflow(15, 17), overflow[15:17])
+        with pytest.raises(IndexError):
+            archive[41]
+        with pytest.raises(ValueError):
+            archive[::2]
+
+
+def test_channel_settings_per_chunk(tmp_path):
+    name = str(tmp_path / 'run.pnw')
+    writer = write(name, [captures(5)])
+    writer.set_channel_settings({'A': 2.0, 'B': 0.5}, OFFSETS)
+    writer.write(list(captures(5, 5)[0].transpose(1, 0, 2)),
+                 captures(5, 5)[1])
+    writer.close()
+    with WaveformArchive(name) as archive:
+        assert archive.settings(4)['ranges']['A'] == 1.0
+        assert archive.settings(5)['ranges']['A'] == 2.0
+        volts = archive.read_volts(3, 7, channels=['A'])
+        data = archive.read(3, 7, channels=['A'])
+        assert numpy.allclose(volts[:2], to_volts(data[:2], 1.0, 0.0))
+        assert numpy.allclose(volts[2:], to_volts(data[2:], 2.0, 0.0))
+        assert (archive.overflow(5) == 0).all()
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'none'])
+def test_truncated_archive(tmp_path, compression):
+    name = str(tmp_path / 'run.pnw')
+    write(name, [captures(40)], compression).close()
+    data = captures(40)[0]
+    with WaveformArchive(name) as archive:
+        last_chunk = archive._chunks[-1]
+    # A crash while the last chunk was written, the index is lost
+    with open(name, 'r+b') as f:
+        f.truncate(last_chunk.data + 10)
+    with WaveformArchive(name) as archive:
+        assert len(archive) == 32
+        assert numpy.array_equal(archive[:], data[:32])
+        assert numpy.array_equal(archive.trigger_times(),
+                                 captures(40)[1][:32])
+
+
+def test_missing_index(tmp_path):
+    # Closed without the index, all chunks are found by scanning
+    name = str(tmp_path / 'run.pnw')
+    writer = write(name, [captures(20)])
+    writer._flush()
+    writer._queue.put(None)
+    writer._thread.join()
+    writer._file.close()
+    with WaveformArchive(name) as archive:
+        assert len(archive) == 20
+        assert numpy.array_equal(archive[:], captures(20)[0])
+
+
+def test_invalid_input(tmp_path):
+    name = str(tmp_path / 'run.pnw')
+    with pytest.raises(ValueError):
+        WaveformWriter(name, CHANNELS, 50, 4.0, RANGES, OFFSETS,
+                       compression='lzma')
+    with write(name, []) as writer:
+        with pytest.raises(ValueError):
+            writer.write(captures(2, num_samples=40)[0].transpose(1, 0, 2),
+                         numpy.zeros(2))
+    other = tmp_path / 'other.pnw'
+    other.write_bytes(b'NOPE' + bytes(100))
+    with pytest.raises(ValueError):
+        WaveformArchive(str(other))
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+
+from PicoNuclear.simulator import SimulatedPicoScope
+
+
+def make_scope(**kwargs):
+    s = SimulatedPicoScope(seed=6, **kwargs)
+    s.set_channel('A', range_value=1)
+    s.set_trigger('A')
+    return s
+
+
+def test_data_ready():
+    s = make_scope()
+
+    async def run():
+        s.start_run(20, 80, num_captures=5)
+        return await s.data_ready(timeout=1)
+
+    assert asyncio.run(run())
+    assert s.data_is_ready.is_set()
+
+
+def test_data_ready_timeout():
+    # 20 captures at 10/s take about 2 s
+    s = make_scope(rate=10, realtime=True)
+
+    async def run():
+        s.start_run(20, 80, num_captures=20)
+        t0 = time.perf_counter()
+        ready = await s.data_ready(timeout=0.05)
+        return ready, time.perf_counter() - t0
+
+    ready, waited = asyncio.run(run())
+    assert not ready
+    assert 0.04 < waited < 1
+    assert not s.data_is_ready.is_set()
+
+
+def test_loop_is_not_blocked():
+    s = make_scope(rate=200, realtime=True)
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.005)
+
+    async def run():
+        task = asyncio.create_task(ticker())
+        values = await s.measure_adc_values_async(20, 80, num_captures=20)
+        task.cancel()
+        return values
+
+    A = asyncio.run(run())[0]
+    assert A.shape == (20, 100)
+    # The run took about 0.1 s, the ticker kept running meanwhile
+    assert len(ticks) > 5
+
+
+def test_cancel_while_waiting():
+    s = make_scope(rate=10, realtime=True)
+
+    async def run():
+        s.start_run(20, 80, num_captures=20)
+        task = asyncio.create_task(s.data_ready())
+        await asyncio.sleep(0.02)
+        task.cancel()
+        t0 = time.perf_counter()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return time.perf_counter() - t0
+
+    assert asyncio.run(run()) < 0.5
+    assert not s.data_is_ready.is_set()
+
+
+def test_measure_async_timeout():
+    s = make_scope(rate=10, realtime=True)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(s.measure_adc_values_async(20, 80, num_captures=20,
+                                               timeout=0.05))
+    assert s.stats.runs == 1
+    assert s.stats.captures == 0
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import numpy
+import pytest
+
+from PicoNuclear.buffers import RingBuffer
+
+
+def chunk(start, n, num_channels=2):
+    return [numpy.arange(start, start + n, dtype=numpy.int16) + 1000 * c
+            for c in range(num_channels)]
+
+
+def test_read_is_contiguous_across_wrap_around():
+    ring = RingBuffer(2, 10, max_read=4)
+    ring.write(chunk(0, 8))
+    start, view = ring.read(4)
+    assert start == 0
+    assert list(view[0]) == [0, 1, 2, 3]
+    ring.release(6)
+    ring.write(chunk(8, 6))
+    start, view = ring.read(4)
+    assert start == 6
+    assert view.shape == (2, 4)
+    assert list(view[0]) == [6, 7, 8, 9]
+    ring.release(4)
+    start, view = ring.read(4)
+    assert start == 10
+    assert list(view[0]) == [10, 11, 12, 13]
+    assert list(view[1]) == [1010, 1011, 1012, 1013]
+    assert ring.overruns == 0
+
+
+def test_every_position_matches_the_stream():
+    ring = RingBuffer(1, 7, max_read=3)
+    expected = 0
+    for step in range(40):
+        ring.write(chunk(ring.total_written, step % 3 + 1, 1))
+        while ring.available >= 3:
+            start, view = ring.read(3)
+            assert start == expected
+            assert list(view[0]) == list(range(expected, expected + 3))
+            ring.release(3)
+            expected += 3
+    assert ring.overruns == 0
+
+
+def test_overrun_drops_oldest_samples():
+    ring = RingBuffer(2, 10, max_read=5)
+    ring.write(chunk(0, 8))
+    ring.write(chunk(8, 6))
+    assert ring.overruns == 4
+    assert ring.available == 10
+    start, view = ring.read(5)
+    assert start == 4
+    assert list(view[0]) == [4, 5, 6, 7, 8]
+
+
+def test_write_larger_than_capacity():
+    ring = RingBuffer(1, 10, max_read=10)
+    ring.write(chunk(0, 25, 1))
+    assert ring.total_written == 25
+    start, view = ring.read()
+    assert start == 15
+    assert list(view[0]) == list(range(15, 25))
+
+
+def test_read_timeout_and_limits():
+    ring = RingBuffer(1, 10, max_read=4)
+    assert ring.read(2, timeout=0.01) == (None, None)
+    with pytest.raises(ValueError):
+        ring.read(5)
+    with pytest.raises(ValueError):
+        RingBuffer(1, 10, max_read=11)
+
+
+def test_close_wakes_up_waiting_reader():
+    ring = RingBuffer(1, 10, max_read=4)
+    ring.write(chunk(0, 2, 1))
+    result = []
+    reader = threading.Thread(
+            target=lambda: result.append(ring.read(4, timeout=10)))
+    reader.start()
+    time.sleep(0.05)
+    assert reader.is_alive()
+    t0 = time.perf_counter()
+    ring.close()
+    reader.join(5)
+    assert time.perf_counter() - t0 < 1
+    start, view = result[0]
+    assert start == 0
+    assert list(view[0]) == [0, 1]
+    ring.release(2)
+    start, view = ring.read(4, timeout=10)
+    assert start == 2
+    assert view.shape == (1, 0)
+    ring.reset()
+    assert not ring.closed
@@ -0,0 +1,48 @@
+import numpy
+import pytest
+
+from PicoNuclear.simulator import SimulatedPicoScope
+
+
+def make_scope(channels=('A', 'B'), memory=10000):
+    s = SimulatedPicoScope(seed=4, rate=1e4, memory=memory)
+    for ch in channels:
+        s.set_channel(ch)
+        s.set_source(ch, background=0.0)
+    return s
+
+
+def test_max_captures_shared_by_channels():
+    assert make_scope(('A',)).get_max_captures(100) == 100
+    assert make_scope(('A', 'B')).get_max_captures(100) == 50
+
+
+def test_measure_chunked_runs():
+    s = make_scope()
+    A, B = s.measure_chunked(20, 80, num_captures=120)
+    assert A.shape == (120, 100) and B.shape == (120, 100)
+    # Two full runs of 50 captures and the last one of 20
+    assert s.stats.runs == 3
+    assert s.stats.captures == 120
+    times = s.get_trigger_times()
+    assert times.shape == (120,)
+    # Times are exact within a run, runs are aligned with the host clock
+    for run in [times[:50], times[50:100], times[100:]]:
+        assert (numpy.diff(run) > 0).all()
+    assert times[50] > times[0] and times[100] > times[50]
+    assert s.get_overflow().shape == (120,)
+    # Every capture has the pulse of the trigger
+    assert (A.min(axis=1) < -0.1 * 32512).all()
+
+
+def test_measure_chunked_trigger_times_returned():
+    s = make_scope()
+    data, times = s.measure_chunked(20, 80, num_captures=50,
+                                    trigger_times=True)
+    assert times.shape == (50,)
+    assert s.stats.runs == 1
+
+
+def test_measure_chunked_no_captures():
+    with pytest.raises(ValueError):
+        make_scope().measure_chunked(20, 80, num_captures=0)
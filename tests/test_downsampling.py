@@ -0,0 +1,80 @@
+import numpy
+import pytest
+
+from PicoNuclear.simulator import SimulatedPicoScope
+
+
+def make_scope():
+    s = SimulatedPicoScope(seed=7)
+    for ch in ['A', 'B']:
+        s.set_channel(ch, range_value=1)
+    s.set_trigger('A')
+    return s
+
+
+def raw_and_reduced(mode, ratio, num_samples=100, num_captures=5):
+    # The same seed gives the same captures, with and without downsampling
+    raw = make_scope().measure_adc_values(20, num_samples - 20,
+                                          num_captures=num_captures)
+    reduced = make_scope().measure_adc_values(
+            20, num_samples - 20, num_captures=num_captures,
+            downsample_mode=mode, downsample_ratio=ratio)
+    return raw, reduced
+
+
+@pytest.mark.parametrize('ratio', [1, 4, 7])
+def test_aggregate_buffers(ratio):
+    raw, reduced = raw_and_reduced('AGGREGATE', ratio)
+    n = -(-100 // ratio)
+    for values, aggregated in zip(raw, reduced):
+        assert aggregated.shape == (2, 5, n)
+        assert aggregated.dtype == numpy.int16
+        for i in range(n):
+            block = values[:, i * ratio:(i + 1) * ratio]
+            assert numpy.array_equal(aggregated[0, :, i], block.max(axis=1))
+            assert numpy.array_equal(aggregated[1, :, i], block.min(axis=1))
+        assert (aggregated[0] >= aggregated[1]).all()
+
+
+@pytest.mark.parametrize('ratio', [4, 7])
+def test_decimate_and_average_shapes(ratio):
+    n = -(-100 // ratio)
+    raw, decimated = raw_and_reduced('DECIMATE', ratio)
+    for values, reduced in zip(raw, decimated):
+        assert reduced.shape == (5, n)
+        assert numpy.array_equal(reduced, values[:, ::ratio])
+    raw, averaged = raw_and_reduced('AVERAGE', ratio)
+    for values, reduced in zip(raw, averaged):
+        assert reduced.shape == (5, n)
+        assert numpy.allclose(reduced[:, 0],
+                              values[:, :ratio].mean(axis=1), atol=0.5)
+        assert numpy.allclose(reduced[:, -1],
+                              values[:, (n - 1) * ratio:].mean(axis=1),
+                              atol=0.5)
+
+
+def test_time_values_and_layout():
+    s = make_scope()
+    t, (A, B) = s.measure(20, 80, num_captures=3,
+                          downsample_mode='AVERAGE', downsample_ratio=8)
+    assert A.shape == (3, 13)
+    assert t.shape == (13,)
+    assert numpy.allclose(numpy.diff(t),
+                          8 * s.get_interval_from_timebase(1))
+    # Downsampling is a part of the buffer layout, the mode is reset
+    # with new buffers
+    A, B = s.measure_adc_values(20, 80, num_captures=3)
+    assert A.shape == (3, 100)
+    buffers = s.allocate_buffer_sets(100, 3, 1)[0]
+    s.swap_buffers(buffers)
+    s.start_run(20, 80, num_captures=3)
+    s.wait_for_data()
+    assert s.get_adc_data()[0].shape == (3, 100)
+
+
+def test_invalid_downsampling():
+    s = make_scope()
+    with pytest.raises(ValueError):
+        s.set_up_buffers(100, 1, 'MEDIAN', 2)
+    with pytest.raises(ValueError):
+        s.set_up_buffers(100, 1, 'AVERAGE', 0)
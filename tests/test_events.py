@@ -0,0 +1,41 @@
+import numpy
+
+from PicoNuclear.events import build_events
+from PicoNuclear.tools import HIT_DTYPE
+
+
+def make_hits(captures, channels, times, amplitudes=None):
+    hits = numpy.empty(len(times), dtype=HIT_DTYPE)
+    hits['capture'] = captures
+    hits['channel'] = channels
+    hits['time'] = times
+    hits['amplitude'] = (numpy.arange(len(times)) + 1 if amplitudes is None
+                         else amplitudes)
+    return hits
+
+
+def test_coincidences_and_singles():
+    hits = make_hits([0, 0, 0, 1], [0, 1, 1, 0], [10.0, 12.0, 50.0, 10.0])
+    coin, singles = build_events(hits, 5.0)
+    assert coin.shape[0] == 1
+    assert coin['A'][0] == 1 and coin['B'][0] == 2
+    assert coin['tB'][0] - coin['tA'][0] == 2.0
+    assert singles.shape[0] == 2
+    assert sorted(singles['mask']) == [1, 2]
+
+
+def test_zero_window_returns_singles():
+    hits = make_hits([0, 0, 0, 1], [0, 1, 1, 0], [10.0, 10.0, 50.0, 10.0])
+    for window in (0.0, -1.0):
+        coin, singles = build_events(hits, window)
+        assert coin.shape[0] == 0
+        assert singles.shape[0] == hits.shape[0]
+        assert list(singles['mask']) == [1, 2, 2, 1]
+        assert list(singles['capture']) == [0, 0, 0, 1]
+
+
+def test_pileup_in_same_channel_is_merged_in_next_pass():
+    hits = make_hits([0, 0, 0], [0, 0, 1], [0.0, 1.0, 2.0])
+    coin, singles = build_events(hits, 5.0)
+    assert coin.shape[0] + singles.shape[0] == 2
+    assert coin.shape[0] == 1 and singles.shape[0] == 1
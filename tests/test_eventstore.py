@@ -0,0 +1,78 @@
+import numpy
+import pytest
+
+from PicoNuclear.eventstore import EventStore
+
+
+DTYPE = [('time', numpy.int64), ('mask', numpy.uint8),
+         ('A', numpy.float32)]
+
+
+def batch(n, start=0):
+    b = numpy.zeros(n, dtype=DTYPE)
+    b['time'] = numpy.arange(start, start + n) * 10**9
+    b['mask'] = 3
+    b['A'] = numpy.arange(start, start + n) * 0.5
+    return b
+
+
+def test_fields_are_required():
+    with pytest.raises(ValueError):
+        EventStore(numpy.float32)
+
+
+def test_append_structured_and_dict():
+    store = EventStore(DTYPE)
+    store.append(batch(3))
+    store.append({'time': 3 * 10**9, 'mask': 1, 'A': 1.5})
+    assert len(store) == 4
+    assert store['time'].dtype == numpy.int64
+    assert store['mask'].dtype == numpy.uint8
+    assert list(store['time']) == [i * 10**9 for i in range(4)]
+    assert list(store['mask']) == [3, 3, 3, 1]
+    assert store.nbytes == 4 * numpy.dtype(DTYPE).itemsize
+
+
+def test_grows_by_doubling():
+    store = EventStore(DTYPE, capacity=4)
+    store.append(batch(4))
+    assert store.capacity == 4
+    store.append(batch(1, 4))
+    assert store.capacity == 8
+    store.append(batch(12, 5))
+    assert store.capacity == 32
+    assert numpy.array_equal(store['A'], numpy.arange(17) * 0.5)
+
+
+def test_reserve_keeps_events():
+    store = EventStore(DTYPE, capacity=2)
+    store.append(batch(2))
+    store.reserve(100)
+    assert store.capacity == 128
+    assert numpy.array_equal(store.to_records(), batch(2))
+
+
+def test_to_records_and_columns():
+    store = EventStore(DTYPE, capacity=1)
+    for i in range(5):
+        store.append(batch(2, 2 * i))
+    records = store.to_records(3, 7)
+    assert records.dtype == numpy.dtype(DTYPE)
+    assert numpy.array_equal(records, batch(10)[3:7])
+    columns = store.columns(8)
+    assert set(columns) == {'time', 'mask', 'A'}
+    assert list(columns['A']) == [4.0, 4.5]
+    assert numpy.shares_memory(columns['A'], store['A'])
+    records[0]['A'] = -1
+    assert store['A'][3] == 1.5
+
+
+def test_clear_keeps_capacity():
+    store = EventStore(DTYPE, capacity=4)
+    store.append(batch(6))
+    store.clear()
+    assert len(store) == 0
+    assert store.capacity == 8
+    assert store.to_records().shape == (0,)
+    store.append(batch(1, 7))
+    assert list(store['time']) == [7 * 10**9]
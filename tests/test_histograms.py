@@ -0,0 +1,52 @@
+import numpy
+
+from PicoNuclear.histograms import CoincidenceSpectra, Histogram
+
+
+def events(n=5000, seed=2):
+    rng = numpy.random.default_rng(seed)
+    A = rng.integers(0, 100, n).astype(numpy.float32)
+    B = rng.integers(0, 100, n).astype(numpy.float32)
+    tA = rng.normal(0, 5, n)
+    tB = rng.normal(0, 5, n)
+    return A, B, tA, tB
+
+
+def test_histogram_matches_numpy():
+    values = numpy.random.default_rng(1).uniform(-10, 110, 1000)
+    values[:3] = [0, 100, 50]
+    h = Histogram((0, 100), 100)
+    h.fill(values[:500])
+    h.fill(values[500:])
+    counts, edges = numpy.histogram(values, 100, (0, 100))
+    assert numpy.array_equal(h.counts, counts)
+    assert numpy.allclose(h.edges, edges)
+
+
+def test_gate_matches_mask_selection():
+    A, B, tA, tB = events()
+    for gate in [(10, 40, 20, 99), (0, 0, 0, 99), (35, 35, 50, 50),
+                 (-5, 120, 5, 6)]:
+        xl, xr, yl, yr = gate
+        spectra = CoincidenceSpectra((0, 100), 100, (-50, 50), 100)
+        spectra.fill(A[:2000], B[:2000], tA[:2000], tB[:2000])
+        spectra.set_gate(gate, A[:2000], B[:2000], tA[:2000], tB[:2000])
+        spectra.fill(A[2000:], B[2000:], tA[2000:], tB[2000:])
+        good = (A >= xl) & (A <= xr) & (B >= yl) & (B <= yr)
+        assert spectra.counts_gated == good.sum()
+        assert numpy.array_equal(
+                spectra.A_gated, numpy.histogram(A[good], 100, (0, 100))[0])
+        assert numpy.array_equal(
+                spectra.B_gated, numpy.histogram(B[good], 100, (0, 100))[0])
+        assert numpy.array_equal(
+                spectra.dt_gated.counts,
+                numpy.histogram((tB - tA)[good], 100, (-50, 50))[0])
+
+
+def test_unchanged_gate_is_not_refilled():
+    A, B, tA, tB = events(100)
+    spectra = CoincidenceSpectra((0, 100), 100, (-50, 50), 100)
+    spectra.fill(A, B, tA, tB)
+    assert spectra.set_gate((0, 99, 0, 99), A, B, tA, tB)
+    assert not spectra.set_gate((0, 99, 0, 99), A, B, tA, tB)
+    assert spectra.counts_gated == 100
@@ -0,0 +1,90 @@
+import os
+
+import numpy
+import pytest
+
+from PicoNuclear.listmode import ListModeWriter, read_header, read_listmode
+
+
+DTYPE = [('time', numpy.int64), ('mask', numpy.uint8),
+         ('flags', numpy.uint8), ('A', numpy.float32),
+         ('tA', numpy.float32)]
+
+
+def batch(n, start=0):
+    b = numpy.zeros(n, dtype=DTYPE)
+    b['time'] = (numpy.arange(start, start + n) * 123456789012)
+    b['mask'] = 1
+    b['flags'] = numpy.arange(start, start + n) % 2
+    b['A'] = numpy.arange(start, start + n) * 0.25
+    b['tA'] = -1.5
+    return b
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(tmp_path, mmap):
+    name = str(tmp_path / 'run.lmd')
+    with ListModeWriter(name, DTYPE, {'config': {'captures': 100},
+                                      'gain': numpy.float32(2.5)}) as writer:
+        writer.write(batch(10))
+        columns = batch(5, 10)
+        writer.write({field: columns[field] for field in columns.dtype.names})
+        writer.write(batch(0))
+    header, events = read_listmode(name, mmap=mmap)
+    assert header['events'] == 15
+    assert header['config'] == {'captures': 100}
+    assert header['gain'] == 2.5
+    assert 'start' in header and 'stop' in header
+    assert events.dtype == numpy.dtype(DTYPE)
+    assert numpy.array_equal(events, batch(15))
+
+
+def test_close_info(tmp_path):
+    name = str(tmp_path / 'run.lmd')
+    writer = ListModeWriter(name, DTYPE)
+    writer.write(batch(3))
+    writer.close({'live_time': 12.5})
+    writer.close()
+    header, offset = read_header(name)
+    assert header['live_time'] == 12.5
+    assert offset == os.path.getsize(name) - 3 * numpy.dtype(DTYPE).itemsize
+
+
+def test_truncated_file(tmp_path):
+    name = str(tmp_path / 'run.lmd')
+    writer = ListModeWriter(name, DTYPE)
+    writer.write(batch(8))
+    writer.close()
+    itemsize = numpy.dtype(DTYPE).itemsize
+    # A crash in the middle of the last record
+    with open(name, 'r+b') as f:
+        f.truncate(os.path.getsize(name) - itemsize // 2)
+    for mmap in [True, False]:
+        header, events = read_listmode(name, mmap=mmap)
+        assert numpy.array_equal(events, batch(7))
+
+
+def test_file_not_closed(tmp_path):
+    # The records are flushed batch by batch, the header has no stop time
+    name = str(tmp_path / 'run.lmd')
+    writer = ListModeWriter(name, DTYPE)
+    writer.write(batch(4))
+    writer.write(batch(4, 4))
+    writer._queue.put(None)
+    writer._thread.join()
+    header, events = read_listmode(name)
+    assert 'stop' not in header
+    assert numpy.array_equal(events, batch(8))
+    writer._file.close()
+
+
+def test_empty_and_invalid_files(tmp_path):
+    name = str(tmp_path / 'run.lmd')
+    ListModeWriter(name, DTYPE).close()
+    header, events = read_listmode(name)
+    assert events.shape == (0,)
+    assert header['events'] == 0
+    other = tmp_path / 'other.lmd'
+    other.write_bytes(b'NOPE' + bytes(100))
+    with pytest.raises(ValueError):
+        read_listmode(str(other))
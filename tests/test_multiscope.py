@@ -0,0 +1,80 @@
+import threading
+import time
+
+import numpy
+import pytest
+
+from PicoNuclear.multiscope import ScopeGroup
+from PicoNuclear.simulator import SimulatedPicoScope
+
+
+def make_scope(seed, **kwargs):
+    s = SimulatedPicoScope(seed=seed, **kwargs)
+    for ch in ['A', 'B']:
+        s.set_channel(ch, range_value=1)
+    s.set_trigger('A')
+    return s
+
+
+def test_batch_from_every_device():
+    group = ScopeGroup([make_scope(1), make_scope(2)])
+    assert len(group) == 2
+    data, times = group.measure_adc_values(20, 80, num_captures=30)
+    assert len(data) == 2 and len(times) == 2
+    for values, t in zip(data, times):
+        assert values[0].shape == (30, 100)
+        assert t.dtype == numpy.int64
+        assert (numpy.diff(t) > 0).all()
+        # Shifted by the arming time of the device only, well below 1 s
+        assert 0 <= t[0] < 10**12
+    group.close()
+
+
+def test_devices_on_common_timeline():
+    # Devices with the same seed see the same triggers, on the common
+    # timeline their times differ only by a constant (arming time and
+    # the time offset of the device)
+    group = ScopeGroup([make_scope(3), make_scope(3)])
+    group.time_offsets = [0, 5 * 10**9]
+    data, times = group.measure_adc_values(20, 80, num_captures=50)
+    shift = times[1] - times[0]
+    assert (shift == shift[0]).all()
+    assert abs(shift[0] - 5 * 10**9) < 10**11
+    assert numpy.array_equal(data[0][0], data[1][0])
+
+
+def test_continuous_acquisition():
+    group = ScopeGroup([make_scope(4, rate=5000, realtime=True),
+                        make_scope(5, rate=5000, realtime=True)])
+    group.time_offsets = [0, 10**12]
+    lock = threading.Lock()
+    batches = {0: [], 1: []}
+
+    def consumer(index, data, trigger_times):
+        with lock:
+            batches[index].append(trigger_times.copy())
+
+    group.start(consumer, 20, 80, num_captures=20)
+    time.sleep(0.3)
+    group.stop()
+    for index, times in batches.items():
+        assert len(times) >= 3
+        times = numpy.concatenate(times)
+        # Batches of a device follow each other on the timeline
+        assert (numpy.diff(times) > 0).all()
+        assert times[0] >= index * 10**12
+    group.close()
+
+
+def test_consumer_error_raised_in_stop():
+    group = ScopeGroup([make_scope(6), make_scope(7)])
+
+    def consumer(index, data, trigger_times):
+        if index == 1:
+            raise RuntimeError('consumer failed')
+
+    group.start(consumer, 20, 80, num_captures=10)
+    time.sleep(0.05)
+    with pytest.raises(RuntimeError):
+        group.stop()
+    group.close()
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import numpy
+
+from PicoNuclear.pipeline import PipelinedAcquisition
+from PicoNuclear.simulator import SimulatedPicoScope
+
+
+class CheckedScope(SimulatedPicoScope):
+    """Simulated device failing if buffers are swapped during a run"""
+
+    running = False
+    swaps = 0
+
+    def start_run(self, *args, **kwargs):
+        self.running = True
+        super().start_run(*args, **kwargs)
+
+    def stop(self):
+        self.running = False
+        super().stop()
+
+    def swap_buffers(self, buffers):
+        assert not self.running
+        self.swaps += 1
+        super().swap_buffers(buffers)
+
+
+def make_scope():
+    s = CheckedScope(seed=2, rate=1e5)
+    for ch in ['A', 'B']:
+        s.set_channel(ch)
+    return s
+
+
+def run_pipeline(scope, consumer, batches, **kwargs):
+    done = threading.Event()
+
+    def count(*args):
+        consumer(*args)
+        if pipeline.batches_processed + 1 >= batches:
+            done.set()
+
+    pipeline = PipelinedAcquisition(scope, count, 20, 80, num_captures=8,
+                                    **kwargs)
+    pipeline.start()
+    assert done.wait(30)
+    pipeline.stop()
+    return pipeline
+
+
+def test_pipeline_batches():
+    scope = make_scope()
+    seen = []
+
+    def consumer(data, trigger_times):
+        A, B = data
+        assert A.shape == (8, 100) and B.shape == (8, 100)
+        assert trigger_times.shape == (8,)
+        seen.append((id(A), A.copy(), trigger_times[0]))
+
+    pipeline = run_pipeline(scope, consumer, 10, num_buffers=3,
+                            trigger_times=True)
+    assert pipeline.batches_processed == pipeline.batches_acquired
+    assert pipeline.batches_processed >= 10
+    # Buffer sets are used in turn
+    assert len({buffer_id for buffer_id, data, t in seen}) == 3
+    # Each batch is new data, trigger times grow with the runs
+    assert not numpy.array_equal(seen[0][1], seen[1][1])
+    times = [t for buffer_id, data, t in seen]
+    assert times == sorted(times)
+    # Driver buffers are registered once, before the first run
+    assert scope.swaps == 1
+    assert 0 < pipeline.rearm_time < pipeline.elapsed_time
+    assert pipeline.duty_cycle + pipeline.dead_time == 1.0
+
+
+def test_pipeline_consumer_error():
+    scope = make_scope()
+
+    def consumer(data):
+        raise RuntimeError('consumer failed')
+
+    pipeline = PipelinedAcquisition(scope, consumer, 20, 80, num_captures=4)
+    pipeline.start()
+    time.sleep(0.2)
+    try:
+        pipeline.stop()
+    except RuntimeError as err:
+        assert str(err) == 'consumer failed'
+    else:
+        raise AssertionError('Consumer error was not raised')
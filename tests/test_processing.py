@@ -0,0 +1,55 @@
+import numpy
+import pytest
+
+from PicoNuclear.processing import ProcessingPool
+
+
+CONFIG = {ch: {'filter': {'method': 'max', 'B': 8, 'L': 20, 'G': 5,
+                          'tau': 1000.0, 'threshold': 0.01}}
+          for ch in 'ABCD'}
+
+
+def block(num_captures, num_samples=128, amplitude=1000):
+    V = numpy.zeros((num_captures, num_samples), dtype=numpy.int16)
+    V[:, num_samples // 2:] = -amplitude
+    return V
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with ProcessingPool(CONFIG, 4.0, 128, 16, channels=('A', 'B', 'C', 'D'),
+                        num_workers=1, num_slots=2, policy='block') as pool:
+        yield pool
+
+
+def test_disabled_channels_are_skipped(pool):
+    assert pool.submit([block(5), None, block(5, amplitude=200), None],
+                       tag=1)
+    tag, hits = pool.get(timeout=60)
+    assert tag == 1
+    assert hits.shape[0] == 10
+    assert set(hits['channel']) == {0, 2}
+    numpy.testing.assert_allclose(hits['amplitude'][hits['channel'] == 2],
+                                  200)
+
+
+def test_channels_by_name(pool):
+    assert pool.submit({'D': block(3)}, tag=2)
+    tag, hits = pool.get(timeout=60)
+    assert tag == 2
+    assert list(hits['channel']) == [3, 3, 3]
+
+
+def test_block_larger_than_slot(pool):
+    with pytest.raises(ValueError):
+        pool.submit([block(17), block(17)])
+    with pytest.raises(ValueError):
+        pool.submit([block(4, num_samples=256)])
+    assert len(pool.results()) == 0
+    assert pool.pending == 0
+
+
+def test_get_without_pending_blocks(pool):
+    assert pool.pending == 0
+    with pytest.raises(RuntimeError):
+        pool.get()
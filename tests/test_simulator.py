@@ -0,0 +1,40 @@
+from PicoNuclear.simulator import SimulatedPicoScope
+
+
+def make_scope(**kwargs):
+    s = SimulatedPicoScope(seed=1, **kwargs)
+    for ch in ['A', 'B']:
+        s.set_channel(ch, range_value=1)
+        s.set_source(ch, background=0.0, pileup=0.0)
+    return s
+
+
+def pulses(values):
+    # Pulses are negative, at least 0.5 V high (noise is a few mV)
+    return values.min(axis=1) < -0.25 * 32512
+
+
+def test_or_trigger_source_per_capture():
+    s = make_scope(coincidence=0.0)
+    s.set_advanced_trigger({'A': 0.1, 'B': 0.1}, logic='OR')
+    A, B = s.measure_adc_values(50, 200, num_captures=200)
+    a = pulses(A)
+    b = pulses(B)
+    # Exactly one channel triggered each capture, both channels did
+    assert (a ^ b).all()
+    assert 50 < a.sum() < 150
+
+
+def test_and_trigger_has_all_sources():
+    s = make_scope(coincidence=0.0)
+    s.set_advanced_trigger({'A': 0.1, 'B': 0.1}, logic='AND')
+    A, B = s.measure_adc_values(50, 200, num_captures=100)
+    assert pulses(A).all() and pulses(B).all()
+
+
+def test_single_trigger_coincidence():
+    s = make_scope(coincidence=0.0)
+    s.set_trigger('B')
+    A, B = s.measure_adc_values(50, 200, num_captures=100)
+    assert pulses(B).all()
+    assert not pulses(A).any()
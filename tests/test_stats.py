@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from PicoNuclear.simulator import SimulatedPicoScope
+from PicoNuclear.stats import AcquisitionStats
+
+
+def make_scope(**kwargs):
+    s = SimulatedPicoScope(seed=5, **kwargs)
+    for ch in ['A', 'B']:
+        s.set_channel(ch, range_value=1)
+    s.set_trigger('A')
+    return s
+
+
+def test_live_and_dead_time_add_up():
+    s = make_scope(rate=2000, realtime=True)
+    s.stats.reset()
+    for i in range(5):
+        s.measure_adc_values(20, 80, num_captures=20)
+        time.sleep(0.01)
+    summary = s.stats.summary()
+    assert summary['runs'] == 5
+    assert summary['live_time'] > 0
+    # 5 runs of 20 captures at 2000/s take about 50 ms of live time,
+    # the sleeps between them are dead time
+    assert summary['dead_time'] >= 0.04
+    assert (summary['live_time'] + summary['dead_time']
+            == pytest.approx(summary['elapsed_time'], abs=1e-3))
+    assert (summary['dead_time_fraction']
+            == pytest.approx(summary['dead_time'] / summary['elapsed_time'],
+                             abs=1e-3))
+
+
+def test_capture_and_byte_counts():
+    s = make_scope()
+    s.stats.reset()
+    s.measure_adc_values(20, 80, num_captures=30)
+    s.measure_adc_values(50, 50, num_captures=10)
+    assert s.stats.runs == 2
+    assert s.stats.captures == 40
+    assert s.stats.bytes == 2 * 100 * 40 * 2
+    assert s.stats.capture_rate > 0
+    s.stats.reset()
+    assert s.stats.captures == 0 and s.stats.runs == 0
+    assert s.stats.live_time == 0
+
+
+def test_stopped_run_counts_live_time_only():
+    s = make_scope()
+    s.stats.reset()
+    s.start_run(20, 80, num_captures=10)
+    s.stop()
+    assert s.stats.runs == 1
+    assert s.stats.captures == 0
+    # Stop without a run is not counted
+    s.stop()
+    assert s.stats.runs == 1
+
+
+def test_explicit_times():
+    stats = AcquisitionStats()
+    stats.armed(10.0)
+    stats.disarmed(10.25)
+    stats.armed(11.0)
+    stats.disarmed(11.5)
+    assert stats.live_time == pytest.approx(0.75)
+    stats.armed(20.0)
+    stats.disarmed(19.0)
+    assert stats.armed_time == pytest.approx(0.75)
+    assert stats.runs == 3
@@ -0,0 +1,94 @@
+import numpy
+import pytest
+
+import PicoNuclear.tools as tools
+
+
+BACKENDS = ['numpy']
+if tools.numba is not None:
+    BACKENDS.append('numba')
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    previous = tools.get_backend()
+    tools.set_backend(request.param)
+    yield request.param
+    tools.set_backend(previous)
+
+
+def params(L=20, G=5):
+    return {'filter': {'B': 8, 'L': L, 'G': G, 'tau': 1000.0,
+                       'threshold': 0.01}}
+
+
+def pulses(n, N, seed=0):
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(N)
+    V = rng.normal(0, 0.001, (n, N))
+    V[:, N // 4:] -= 0.5 * numpy.exp(-(t[N // 4:] - N // 4) / 1000.0)
+    return V
+
+
+@pytest.mark.parametrize('N', [1, 10, 30, 44])
+def test_trapezoidal_short_trace(backend, N):
+    # Shorter than 2L+G = 45 samples
+    V = pulses(3, N)
+    p = params()
+    A, S, P = tools.trapezoidal_batch(V, p, 4.0)
+    assert S.shape == V.shape
+    for i, v in enumerate(V):
+        a, s, peak = tools.trapezoidal(v, p, 4.0)
+        numpy.testing.assert_allclose(s, S[i], atol=1e-9)
+        numpy.testing.assert_allclose(a[0], A[i], atol=1e-9)
+
+
+def test_trapezoidal_batch_matches_single(backend):
+    V = pulses(4, 512)
+    p = params()
+    A, S, P = tools.trapezoidal_batch(V, p, 4.0)
+    for i, v in enumerate(V):
+        a, s, peak = tools.trapezoidal(v, p, 4.0)
+        numpy.testing.assert_allclose(s, S[i], atol=1e-9)
+        assert peak == P[i]
+
+
+def rising_pulses(n, N=200, seed=3, noise=1e-4):
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(N)
+    t0 = 60 + rng.uniform(0, 1, n)[:, numpy.newaxis]
+    dt = numpy.maximum(t - t0, 0)
+    V = (numpy.exp(-dt / 50.0) - numpy.exp(-dt / 4.0)) * 0.5
+    return V + rng.normal(0, noise, (n, N))
+
+
+@pytest.mark.parametrize('shift', [3, 10])
+def test_zero_crossing_batch_matches_single(backend, shift):
+    V = rising_pulses(20)
+    single = numpy.array([tools.zero_crossing(v, shift=shift, falling=False)
+                          for v in V])
+    assert (single > 0).all()
+    cubic = tools.zero_crossing_batch(V, shift=shift, falling=False)
+    linear = tools.zero_crossing_batch(V, shift=shift, falling=False,
+                                       method='linear')
+    numpy.testing.assert_allclose(cubic, single, atol=0.05)
+    numpy.testing.assert_allclose(linear, single, atol=0.5)
+
+
+def test_zero_crossing_zero_shift(backend):
+    # Degenerate, but handled as by zero_crossing()
+    V = rising_pulses(5)
+    for method in ['cubic', 'linear']:
+        T = tools.zero_crossing_batch(V, shift=0, falling=False,
+                                      method=method)
+        assert T.shape == (5,) and numpy.isfinite(T).all()
+    assert numpy.isfinite(tools.zero_crossing(V[0], shift=0, falling=False))
+
+
+def test_zero_crossing_not_found(backend):
+    V = numpy.zeros((3, 100))
+    V[1] = 0.5
+    for method in ['cubic', 'linear']:
+        T = tools.zero_crossing_batch(V, falling=False, method=method)
+        assert (T == 0).all()
+    assert tools.zero_crossing(V[0], falling=False) == 0